@@ -1,6 +1,37 @@
-from flask import Flask, render_template, request, redirect, url_for, make_response  # Added make_response
-from flask_mysqldb import MySQL
-import MySQLdb.cursors
+from flask import Flask, render_template, request, redirect, url_for, make_response, Response, jsonify, send_file, stream_template, stream_with_context, g
+import attendance_analytics
+import attendance_summary
+from attendance_queue import AttendanceQueue, apply_batch, new_mark, prune_applied
+import change_log
+import click
+from compression import compress_response
+import enrollment_counts
+import metrics
+import migrations
+from csv_import import IMPORT_SPECS, import_rows, read_csv
+from db_pool import PooledMySQL, PoolExhausted
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import escape
+from refdata_cache import ReferenceCache
+from schedule_cache import ScheduleCache, slot_times, to_ical, week_schedule
+from storage import DATABASE_ERRORS, OPERATIONAL_ERRORS, DictCursor, SSCursor, SSDictCursor, acquire_lock, release_lock
+from table_versions import TableVersions
+from timetable_conflicts import TimetableIndex, describe_conflict, format_minutes, normalize_day, slots_overlap, to_minutes
+from timetable_solver import TimetableProblem, sessions_for_hours, solve_parallel
+import csv
+import functools
+import io
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+try:
+    from openpyxl import Workbook  # Optional, only needed for .xlsx exports
+except ImportError:
+    Workbook = None
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -11,8 +42,358 @@ app.config['MYSQL_USER'] = 'root'  # Default MySQL username in XAMPP
 app.config['MYSQL_PASSWORD'] = ''  # Default password for MySQL in XAMPP
 app.config['MYSQL_DB'] = 'timetable_attendance'  # Database name
 
-# Initialize MySQL
-mysql = MySQL(app)
+# Storage backend: 'mysql' (the server above) or 'sqlite' (an embedded database file in WAL
+# mode at SQLITE_PATH, for single-node deployments without a MySQL server; see storage.py)
+app.config['DATABASE_BACKEND'] = os.environ.get('DATABASE_BACKEND', 'mysql')
+app.config['SQLITE_PATH'] = os.path.join(app.root_path, 'timetable_attendance.db')
+
+# Connection pool settings (per worker process)
+app.config['MYSQL_POOL_MIN_SIZE'] = 2  # Connections opened up front
+app.config['MYSQL_POOL_MAX_SIZE'] = 10  # Keep workers x this below MySQL's max_connections
+app.config['MYSQL_POOL_TIMEOUT'] = 5  # Seconds a request waits for a free connection
+app.config['MYSQL_POOL_RECYCLE'] = 3600  # Seconds before a connection is replaced (below wait_timeout)
+app.config['MYSQL_POOL_PING'] = True  # Check each connection when it is checked out
+
+# Seconds a worker trusts its in-memory timetable index before reloading it from the database,
+# so timetable changes made by other worker processes are picked up
+app.config['TIMETABLE_INDEX_TTL'] = 30
+
+# Seconds cached reference data (departments, courses, faculty, ...) is trusted before it is
+# re-read; writes through this worker invalidate it straight away
+app.config['REFDATA_CACHE_TTL'] = 60
+
+# Seconds an ETag of a list page stays valid at most, bounding how long a page changed outside
+# the app (directly in the database) can still be answered with 304
+app.config['ETAG_MAX_AGE'] = 30
+
+# Write-behind attendance ingestion (see attendance_queue.py): add/update attendance append the
+# mark to a local log and return at once, and a background thread writes the log to MySQL in
+# batches of ATTENDANCE_QUEUE_BATCH marks at least every ATTENDANCE_QUEUE_INTERVAL seconds
+app.config['ATTENDANCE_WRITE_BEHIND'] = False
+app.config['ATTENDANCE_QUEUE_PATH'] = os.path.join(app.root_path, 'attendance_queue.log')
+app.config['ATTENDANCE_QUEUE_BATCH'] = 500
+app.config['ATTENDANCE_QUEUE_INTERVAL'] = 1.0
+
+# Seconds a cached student/teacher weekly timetable is trusted; changes made through this
+# worker invalidate the affected timetables straight away
+app.config['SCHEDULE_CACHE_TTL'] = 300
+
+# Seconds a student lookup (assigned courses, enrollments, attendance totals) is cached;
+# enrollment, assignment and student changes made through this worker drop it straight away,
+# new attendance marks show up within this time
+app.config['STUDENT_PROFILE_CACHE_TTL'] = 30
+
+# Seconds the timetable generator may search before giving up, and the processes it searches
+# with. One generation runs at a time across every worker process sharing the database (an
+# advisory lock, see storage.acquire_lock), so the solver never uses more than
+# TIMETABLE_SOLVER_WORKERS cores in total; a second request meanwhile gets 503.
+app.config['TIMETABLE_SOLVER_TIME_LIMIT'] = 50
+app.config['TIMETABLE_SOLVER_WORKERS'] = max(1, (os.cpu_count() or 1) // 2)
+
+# Hours of the day the free-slot finder searches unless asked otherwise
+app.config['TIMETABLE_FINDER_HOURS'] = ('08:00', '18:00')
+
+# Fraction of requests (and list-page debug events) written to the structured log; requests
+# slower than SLOW_REQUEST_SECONDS are always logged
+app.config['LOG_SAMPLE_RATE'] = 0.01
+app.config['SLOW_REQUEST_SECONDS'] = 1.0
+
+# Seconds the change feed waits for a missing ChangeID (a transaction still open, or rolled
+# back) before serving the changes after it; see change_log.py. Keep it above the longest a
+# write transaction stays open after recording its changes, e.g. a large CSV import.
+app.config['CHANGE_FEED_SETTLE_SECONDS'] = change_log.SETTLE_SECONDS
+
+# Directory of the compiled-template cache shared by the worker processes
+app.config['JINJA_BYTECODE_CACHE_DIR'] = os.path.join(app.root_path, '.jinja_cache')
+
+# Text responses of at least COMPRESS_MIN_SIZE bytes are sent gzip/brotli compressed at
+# COMPRESS_LEVEL (streamed ones always, chunk by chunk)
+app.config['COMPRESS_MIN_SIZE'] = 500
+app.config['COMPRESS_LEVEL'] = 6
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(message)s')
+
+# Compiled templates are kept on disk, so a new worker loads their bytecode instead of
+# compiling every template again; a changed template gets a new checksum and is recompiled
+os.makedirs(app.config['JINJA_BYTECODE_CACHE_DIR'], exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['JINJA_BYTECODE_CACHE_DIR'])
+
+# Initialize MySQL (pooled; routes use mysql.connection as before)
+mysql = PooledMySQL(app)
+
+# Number of rows shown per page on the paginated list pages
+PAGE_SIZE = 50
+
+# Number of rows pulled from the server-side cursor per chunk when exporting
+EXPORT_CHUNK_ROWS = 1000
+
+# Bytes of rendered HTML collected before a streamed page sends a chunk
+STREAM_CHUNK_BYTES = 8192
+
+# Answer with 503 instead of a stack trace when every pooled connection stays busy
+@app.errorhandler(PoolExhausted)
+def pool_exhausted(e):
+    print(f"Database pool exhausted: {e}")
+    return "Error: The server is busy, please try again.", 503
+
+# Route to expose the connection pool counters
+@app.route('/pool/stats')
+def pool_stats():
+    return jsonify(mysql.pool.stats())
+
+# -------------------- Metrics --------------------
+
+# SQL counters of the current request; the connection wrapper below feeds them
+def request_query_stats():
+    if 'query_stats' not in g:
+        g.query_stats = metrics.QueryStats()
+    return g.query_stats
+
+mysql.wrap_connection = lambda conn: metrics.InstrumentedConnection(conn, request_query_stats())
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+# Record a finished request in the metrics and, sampled, in the structured log
+def finish_request(endpoint, method, status, started, stats):
+    seconds = time.perf_counter() - started
+    metrics.observe_request(endpoint, method, status, seconds, stats)
+    metrics.log_sampled(
+        'request', app.config['LOG_SAMPLE_RATE'], force=seconds >= app.config['SLOW_REQUEST_SECONDS'],
+        endpoint=endpoint, method=method, status=status, ms=round(seconds * 1000, 1),
+        sql_statements=stats.statements, sql_ms=round(stats.seconds * 1000, 1), rows=stats.rows
+    )
+
+# Streamed responses (exports) do their SQL after teardown has run, so they are recorded when
+# the server closes the response instead
+@app.after_request
+def remember_response_status(response):
+    g.response_status = response.status_code
+    if response.is_streamed and g.get('request_started') is not None:
+        args = (request.endpoint or 'unmatched', request.method, response.status_code,
+                g.pop('request_started'), request_query_stats())
+        response.call_on_close(lambda: finish_request(*args))
+    return response
+
+@app.teardown_request
+def record_request_metrics(exception):
+    started = g.pop('request_started', None)
+    if started is None:
+        return
+    status = g.get('response_status', 500 if exception else 200)
+    finish_request(request.endpoint or 'unmatched', request.method, status, started, request_query_stats())
+
+# Route to expose request, SQL, pool and cache metrics in the Prometheus text format
+@app.route('/metrics')
+def prometheus_metrics():
+    extra = metrics.render_gauges('db_pool', mysql.pool.stats(), 'Connection pool counter')
+    extra += metrics.render_gauges('refdata_cache', refdata_cache.stats(), 'Reference data cache counter')
+    if app.config['ATTENDANCE_WRITE_BEHIND']:
+        extra += metrics.render_gauges('attendance_queue', attendance_queue().stats(), 'Write-behind attendance queue')
+    return Response(metrics.render(extra), mimetype='text/plain; version=0.0.4')
+
+# -------------------- Compression --------------------
+
+@app.after_request
+def compress(response):
+    return compress_response(response, request.accept_encodings, app.config['COMPRESS_MIN_SIZE'],
+                             app.config['COMPRESS_LEVEL'])
+
+# -------------------- Reference Data Cache --------------------
+
+refdata_cache = ReferenceCache(app.config['REFDATA_CACHE_TTL'])
+
+# Run a reference-data query (dropdown contents and the like) through the cache.
+# The tables it depends on are taken from its FROM/JOIN clauses.
+def ref_data(query, dict_rows=True):
+    def load():
+        cur = mysql.connection.cursor(DictCursor) if dict_rows else mysql.connection.cursor()
+        cur.execute(query)
+        rows = cur.fetchall()
+        cur.close()
+        return rows
+    tables = re.findall(r'\b(?:FROM|JOIN)\s+(\w+)', query)
+    return refdata_cache.get((query, dict_rows), tables, load)
+
+# Called by every route after it commits a write to `tables` (and by the attendance queue's
+# flush, on the connection it wrote with). The write has already committed, so a failed
+# version bump is only logged: pages of those tables may answer 304 until the ETag expires.
+def tables_changed(*tables, connection=None):
+    connection = connection or mysql.connection
+    try:
+        table_versions.bump(connection, tables)
+    except DATABASE_ERRORS as e:
+        connection.rollback()
+        metrics.logger.warning("Could not bump the versions of %s: %s", ', '.join(tables), e)
+    refdata_cache.invalidate(*tables)
+    # Course and teacher names appear in every weekly timetable; timetable and assignment
+    # writes invalidate just the affected ones where they happen
+    if 'courses' in tables or 'faculty' in tables:
+        schedule_cache.clear()
+    # Names shown on every student lookup
+    if set(tables) & {'courses', 'semesters', 'sessions', 'offered_programs', 'current_semester'}:
+        profile_cache.clear()
+
+# Route to expose the reference-data cache counters
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify(refdata_cache.stats())
+
+# -------------------- Conditional GET --------------------
+
+table_versions = TableVersions(app.config['ETAG_MAX_AGE'])
+
+# Decorator for GET pages that only depend on `tables`: the ETag is built from their version
+# counters (bumped in the database after every write, see table_versions.py), and a matching
+# If-None-Match is answered with 304 before the view runs, so only the version lookup touches
+# the database and Jinja is not touched at all.
+def conditional_get(*tables):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET':
+                return view(*args, **kwargs)
+            etag = table_versions.etag(mysql.connection, tables, request.full_path)
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            # Browsers must revalidate every time, which is what makes the 304s safe
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
+
+# -------------------- Keyset Pagination --------------------
+
+# Encode the ordering key of a row into an opaque page cursor for the query string
+def encode_cursor(row, keys):
+    return ','.join(str(row[key]) for _, key in keys)
+
+# Decode a page cursor back into its key values (None if missing or malformed)
+def decode_cursor(value, key_count):
+    if not value:
+        return None
+    values = value.split(',')
+    if len(values) != key_count:
+        return None
+    return values
+
+# Build the "row comes after the cursor" condition, e.g. (a < x OR (a = x AND b < y)).
+# Written out in full rather than as a row constructor so MySQL can use the index range.
+def keyset_condition(keys, values, op):
+    clauses = []
+    params = []
+    for i, (column, _) in enumerate(keys):
+        parts = [f"{c} = %s" for c, _ in keys[:i]] + [f"{column} {op} %s"]
+        clauses.append("(" + " AND ".join(parts) + ")")
+        params.extend(values[:i])
+        params.append(values[i])
+    return "(" + " OR ".join(clauses) + ")", params
+
+# The page query for the `after`/`before` cursor in the query string.
+# Returns (sql, params, decoded cursor, whether the page is read backwards).
+def keyset_query(select_sql, where_clauses, params, keys, descending, page_size):
+    after = request.args.get('after')
+    before = request.args.get('before')
+    cursor = decode_cursor(after or before, len(keys))
+    backwards = cursor is not None and not after
+
+    where_clauses = list(where_clauses)
+    params = list(params)
+    if cursor is not None:
+        # "after" continues in listing order, "before" walks back towards the first page
+        op = '<' if descending != backwards else '>'
+        clause, clause_params = keyset_condition(keys, cursor, op)
+        where_clauses.append(clause)
+        params.extend(clause_params)
+
+    direction = 'DESC' if descending != backwards else 'ASC'
+    where_sql = "WHERE " + " AND ".join(where_clauses) if where_clauses else ""
+    order_sql = ", ".join(f"{column} {direction}" for column, _ in keys)
+    return f"{select_sql} {where_sql} ORDER BY {order_sql} LIMIT %s", tuple(params) + (page_size + 1,), cursor, backwards
+
+# Fetch one page of a list query using keyset (seek) pagination.
+# `keys` is a list of (column, result key) pairs that uniquely orders the rows. The position
+# comes from the `after`/`before` query-string cursors, so every page is a bounded index range
+# read no matter how deep the user has paged, instead of fetching the whole table.
+def fetch_keyset_page(cur, select_sql, where_clauses, params, keys, descending=False, page_size=PAGE_SIZE):
+    query, params, cursor, backwards = keyset_query(select_sql, where_clauses, params, keys, descending, page_size)
+    cur.execute(query, params)
+    rows = list(cur.fetchall())
+
+    # One extra row tells us whether there is another page in the scan direction
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if backwards:
+        rows.reverse()
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = cursor is not None, has_more
+    page = {
+        'prev': encode_cursor(rows[0], keys) if rows and has_prev else None,
+        'next': encode_cursor(rows[-1], keys) if rows and has_next else None,
+    }
+    return rows, page
+
+# Like fetch_keyset_page, but the rows are generated from an unbuffered cursor while the page
+# renders. The page links are filled in once the rows have been read, which is why the list
+# templates put them after the rows. A page read backwards is reversed, so it is fetched whole.
+def stream_keyset_page(select_sql, where_clauses, params, keys, descending=False, page_size=PAGE_SIZE):
+    page = {'prev': None, 'next': None}
+
+    def rows():
+        query, query_params, cursor, backwards = keyset_query(select_sql, where_clauses, params, keys, descending, page_size)
+        if backwards:
+            cur = mysql.connection.cursor(DictCursor)
+            try:
+                page_rows, result = fetch_keyset_page(cur, select_sql, where_clauses, params, keys, descending, page_size)
+            finally:
+                cur.close()
+            page.update(result)
+            yield from page_rows
+            return
+        cur = mysql.connection.cursor(SSDictCursor)
+        try:
+            cur.execute(query, query_params)
+            count = 0
+            last = None
+            for row in cur:
+                if count == page_size:
+                    # The extra row: there is a next page
+                    page['next'] = encode_cursor(last, keys)
+                    break
+                if count == 0 and cursor is not None:
+                    page['prev'] = encode_cursor(row, keys)
+                count += 1
+                last = row
+                yield row
+        finally:
+            cur.close()
+
+    return rows(), page
+
+# Collect the pieces Jinja renders into chunks of about STREAM_CHUNK_BYTES
+def chunked(pieces):
+    buffer = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= STREAM_CHUNK_BYTES:
+            yield "".join(buffer)
+            buffer = []
+            size = 0
+    yield "".join(buffer)
+
+# Render a template as a streamed response: the top of the page goes out before the rows have
+# been read, and only one chunk of HTML is held at a time
+def stream_page(template_name, **context):
+    return Response(stream_with_context(chunked(stream_template(template_name, **context))), mimetype='text/html')
 
 # Home route - Redirect to dashboard
 @app.route('/')
@@ -27,18 +408,73 @@ def index():
 # Route for the dashboard
 @app.route('/dashboard')
 def dashboard():
-    return render_template('dashboard.html')
+    totals = enrollment_counts.totals(mysql.connection)
+    return render_template('dashboard.html', totals=totals)
+
+# -------------------- Exports --------------------
+
+# Generate the rows of a query from an unbuffered server-side cursor, chunk by chunk,
+# so an export never holds more than EXPORT_CHUNK_ROWS rows in memory.
+def iter_export_rows(query, params):
+    cur = mysql.connection.cursor(SSCursor)
+    try:
+        cur.execute(query, params)
+        yield [column[0] for column in cur.description]
+        while True:
+            rows = cur.fetchmany(EXPORT_CHUNK_ROWS)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        cur.close()
+
+# Stream rows out as CSV text, one chunk per fetch so the first bytes leave immediately
+def generate_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for i, row in enumerate(rows):
+        writer.writerow(row)
+        # The header goes out on its own, then one chunk per EXPORT_CHUNK_ROWS rows
+        if i % EXPORT_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+    yield buffer.getvalue()
+
+# Build the download response for an export in the requested format ('csv' or 'xlsx')
+def export_response(query, params, fmt, name):
+    if fmt == 'csv':
+        return Response(
+            stream_with_context(generate_csv(iter_export_rows(query, params))),
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename={name}.csv'}
+        )
+    if fmt == 'xlsx':
+        if Workbook is None:
+            return "Error: XLSX export requires the openpyxl package.", 501
+        # XLSX is a zip archive, so it cannot be streamed; write-only mode still keeps memory flat
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet(name)
+        for row in iter_export_rows(query, params):
+            sheet.append(list(row))
+        output = tempfile.TemporaryFile()
+        workbook.save(output)
+        output.seek(0)
+        return send_file(output, as_attachment=True, download_name=f'{name}.xlsx',
+                         mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    return "Error: Unsupported export format.", 404
 
 # -------------------- Departments --------------------
 
 # Route to list departments
 @app.route('/departments')
+@conditional_get('departments')
 def list_departments():
     cur = mysql.connection.cursor()
     cur.execute("SELECT * FROM departments")
     departments = cur.fetchall()
     cur.close()
-    print(f"Fetched departments: {departments}")  # Debugging log
+    metrics.log_sampled('departments_listed', app.config['LOG_SAMPLE_RATE'], count=len(departments))
     return render_template('departments/list_departments.html', departments=departments)
 
 # Route to add a new department
@@ -48,7 +484,9 @@ def add_department():
         department_name = request.form['DepartmentName']
         cur = mysql.connection.cursor()
         cur.execute("INSERT INTO departments (DepartmentName) VALUES (%s)", (department_name,))
+        change_log.record(mysql.connection, 'departments', 'insert', [cur.lastrowid])
         mysql.connection.commit()
+        tables_changed('departments')
         cur.close()
         return redirect(url_for('list_departments'))  # Redirect to the department list after adding
     return render_template('departments/add_department.html')
@@ -62,7 +500,9 @@ def update_department(id):
     if request.method == 'POST':
         department_name = request.form['DepartmentName']
         cur.execute("UPDATE departments SET DepartmentName = %s WHERE DepartmentID = %s", (department_name, id))
+        change_log.record(mysql.connection, 'departments', 'update', [id])
         mysql.connection.commit()
+        tables_changed('departments')
         cur.close()
         return redirect(url_for('list_departments'))
     cur.close()
@@ -87,7 +527,9 @@ def delete_department(id):
 
         # Delete the department
         cur.execute("DELETE FROM departments WHERE DepartmentID = %s", (id,))
+        change_log.record(mysql.connection, 'departments', 'delete', [id])
         mysql.connection.commit()
+        tables_changed('departments')
         cur.close()
         return redirect(url_for('list_departments'))  # Redirect to the department list after deletion
     except Exception as e:
@@ -98,6 +540,7 @@ def delete_department(id):
 
 # Route to list faculty
 @app.route('/faculty')
+@conditional_get('faculty', 'departments')
 def list_faculty():
     cur = mysql.connection.cursor()
     cur.execute("SELECT f.FacultyID, f.FirstName, f.LastName, f.Email, d.DepartmentName FROM faculty f LEFT JOIN departments d ON f.DepartmentID = d.DepartmentID")
@@ -108,10 +551,7 @@ def list_faculty():
 # Route to add a new faculty
 @app.route('/faculty/add', methods=['GET', 'POST'])
 def add_faculty():
-    cur = mysql.connection.cursor()
-    cur.execute("SELECT * FROM departments")
-    departments = cur.fetchall()
-    cur.close()
+    departments = ref_data("SELECT * FROM departments", dict_rows=False)
     if request.method == 'POST':
         first_name = request.form['FirstName']
         last_name = request.form['LastName']
@@ -119,7 +559,9 @@ def add_faculty():
         department_id = request.form['DepartmentID']
         cur = mysql.connection.cursor()
         cur.execute("INSERT INTO faculty (FirstName, LastName, Email, DepartmentID) VALUES (%s, %s, %s, %s)", (first_name, last_name, email, department_id))
+        change_log.record(mysql.connection, 'faculty', 'insert', [cur.lastrowid])
         mysql.connection.commit()
+        tables_changed('faculty')
         cur.close()
         return redirect(url_for('list_faculty'))
     return render_template('faculty/add_faculty.html', departments=departments)
@@ -130,8 +572,7 @@ def update_faculty(id):
     cur = mysql.connection.cursor()
     cur.execute("SELECT * FROM faculty WHERE FacultyID = %s", (id,))
     faculty = cur.fetchone()
-    cur.execute("SELECT * FROM departments")
-    departments = cur.fetchall()
+    departments = ref_data("SELECT * FROM departments", dict_rows=False)
     cur.close()
     if request.method == 'POST':
         first_name = request.form['FirstName']
@@ -140,7 +581,9 @@ def update_faculty(id):
         department_id = request.form['DepartmentID']
         cur = mysql.connection.cursor()
         cur.execute("UPDATE faculty SET FirstName = %s, LastName = %s, Email = %s, DepartmentID = %s WHERE FacultyID = %s", (first_name, last_name, email, department_id, id))
+        change_log.record(mysql.connection, 'faculty', 'update', [id])
         mysql.connection.commit()
+        tables_changed('faculty')
         cur.close()
         return redirect(url_for('list_faculty'))
     return render_template('faculty/update_faculty.html', faculty=faculty, departments=departments)
@@ -151,7 +594,9 @@ def delete_faculty(id):
     try:
         cur = mysql.connection.cursor()
         cur.execute("DELETE FROM faculty WHERE FacultyID = %s", (id,))
+        change_log.record(mysql.connection, 'faculty', 'delete', [id])
         mysql.connection.commit()
+        tables_changed('faculty')
         cur.close()
         return redirect(url_for('list_faculty'))
     except Exception as e:
@@ -162,8 +607,9 @@ def delete_faculty(id):
 
 # Route to list courses
 @app.route('/courses')
+@conditional_get('courses', 'departments', 'faculty')
 def list_courses():
-    cur = mysql.connection.cursor(MySQLdb.cursors.DictCursor)  # Use DictCursor
+    cur = mysql.connection.cursor(DictCursor)  # Use DictCursor
     cur.execute("SELECT c.CourseID, c.CourseName, d.DepartmentName, f.FirstName, f.LastName FROM courses c LEFT JOIN departments d ON c.DepartmentID = d.DepartmentID LEFT JOIN faculty f ON c.FacultyID = f.FacultyID")
     courses = cur.fetchall()
     cur.close()
@@ -179,7 +625,9 @@ def add_course():
             faculty_id = request.form['FacultyID']
             cur = mysql.connection.cursor()
             cur.execute("INSERT INTO courses (CourseName, DepartmentID, FacultyID) VALUES (%s, %s, %s)", (course_name, department_id, faculty_id))
+            change_log.record(mysql.connection, 'courses', 'insert', [cur.lastrowid])
             mysql.connection.commit()
+            tables_changed('courses')
             cur.close()
             return redirect(url_for('list_courses'))  # Redirect to the course list after adding
         except Exception as e:
@@ -187,24 +635,18 @@ def add_course():
             return "An error occurred while adding the course.", 500
 
     # Fetch updated list of departments and faculty
-    cur = mysql.connection.cursor(MySQLdb.cursors.DictCursor)  # Use DictCursor
-    cur.execute("SELECT DepartmentID, DepartmentName FROM departments")
-    departments = cur.fetchall()
-    cur.execute("SELECT FacultyID, FirstName, LastName FROM faculty")
-    faculty = cur.fetchall()
-    cur.close()
+    departments = ref_data("SELECT DepartmentID, DepartmentName FROM departments")
+    faculty = ref_data("SELECT FacultyID, FirstName, LastName FROM faculty")
     return render_template('courses/add_course.html', departments=departments, faculty=faculty)
 
 # Route to update a course
 @app.route('/courses/update/<int:id>', methods=['GET', 'POST'])
 def update_course(id):
-    cur = mysql.connection.cursor(MySQLdb.cursors.DictCursor)  # Use DictCursor
+    cur = mysql.connection.cursor(DictCursor)  # Use DictCursor
     cur.execute("SELECT * FROM courses WHERE CourseID = %s", (id,))
     course = cur.fetchone()
-    cur.execute("SELECT DepartmentID, DepartmentName FROM departments")
-    departments = cur.fetchall()
-    cur.execute("SELECT FacultyID, FirstName, LastName FROM faculty")
-    faculty = cur.fetchall()
+    departments = ref_data("SELECT DepartmentID, DepartmentName FROM departments")
+    faculty = ref_data("SELECT FacultyID, FirstName, LastName FROM faculty")
     cur.close()
     if request.method == 'POST':
         course_name = request.form['CourseName']
@@ -212,7 +654,9 @@ def update_course(id):
         faculty_id = request.form['FacultyID']
         cur = mysql.connection.cursor()
         cur.execute("UPDATE courses SET CourseName = %s, DepartmentID = %s, FacultyID = %s WHERE CourseID = %s", (course_name, department_id, faculty_id, id))
+        change_log.record(mysql.connection, 'courses', 'update', [id])
         mysql.connection.commit()
+        tables_changed('courses')
         cur.close()
         return redirect(url_for('list_courses'))
     return render_template('courses/update_course.html', course=course, departments=departments, faculty=faculty)
@@ -223,7 +667,9 @@ def delete_course(id):
     try:
         cur = mysql.connection.cursor()
         cur.execute("DELETE FROM courses WHERE CourseID = %s", (id,))
+        change_log.record(mysql.connection, 'courses', 'delete', [id])
         mysql.connection.commit()
+        tables_changed('courses')
         cur.close()
         return redirect(url_for('list_courses'))
     except Exception as e:
@@ -233,7 +679,7 @@ def delete_course(id):
 # Route to list enrolled students for a course
 @app.route('/courses/enrolled_students/<int:course_id>')
 def enrolled_students(course_id):
-    cur = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
+    cur = mysql.connection.cursor(DictCursor)
     cur.execute("""
         SELECT s.StudentID, s.FirstName, s.LastName, s.EnrollmentNo, s.Email
         FROM EnrolledStudents es
@@ -251,40 +697,39 @@ def enrolled_students(course_id):
 # Route to list students
 @app.route('/students')
 def list_students():
-    cur = mysql.connection.cursor(MySQLdb.cursors.DictCursor)  # Use DictCursor
-    cur.execute("SELECT s.StudentID, s.FirstName, s.LastName, s.EnrollmentNo, s.Email, d.DepartmentName FROM students s LEFT JOIN departments d ON s.DepartmentID = d.DepartmentID")
-    students = cur.fetchall()
-    cur.close()
-    return render_template('students/list_students.html', students=students)
+    students, page = stream_keyset_page(
+        "SELECT s.StudentID, s.FirstName, s.LastName, s.EnrollmentNo, s.Email, d.DepartmentName FROM students s LEFT JOIN departments d ON s.DepartmentID = d.DepartmentID",
+        [], [], [('s.StudentID', 'StudentID')]
+    )
+    return stream_page('students/list_students.html', students=students, page=page)
 
 # Route to add a new student
 @app.route('/students/add', methods=['GET', 'POST'])
 def add_student():
-    cur = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-    cur.execute("SELECT * FROM departments")
-    departments = cur.fetchall()
-    cur.close()
+    departments = ref_data("SELECT * FROM departments")
     if request.method == 'POST':
         first_name = request.form['FirstName']
         last_name = request.form['LastName']
         enrollment_no = request.form['EnrollmentNo']
         email = request.form['Email']
         department_id = request.form['DepartmentID']
+        program_id = request.form.get('ProgramID') or None  # Offered program (intake) the student belongs to
         cur = mysql.connection.cursor()
-        cur.execute("INSERT INTO students (FirstName, LastName, EnrollmentNo, Email, DepartmentID) VALUES (%s, %s, %s, %s, %s)", (first_name, last_name, enrollment_no, email, department_id))
+        cur.execute("INSERT INTO students (FirstName, LastName, EnrollmentNo, Email, DepartmentID, ProgramID) VALUES (%s, %s, %s, %s, %s, %s)", (first_name, last_name, enrollment_no, email, department_id, program_id))
+        change_log.record(mysql.connection, 'students', 'insert', [cur.lastrowid])
         mysql.connection.commit()
+        tables_changed('students')
         cur.close()
         return redirect(url_for('list_students'))  # Redirect to the student list after adding
-    return render_template('students/add_student.html', departments=departments)
+    return render_template('students/add_student.html', departments=departments, programs=assignable_programs())
 
 # Route to update a student
 @app.route('/students/update/<int:id>', methods=['GET', 'POST'])
 def update_student(id):
-    cur = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
+    cur = mysql.connection.cursor(DictCursor)
     cur.execute("SELECT * FROM students WHERE StudentID = %s", (id,))
     student = cur.fetchone()
-    cur.execute("SELECT * FROM departments")
-    departments = cur.fetchall()
+    departments = ref_data("SELECT * FROM departments")
     cur.close()
     if request.method == 'POST':
         first_name = request.form['FirstName']
@@ -292,16 +737,21 @@ def update_student(id):
         enrollment_no = request.form['EnrollmentNo']
         email = request.form['Email']
         department_id = request.form['DepartmentID']
+        program_id = request.form.get('ProgramID') or None
         cur = mysql.connection.cursor()
         cur.execute("""
             UPDATE students
-            SET FirstName = %s, LastName = %s, EnrollmentNo = %s, Email = %s, DepartmentID = %s
+            SET FirstName = %s, LastName = %s, EnrollmentNo = %s, Email = %s, DepartmentID = %s, ProgramID = %s
             WHERE StudentID = %s
-        """, (first_name, last_name, enrollment_no, email, department_id, id))
+        """, (first_name, last_name, enrollment_no, email, department_id, program_id, id))
+        change_log.record(mysql.connection, 'students', 'update', [id])
         mysql.connection.commit()
+        tables_changed('students')
+        profile_cache.invalidate_owner('student', id)
         cur.close()
         return redirect(url_for('list_students'))
-    return render_template('students/update_student.html', student=student, departments=departments)
+    return render_template('students/update_student.html', student=student, departments=departments,
+                           programs=assignable_programs())
 
 # Route to delete a student
 @app.route('/students/delete/<int:id>', methods=['POST'])
@@ -309,80 +759,406 @@ def delete_student(id):
     try:
         cur = mysql.connection.cursor()
         cur.execute("DELETE FROM students WHERE StudentID = %s", (id,))  # Corrected column name
+        change_log.record(mysql.connection, 'students', 'delete', [id])
         mysql.connection.commit()
+        tables_changed('students')
+        profile_cache.invalidate_owner('student', id)
         cur.close()
         return redirect(url_for('list_students'))
     except Exception as e:
         print(f"Error deleting student: {e}")
         return "An error occurred while deleting the student.", 500
 
+# -------------------- Student Lookup (JSON) --------------------
+
+# Number of matches returned by the student search by default and at most
+STUDENT_SEARCH_LIMIT = 20
+STUDENT_SEARCH_MAX_LIMIT = 50
+
+# Students enrolled in a course (optionally in one semester), ordered by name
+def course_roster(cur, course_id, semester_id=None):
+    semester_sql = "AND es.SemesterID = %s" if semester_id else ""
+    params = (course_id, semester_id) if semester_id else (course_id,)
+    cur.execute(f"""
+        SELECT DISTINCT s.StudentID, s.FirstName, s.LastName, s.EnrollmentNo
+        FROM enrolledstudents es
+        JOIN students s ON es.StudentID = s.StudentID
+        WHERE es.CourseID = %s {semester_sql}
+        ORDER BY s.FirstName, s.LastName
+    """, params)
+    return cur.fetchall()
+
+# LIKE pattern matching values that start with `text`
+def like_prefix(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+# Route returning the students enrolled in a course as JSON (for the attendance forms)
+@app.route('/api/courses/<int:course_id>/roster')
+def course_roster_json(course_id):
+    cur = mysql.connection.cursor(DictCursor)
+    roster = course_roster(cur, course_id, request.args.get('semester_id'))
+    cur.close()
+    return jsonify(roster)
+
+# Route searching students by EnrollmentNo, first name or last name prefix ("first last"
+# narrows by both). Each branch is a range scan on its own index.
+@app.route('/api/students/search')
+def search_students():
+    q = request.args.get('q', '').strip()
+    if not q:
+        return jsonify([])
+    limit = min(request.args.get('limit', STUDENT_SEARCH_LIMIT, type=int), STUDENT_SEARCH_MAX_LIMIT)
+    columns = "StudentID, FirstName, LastName, EnrollmentNo"
+    cur = mysql.connection.cursor(DictCursor)
+    if ' ' in q:
+        first_name, last_name = q.split(None, 1)
+        cur.execute(f"""
+            SELECT {columns} FROM students
+            WHERE FirstName = %s AND LastName LIKE %s
+            ORDER BY FirstName, LastName
+            LIMIT %s
+        """, (first_name, like_prefix(last_name), limit))
+    else:
+        pattern = like_prefix(q)
+        # Branches as derived tables so their ORDER BY/LIMIT work on SQLite as well as MySQL
+        cur.execute(f"""
+            SELECT * FROM (SELECT {columns} FROM students WHERE EnrollmentNo LIKE %s ORDER BY EnrollmentNo LIMIT %s) AS by_number
+            UNION
+            SELECT * FROM (SELECT {columns} FROM students WHERE FirstName LIKE %s ORDER BY FirstName, LastName LIMIT %s) AS by_first
+            UNION
+            SELECT * FROM (SELECT {columns} FROM students WHERE LastName LIKE %s ORDER BY LastName, FirstName LIMIT %s) AS by_last
+            ORDER BY FirstName, LastName
+            LIMIT %s
+        """, (pattern, limit, pattern, limit, pattern, limit, limit))
+    students = cur.fetchall()
+    cur.close()
+    return jsonify(students)
+
 # -------------------- Attendance --------------------
 
-# Route to list attendance records
+# Read the attendance filters from the query string.
+# Returns the WHERE clauses, their parameters and the active filters (for building page links).
+def attendance_filters(args):
+    filters = {}
+    where_clauses = []
+    params = []
+    if args.get('course_id'):
+        filters['course_id'] = args['course_id']
+        where_clauses.append("a.CourseID = %s")
+        params.append(args['course_id'])
+    if args.get('student_id'):
+        filters['student_id'] = args['student_id']
+        where_clauses.append("a.StudentID = %s")
+        params.append(args['student_id'])
+    if args.get('date_from'):
+        filters['date_from'] = args['date_from']
+        where_clauses.append("a.AttendanceDate >= %s")
+        params.append(args['date_from'])
+    if args.get('date_to'):
+        filters['date_to'] = args['date_to']
+        where_clauses.append("a.AttendanceDate <= %s")
+        params.append(args['date_to'])
+    if args.get('status') in ('Present', 'Absent'):
+        filters['status'] = args['status']
+        where_clauses.append("a.AttendanceStatus = %s")
+        params.append(args['status'])
+    if args.get('semester_id'):
+        # Attendance has no semester column; a mark belongs to the semester the student took the course in
+        filters['semester_id'] = args['semester_id']
+        where_clauses.append("EXISTS (SELECT 1 FROM enrolledstudents es WHERE es.StudentID = a.StudentID AND es.CourseID = a.CourseID AND es.SemesterID = %s)")
+        params.append(args['semester_id'])
+    return where_clauses, params, filters
+
+# -------- Write-behind queue --------
+
+_attendance_queue = None
+_attendance_queue_lock = threading.Lock()
+_applied_marks_pruned_at = 0.0
+
+# Write a drained batch of marks; runs on the queue's background thread, outside any request
+def flush_attendance_marks(marks):
+    global _applied_marks_pruned_at
+    conn = mysql.pool.checkout()
+    broken = False
+    try:
+        apply_batch(conn, marks)
+        tables_changed('attendance', connection=conn)
+        if time.monotonic() - _applied_marks_pruned_at > 3600:
+            prune_applied(conn)
+            _applied_marks_pruned_at = time.monotonic()
+    except OPERATIONAL_ERRORS:
+        broken = True
+        raise
+    finally:
+        mysql.pool.checkin(conn, broken=broken)
+
+def attendance_queue():
+    global _attendance_queue
+    with _attendance_queue_lock:
+        if _attendance_queue is None:
+            _attendance_queue = AttendanceQueue(
+                app.config['ATTENDANCE_QUEUE_PATH'], flush_attendance_marks,
+                batch_size=app.config['ATTENDANCE_QUEUE_BATCH'],
+                interval=app.config['ATTENDANCE_QUEUE_INTERVAL'],
+                transient_errors=(PoolExhausted, *OPERATIONAL_ERRORS)
+            )
+            _attendance_queue.start()
+        return _attendance_queue
+
+# Latest queued update of each AttendanceID
+def pending_attendance_updates(marks):
+    return {str(mark['AttendanceID']): mark for mark in marks if mark['op'] == 'update'}
+
+# Whether a queued mark passes the listing's filters
+def mark_matches(mark, filters):
+    if 'semester_id' in filters:
+        return False  # needs the enrollments; the mark shows up once it is flushed
+    return (filters.get('course_id') in (None, mark['CourseID'])
+            and filters.get('student_id') in (None, mark['StudentID'])
+            and filters.get('status') in (None, mark['AttendanceStatus'])
+            and mark['AttendanceDate'] >= filters.get('date_from', '')
+            and mark['AttendanceDate'] <= filters.get('date_to', '9999-12-31'))
+
+# Merge queued marks into a page of the attendance listing: queued updates replace the values
+# of their records, and queued new marks matching the filters are returned as extra rows
+def merge_pending_attendance(records, filters):
+    marks = attendance_queue().pending()
+    if not marks:
+        return []
+    updates = pending_attendance_updates(marks)
+    added = [mark for mark in marks if mark['op'] == 'add' and mark_matches(mark, filters)]
+    changed = [(record, updates[str(record['AttendanceID'])]) for record in records
+               if str(record['AttendanceID']) in updates]
+    student_ids = {mark['StudentID'] for mark in added} | {mark['StudentID'] for _, mark in changed}
+    names = {}
+    if student_ids:
+        cur = mysql.connection.cursor(DictCursor)
+        placeholders = ', '.join(['%s'] * len(student_ids))
+        cur.execute(f"SELECT StudentID, FirstName, LastName FROM students WHERE StudentID IN ({placeholders})", tuple(student_ids))
+        names = {str(row['StudentID']): row for row in cur.fetchall()}
+        cur.close()
+    course_names = {str(c['CourseID']): c['CourseName'] for c in ref_data("SELECT CourseID, CourseName FROM courses")}
+
+    def as_record(mark, record):
+        student = names.get(mark['StudentID'], {})
+        record.update(FirstName=student.get('FirstName'), LastName=student.get('LastName'),
+                      CourseName=course_names.get(mark['CourseID']), AttendanceDate=mark['AttendanceDate'],
+                      AttendanceStatus=mark['AttendanceStatus'], Pending=True)
+        return record
+
+    for record, mark in changed:
+        as_record(mark, record)
+    return [as_record(mark, {'AttendanceID': None}) for mark in reversed(added)]
+
+# Route to expose the write-behind queue counters, including its lag
+@app.route('/attendance/queue/stats')
+def attendance_queue_stats():
+    if not app.config['ATTENDANCE_WRITE_BEHIND']:
+        return jsonify({'enabled': False})
+    return jsonify(dict(attendance_queue().stats(), enabled=True))
+
+# Route to list attendance records (newest first, paginated and filterable)
 @app.route('/attendance')
 def list_attendance():
-    cur = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-    cur.execute("""
+    where_clauses, params, filters = attendance_filters(request.args)
+    courses = ref_data("SELECT CourseID, CourseName FROM courses")  # For the course filter
+    semesters = ref_data("SELECT SemesterID, SemesterName FROM semesters")  # For the semester filter
+    attendance_records, page = stream_keyset_page(
+        """
         SELECT a.AttendanceID, s.FirstName, s.LastName, c.CourseName, a.AttendanceDate, a.AttendanceStatus
         FROM attendance a
         LEFT JOIN students s ON a.StudentID = s.StudentID
         LEFT JOIN courses c ON a.CourseID = c.CourseID
-    """)  # Updated to use CourseID
-    attendance_records = cur.fetchall()
-    cur.close()
-    return render_template('attendance/list_attendance.html', attendance_records=attendance_records)
+        """,
+        where_clauses, params,
+        [('a.AttendanceDate', 'AttendanceDate'), ('a.AttendanceID', 'AttendanceID')],
+        descending=True
+    )
+    if app.config['ATTENDANCE_WRITE_BEHIND']:
+        # Queued marks are merged into the page, so it is read whole first
+        attendance_records = [dict(record) for record in attendance_records]
+        pending = merge_pending_attendance(attendance_records, filters)
+        # Queued new marks are the newest of all, so they belong on the first page
+        if not request.args.get('after') and not request.args.get('before'):
+            attendance_records = pending + attendance_records
+    return stream_page('attendance/list_attendance.html', attendance_records=attendance_records,
+                       courses=courses, semesters=semesters, filters=filters, page=page)
+
+# Route to export attendance records (same filters as the listing) as CSV or XLSX
+@app.route('/attendance/export.<fmt>')
+def export_attendance(fmt):
+    where_clauses, params, _ = attendance_filters(request.args)
+    where_sql = "WHERE " + " AND ".join(where_clauses) if where_clauses else ""
+    query = f"""
+        SELECT a.AttendanceID, a.StudentID, s.EnrollmentNo, s.FirstName, s.LastName,
+               a.CourseID, c.CourseName, a.AttendanceDate, a.AttendanceStatus
+        FROM attendance a
+        LEFT JOIN students s ON a.StudentID = s.StudentID
+        LEFT JOIN courses c ON a.CourseID = c.CourseID
+        {where_sql}
+        ORDER BY a.AttendanceID
+    """
+    return export_response(query, tuple(params), fmt, 'attendance')
 
 # Route to add a new attendance record
 @app.route('/attendance/add', methods=['GET', 'POST'])
 def add_attendance():
-    cur = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-    cur.execute("SELECT * FROM students")
-    students = cur.fetchall()
-    cur.execute("SELECT * FROM courses")  # Ensure this query fetches the correct column names
-    courses = cur.fetchall()
-    cur.close()
+    # Students are loaded by the page from the selected course's roster (see course_roster_json)
+    courses = ref_data("SELECT CourseID, CourseName FROM courses")
     if request.method == 'POST':
         student_id = request.form['StudentID']
         course_id = request.form['CourseID']  # Updated to 'CourseID'
         attendance_date = request.form['AttendanceDate']
         attendance_status = 'Present' if 'AttendanceStatus' in request.form else 'Absent'
+        if app.config['ATTENDANCE_WRITE_BEHIND']:
+            try:
+                attendance_queue().append(new_mark('add', student_id, course_id, attendance_date, attendance_status))
+            except ValueError as e:
+                return f"Error: {escape(str(e))}.", 400
+            return redirect(url_for('list_attendance'))
         cur = mysql.connection.cursor()
-        cur.execute("INSERT INTO attendance (StudentID, CourseID, AttendanceDate, AttendanceStatus) VALUES (%s, %s, %s, %s)", (student_id, course_id, attendance_date, attendance_status))  # Updated query
+        semester_id = attendance_summary.enrollment_semesters(cur, [(student_id, course_id)])[(student_id, course_id)]
+        cur.execute("INSERT INTO attendance (StudentID, CourseID, AttendanceDate, AttendanceStatus, SemesterID) VALUES (%s, %s, %s, %s, %s)", (student_id, course_id, attendance_date, attendance_status, semester_id))  # Updated query
+        attendance_summary.apply_marks(mysql.connection, [(student_id, course_id, semester_id, attendance_status)])
+        change_log.record(mysql.connection, 'attendance', 'insert', [cur.lastrowid])
         mysql.connection.commit()
+        tables_changed('attendance')
         cur.close()
         return redirect(url_for('list_attendance'))  # Redirect to the attendance list after adding
-    return render_template('attendance/add_attendance.html', students=students, courses=courses)
+    return render_template('attendance/add_attendance.html', courses=courses)
+
+# Route to mark attendance for a whole class meeting (one course, one date) in one submit.
+# Only the submitted students' marks are written: a student already marked gets their mark
+# updated if the status changed, an unmarked one gets a new mark, and marks of students not on
+# the submitted roster (enrolled after the page loaded, or marked elsewhere) are left alone.
+@app.route('/attendance/mark_class', methods=['GET', 'POST'])
+def mark_class_attendance():
+    if request.method == 'POST':
+        course_id = request.form['CourseID']
+        attendance_date = request.form['AttendanceDate']
+        roster_ids = list(dict.fromkeys(request.form.getlist('StudentID')))
+        present_ids = set(request.form.getlist('Present'))
+        if not roster_ids:
+            return "Error: No students submitted for the class.", 400
+        cur = mysql.connection.cursor()
+        try:
+            roster_cur = mysql.connection.cursor(DictCursor)
+            enrolled = {str(student['StudentID']) for student in course_roster(roster_cur, course_id)}
+            roster_cur.close()
+            unknown = [student_id for student_id in roster_ids if student_id not in enrolled]
+            if unknown:
+                return f"Error: Students {escape(', '.join(unknown))} are not enrolled in the course.", 400
+            statuses = {student_id: 'Present' if student_id in present_ids else 'Absent' for student_id in roster_ids}
+
+            # Everything happens in one transaction, locking only the submitted students' marks
+            placeholders = ', '.join(['%s'] * len(roster_ids))
+            cur.execute(f"""
+                SELECT AttendanceID, StudentID, CourseID, SemesterID, AttendanceStatus FROM attendance
+                WHERE CourseID = %s AND AttendanceDate = %s AND StudentID IN ({placeholders})
+                FOR UPDATE
+            """, (course_id, attendance_date, *roster_ids))
+            previous = cur.fetchall()
+            marked = {str(row[1]) for row in previous}
+            changed = [row for row in previous if row[4] != statuses[str(row[1])]]
+            if changed:
+                cur.executemany("UPDATE attendance SET AttendanceStatus = %s WHERE AttendanceID = %s",
+                                [(statuses[str(row[1])], row[0]) for row in changed])
+                attendance_summary.apply_marks(mysql.connection, [row[1:] for row in changed], sign=-1)
+                attendance_summary.apply_marks(mysql.connection, [(row[1], row[2], row[3], statuses[str(row[1])]) for row in changed])
+            new_ids = [student_id for student_id in roster_ids if student_id not in marked]
+            last_id = change_log.last_key(mysql.connection, 'attendance')
+            if new_ids:
+                semesters = attendance_summary.enrollment_semesters(cur, [(student_id, course_id) for student_id in new_ids])
+                rows = [(student_id, course_id, attendance_date, statuses[student_id], semesters[(student_id, course_id)])
+                        for student_id in new_ids]
+                # executemany turns this into a single multi-row INSERT
+                cur.executemany("INSERT INTO attendance (StudentID, CourseID, AttendanceDate, AttendanceStatus, SemesterID) VALUES (%s, %s, %s, %s, %s)", rows)
+                attendance_summary.apply_marks(mysql.connection, [(row[0], row[1], row[4], row[3]) for row in rows])
+            change_log.record(mysql.connection, 'attendance', 'update', [row[0] for row in changed])
+            change_log.record_where(mysql.connection, 'attendance', 'insert', "AttendanceID > %s", (last_id,))
+            mysql.connection.commit()
+            tables_changed('attendance')
+        except Exception as e:
+            mysql.connection.rollback()
+            print(f"Error marking class attendance: {e}")
+            return "An error occurred while marking attendance for the class.", 500
+        finally:
+            cur.close()
+        return redirect(url_for('list_attendance', course_id=course_id, date_from=attendance_date, date_to=attendance_date))
+
+    course_id = request.args.get('course_id')
+    attendance_date = request.args.get('date')
+    cur = mysql.connection.cursor(DictCursor)
+    courses = ref_data("SELECT CourseID, CourseName FROM courses")
+    roster = []
+    marked = {}
+    if course_id and attendance_date:
+        # Roster comes from the course's enrollments, not the whole students table
+        roster = course_roster(cur, course_id)
+        # Pre-tick existing marks so the meeting can be corrected
+        cur.execute("SELECT StudentID, AttendanceStatus FROM attendance WHERE CourseID = %s AND AttendanceDate = %s", (course_id, attendance_date))
+        marked = {row['StudentID']: row['AttendanceStatus'] for row in cur.fetchall()}
+    cur.close()
+    return render_template('attendance/mark_class.html', courses=courses, roster=roster, marked=marked,
+                           course_id=course_id, attendance_date=attendance_date)
 
 # Route to update an attendance record
 @app.route('/attendance/update/<int:id>', methods=['GET', 'POST'])
 def update_attendance(id):
-    cur = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
+    cur = mysql.connection.cursor(DictCursor)
     cur.execute("SELECT * FROM attendance WHERE AttendanceID = %s", (id,))
     attendance = cur.fetchone()
-    cur.execute("SELECT * FROM students")
-    students = cur.fetchall()
-    cur.execute("SELECT * FROM courses")  # Ensure this query fetches the correct column names
-    courses = cur.fetchall()
+    if attendance and app.config['ATTENDANCE_WRITE_BEHIND']:
+        # Show the record as it will be once a queued update of it is flushed
+        queued = pending_attendance_updates(attendance_queue().pending()).get(str(id))
+        if queued:
+            attendance.update((key, queued[key]) for key in ('StudentID', 'CourseID', 'AttendanceDate', 'AttendanceStatus'))
+    # Only the record's own student is rendered; the page loads the rest of the roster
+    student = None
+    if attendance:
+        cur.execute("SELECT StudentID, FirstName, LastName, EnrollmentNo FROM students WHERE StudentID = %s", (attendance['StudentID'],))
+        student = cur.fetchone()
+    courses = ref_data("SELECT CourseID, CourseName FROM courses")
     cur.close()
     if request.method == 'POST':
         student_id = request.form['StudentID']
         course_id = request.form['CourseID']  # Updated to 'CourseID'
         attendance_date = request.form['AttendanceDate']
         attendance_status = 'Present' if 'AttendanceStatus' in request.form else 'Absent'
+        if app.config['ATTENDANCE_WRITE_BEHIND']:
+            try:
+                attendance_queue().append(new_mark('update', student_id, course_id, attendance_date, attendance_status, attendance_id=id))
+            except ValueError as e:
+                return f"Error: {escape(str(e))}.", 400
+            return redirect(url_for('list_attendance'))
         cur = mysql.connection.cursor()
-        cur.execute("UPDATE attendance SET StudentID = %s, CourseID = %s, AttendanceDate = %s, AttendanceStatus = %s WHERE AttendanceID = %s", (student_id, course_id, attendance_date, attendance_status, id))  # Updated query
+        cur.execute("SELECT StudentID, CourseID, SemesterID, AttendanceStatus FROM attendance WHERE AttendanceID = %s FOR UPDATE", (id,))
+        previous = cur.fetchall()
+        if previous:
+            semester_id = attendance_summary.updated_semester(cur, previous[0], student_id, course_id)
+            cur.execute("UPDATE attendance SET StudentID = %s, CourseID = %s, AttendanceDate = %s, AttendanceStatus = %s, SemesterID = %s WHERE AttendanceID = %s", (student_id, course_id, attendance_date, attendance_status, semester_id, id))  # Updated query
+            # Move the mark in the summary from its old student/course/status to the new one
+            attendance_summary.apply_marks(mysql.connection, previous, sign=-1)
+            attendance_summary.apply_marks(mysql.connection, [(student_id, course_id, semester_id, attendance_status)])
+        change_log.record(mysql.connection, 'attendance', 'update', [id])
         mysql.connection.commit()
+        tables_changed('attendance')
         cur.close()
         return redirect(url_for('list_attendance'))
-    return render_template('attendance/update_attendance.html', attendance=attendance, students=students, courses=courses)
+    return render_template('attendance/update_attendance.html', attendance=attendance, student=student, courses=courses)
 
 # Route to delete an attendance record
 @app.route('/attendance/delete/<int:id>', methods=['POST'])
 def delete_attendance(id):
     try:
         cur = mysql.connection.cursor()
+        cur.execute("SELECT StudentID, CourseID, SemesterID, AttendanceStatus FROM attendance WHERE AttendanceID = %s FOR UPDATE", (id,))
+        removed = cur.fetchall()
         cur.execute("DELETE FROM attendance WHERE AttendanceID = %s", (id,))
+        attendance_summary.apply_marks(mysql.connection, removed, sign=-1)
+        change_log.record(mysql.connection, 'attendance', 'delete', [id])
         mysql.connection.commit()
+        tables_changed('attendance')
         cur.close()
         return redirect(url_for('list_attendance'))
     except Exception as e:
@@ -391,10 +1167,85 @@ def delete_attendance(id):
 
 # -------------------- Timetables --------------------
 
+# Process-wide timetable conflict index and when it was loaded
+_timetable_index = None
+_timetable_index_loaded_at = 0.0
+_timetable_index_lock = threading.Lock()
+
+# Return the timetable conflict index, loading it from the database when missing or stale
+def timetable_index():
+    global _timetable_index, _timetable_index_loaded_at
+    with _timetable_index_lock:
+        if _timetable_index is None or time.monotonic() - _timetable_index_loaded_at > app.config['TIMETABLE_INDEX_TTL']:
+            cur = mysql.connection.cursor(DictCursor)
+            cur.execute("SELECT TimetableID, CourseID, DayOfWeek, StartTime, EndTime, RoomNumber, TaughtBy FROM timetables")
+            _timetable_index = TimetableIndex(cur.fetchall())
+            cur.close()
+            _timetable_index_loaded_at = time.monotonic()
+        return _timetable_index
+
+# Drop the timetable index so the next use reloads it from the database
+def invalidate_timetable_index():
+    global _timetable_index
+    with _timetable_index_lock:
+        _timetable_index = None
+
+# Put a committed timetable row into the index (replacing any previous version of it)
+def index_timetable_entry(entry):
+    index = timetable_index()
+    index.remove(entry['TimetableID'])
+    index.add(entry)
+
+# Clashes of `entries` with the timetable rows committed in the database, as (reason, entry)
+# pairs. Run inside the caller's write transaction: the rows on the same day in the same room
+# or with the same teacher are read with FOR UPDATE, so a concurrent write to those slots (from
+# this or any other worker, whose index may be up to TIMETABLE_INDEX_TTL behind) waits for the
+# caller to commit instead of slipping past the index check.
+def committed_clashes(entries, exclude_id=None):
+    probes = sorted({(column, str(entry['DayOfWeek']), str(entry[column]))
+                     for entry in entries for column in ('RoomNumber', 'TaughtBy')})
+    rows = {}
+    cur = mysql.connection.cursor(DictCursor)
+    try:
+        for column, day, value in probes:
+            cur.execute(f"""
+                SELECT TimetableID, CourseID, DayOfWeek, StartTime, EndTime, RoomNumber, TaughtBy
+                FROM timetables WHERE DayOfWeek = %s AND {column} = %s
+                FOR UPDATE
+            """, (day, value))
+            for row in cur.fetchall():
+                rows[row['TimetableID']] = row
+    finally:
+        cur.close()
+    index = TimetableIndex(rows.values())
+    clashes = []
+    for entry in entries:
+        clashes.extend(index.conflicts(entry['DayOfWeek'], entry['StartTime'], entry['EndTime'],
+                                       entry['RoomNumber'], entry['TaughtBy'], exclude_id=exclude_id))
+    if clashes:
+        # The index missed them, so it is behind the database: reload it on next use
+        invalidate_timetable_index()
+    return clashes
+
+# Whether a slot's StartTime and EndTime are both readable times
+def valid_times(start_time, end_time):
+    try:
+        to_minutes(start_time)
+        to_minutes(end_time)
+    except (ValueError, IndexError):
+        return False
+    return True
+
+# Error response listing every clash found for a slot
+def conflict_response(conflicts):
+    details = "; ".join(describe_conflict(reason, entry) for reason, entry in conflicts)
+    return f"Error: Time slot conflicts with an existing timetable entry for the same teacher or classroom ({escape(details)}).", 400
+
 # Route to list timetables
 @app.route('/timetables')
+@conditional_get('timetables', 'courses')
 def list_timetables():
-    cur = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
+    cur = mysql.connection.cursor(DictCursor)
     cur.execute("SELECT t.TimetableID, c.CourseName, t.DayOfWeek, t.StartTime, t.EndTime, t.RoomNumber FROM timetables t LEFT JOIN courses c ON t.CourseID = c.CourseID")
     timetables = cur.fetchall()
     cur.close()
@@ -403,12 +1254,8 @@ def list_timetables():
 # Route to add a new timetable
 @app.route('/timetables/add', methods=['GET', 'POST'])
 def add_timetable():
-    cur = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-    cur.execute("SELECT * FROM courses")
-    courses = cur.fetchall()
-    cur.execute("SELECT FacultyID, CONCAT(FirstName, ' ', LastName) AS FullName FROM faculty")  # Fetch faculty names
-    faculty = cur.fetchall()
-    cur.close()
+    courses = ref_data("SELECT * FROM courses")
+    faculty = ref_data("SELECT FacultyID, CONCAT(FirstName, ' ', LastName) AS FullName FROM faculty")  # Fetch faculty names
     if request.method == 'POST':
         course_id = request.form['CourseID']
         day_of_week = request.form['DayOfWeek']
@@ -416,46 +1263,51 @@ def add_timetable():
         end_time = request.form['EndTime']
         room_number = request.form['RoomNumber']
         taught_by = request.form['TaughtBy']  # Foreign key (FacultyID)
+        if not valid_times(start_time, end_time):
+            return "Error: Invalid StartTime or EndTime.", 400
+        entry = {'CourseID': course_id, 'DayOfWeek': day_of_week, 'StartTime': start_time,
+                 'EndTime': end_time, 'RoomNumber': room_number, 'TaughtBy': taught_by}
 
-        # Validate overlapping time slots for the teacher and the classroom
-        cur = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-        cur.execute("""
-            SELECT t.*
-            FROM timetables t
-            WHERE t.DayOfWeek = %s
-            AND (
-                (t.StartTime < t.EndTime AND (%s < t.EndTime AND %s > t.StartTime)) OR
-                (t.StartTime > t.EndTime AND (%s < t.EndTime OR %s > t.StartTime))  -- Handle crossing midnight
-            )
-            AND (t.RoomNumber = %s OR t.TaughtBy = %s)
-        """, (day_of_week, end_time, start_time, end_time, start_time, room_number, taught_by))
-        conflict = cur.fetchone()
-        cur.close()
-
-        if conflict:
-            return "Error: Time slot conflicts with an existing timetable entry for the same teacher or classroom.", 400
+        # Validate overlapping time slots for the teacher and the classroom (midnight-crossing slots included)
+        conflicts = timetable_index().conflicts(day_of_week, start_time, end_time, room_number, taught_by)
+        if conflicts:
+            return conflict_response(conflicts)
 
-        # Insert new timetable entry
+        # Insert new timetable entry, re-checking the committed timetable in the same transaction
         cur = mysql.connection.cursor()
-        cur.execute("""
-            INSERT INTO timetables (CourseID, DayOfWeek, StartTime, EndTime, RoomNumber, TaughtBy)
-            VALUES (%s, %s, %s, %s, %s, %s)
-        """, (course_id, day_of_week, start_time, end_time, room_number, taught_by))
-        mysql.connection.commit()
-        cur.close()
+        try:
+            conflicts = committed_clashes([entry])
+            if conflicts:
+                mysql.connection.rollback()
+                return conflict_response(conflicts)
+            cur.execute("""
+                INSERT INTO timetables (CourseID, DayOfWeek, StartTime, EndTime, RoomNumber, TaughtBy)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            """, (course_id, day_of_week, start_time, end_time, room_number, taught_by))
+            timetable_id = cur.lastrowid
+            change_log.record(mysql.connection, 'timetables', 'insert', [timetable_id])
+            mysql.connection.commit()
+            tables_changed('timetables')
+        except Exception as e:
+            mysql.connection.rollback()
+            print(f"Error adding timetable: {e}")
+            return "An error occurred while adding the timetable.", 500
+        finally:
+            cur.close()
+        entry['TimetableID'] = timetable_id
+        index_timetable_entry(entry)
+        schedule_cache.invalidate_entries(entry)
         return redirect(url_for('list_timetables'))
     return render_template('timetables/add_timetable.html', courses=courses, faculty=faculty)
 
 # Route to update a timetable
 @app.route('/timetables/update/<int:id>', methods=['GET', 'POST'])
 def update_timetable(id):
-    cur = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
+    cur = mysql.connection.cursor(DictCursor)
     cur.execute("SELECT * FROM timetables WHERE TimetableID = %s", (id,))
     timetable = cur.fetchone()
-    cur.execute("SELECT * FROM courses")
-    courses = cur.fetchall()
-    cur.execute("SELECT FacultyID, CONCAT(FirstName, ' ', LastName) AS FullName FROM faculty")  # Fetch faculty names
-    faculty = cur.fetchall()
+    courses = ref_data("SELECT * FROM courses")
+    faculty = ref_data("SELECT FacultyID, CONCAT(FirstName, ' ', LastName) AS FullName FROM faculty")  # Fetch faculty names
     cur.close()
     if request.method == 'POST':
         course_id = request.form['CourseID']
@@ -464,35 +1316,39 @@ def update_timetable(id):
         end_time = request.form['EndTime']
         room_number = request.form['RoomNumber']
         taught_by = request.form['TaughtBy']  # Foreign key (FacultyID)
+        if not valid_times(start_time, end_time):
+            return "Error: Invalid StartTime or EndTime.", 400
+        entry = {'TimetableID': id, 'CourseID': course_id, 'DayOfWeek': day_of_week,
+                 'StartTime': start_time, 'EndTime': end_time, 'RoomNumber': room_number, 'TaughtBy': taught_by}
 
-        # Validate overlapping time slots for the teacher and the classroom
-        cur = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-        cur.execute("""
-            SELECT t.*
-            FROM timetables t
-            WHERE t.DayOfWeek = %s
-            AND (
-                (t.StartTime < t.EndTime AND (%s < t.EndTime AND %s > t.StartTime)) OR
-                (t.StartTime > t.EndTime AND (%s < t.EndTime OR %s > t.StartTime))  -- Handle crossing midnight
-            )
-            AND (t.RoomNumber = %s OR t.TaughtBy = %s)
-            AND t.TimetableID != %s
-        """, (day_of_week, end_time, start_time, end_time, start_time, room_number, taught_by, id))
-        conflict = cur.fetchone()
-        cur.close()
-
-        if conflict:
-            return "Error: Time slot conflicts with an existing timetable entry for the same teacher or classroom.", 400
+        # Validate overlapping time slots for the teacher and the classroom, ignoring this entry itself
+        conflicts = timetable_index().conflicts(day_of_week, start_time, end_time, room_number, taught_by, exclude_id=id)
+        if conflicts:
+            return conflict_response(conflicts)
 
-        # Update timetable entry
+        # Update timetable entry, re-checking the committed timetable in the same transaction
         cur = mysql.connection.cursor()
-        cur.execute("""
-            UPDATE timetables
-            SET CourseID = %s, DayOfWeek = %s, StartTime = %s, EndTime = %s, RoomNumber = %s, TaughtBy = %s
-            WHERE TimetableID = %s
-        """, (course_id, day_of_week, start_time, end_time, room_number, taught_by, id))
-        mysql.connection.commit()
-        cur.close()
+        try:
+            conflicts = committed_clashes([entry], exclude_id=id)
+            if conflicts:
+                mysql.connection.rollback()
+                return conflict_response(conflicts)
+            cur.execute("""
+                UPDATE timetables
+                SET CourseID = %s, DayOfWeek = %s, StartTime = %s, EndTime = %s, RoomNumber = %s, TaughtBy = %s
+                WHERE TimetableID = %s
+            """, (course_id, day_of_week, start_time, end_time, room_number, taught_by, id))
+            change_log.record(mysql.connection, 'timetables', 'update', [id])
+            mysql.connection.commit()
+            tables_changed('timetables')
+        except Exception as e:
+            mysql.connection.rollback()
+            print(f"Error updating timetable: {e}")
+            return "An error occurred while updating the timetable.", 500
+        finally:
+            cur.close()
+        index_timetable_entry(entry)
+        schedule_cache.invalidate_entries(*([timetable, entry] if timetable else [entry]))
         return redirect(url_for('list_timetables'))
     return render_template('timetables/update_timetable.html', timetable=timetable, courses=courses, faculty=faculty)
 
@@ -500,60 +1356,413 @@ def update_timetable(id):
 @app.route('/timetables/delete/<int:id>', methods=['POST'])
 def delete_timetable(id):
     try:
-        cur = mysql.connection.cursor()
+        cur = mysql.connection.cursor(DictCursor)
+        cur.execute("SELECT CourseID, TaughtBy FROM timetables WHERE TimetableID = %s", (id,))
+        removed = cur.fetchall()
         cur.execute("DELETE FROM timetables WHERE TimetableID = %s", (id,))
+        change_log.record(mysql.connection, 'timetables', 'delete', [id])
         mysql.connection.commit()
+        tables_changed('timetables')
         cur.close()
+        timetable_index().remove(id)
+        schedule_cache.invalidate_entries(*removed)
         return redirect(url_for('list_timetables'))
     except Exception as e:
         print(f"Error deleting timetable: {e}")
         return "An error occurred while deleting the timetable.", 500
 
+# Columns of a timetable upload
+TIMETABLE_COLUMNS = ['CourseID', 'DayOfWeek', 'StartTime', 'EndTime', 'RoomNumber', 'TaughtBy']
+
+# Route to validate (and optionally save) a whole proposed timetable uploaded as CSV.
+# Every clash is listed, both with the existing timetable and within the upload itself.
+@app.route('/timetables/validate', methods=['GET', 'POST'])
+def validate_timetable():
+    if request.method == 'GET':
+        return render_template('timetables/validate_timetable.html', columns=TIMETABLE_COLUMNS)
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return "Error: No CSV file uploaded.", 400
+
+    entries = []
+    lines = []
+    errors = []
+    for line, row in enumerate(read_csv(upload.stream), start=2):
+        entry = {c: (row.get(c) or '').strip() for c in TIMETABLE_COLUMNS}
+        missing = [c for c in TIMETABLE_COLUMNS if not entry[c]]
+        if missing:
+            errors.append((line, f"Missing value for {', '.join(missing)}"))
+            continue
+        if not valid_times(entry['StartTime'], entry['EndTime']):
+            errors.append((line, "Invalid StartTime or EndTime"))
+            continue
+        entries.append(entry)
+        lines.append(line)
+
+    for position, reason, other, other_position in timetable_index().validate(entries):
+        if other_position is None:
+            message = f"{describe_conflict(reason, other)} (timetable #{other['TimetableID']})"
+        else:
+            message = f"{describe_conflict(reason, other)} (line {lines[other_position]} of this file)"
+        errors.append((lines[position], message))
+    errors.sort()
+
+    inserted = 0
+    if not errors and entries and request.form.get('save'):
+        rows = [tuple(entry[c] for c in TIMETABLE_COLUMNS) for entry in entries]
+        cur = mysql.connection.cursor()
+        try:
+            conflicts = committed_clashes(entries)
+            if conflicts:
+                mysql.connection.rollback()
+                return conflict_response(conflicts)
+            last_id = change_log.last_key(mysql.connection, 'timetables')
+            cur.executemany("""
+                INSERT INTO timetables (CourseID, DayOfWeek, StartTime, EndTime, RoomNumber, TaughtBy)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            """, rows)
+            change_log.record_where(mysql.connection, 'timetables', 'insert', "TimetableID > %s", (last_id,))
+            mysql.connection.commit()
+            tables_changed('timetables')
+        except Exception as e:
+            mysql.connection.rollback()
+            print(f"Error saving timetable: {e}")
+            return "An error occurred while saving the timetable.", 500
+        finally:
+            cur.close()
+        inserted = len(rows)
+        # New rows get their IDs from the database, so reload the index on next use
+        invalidate_timetable_index()
+        schedule_cache.invalidate_entries(*entries)
+    return render_template('timetables/validate_timetable.html', columns=TIMETABLE_COLUMNS,
+                           checked=len(entries), errors=errors, inserted=inserted)
+
+# Days offered by default on the timetable generator
+WEEK_DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday']
+
+# Held while this process runs the generator's solver; GENERATOR_LOCK is the advisory lock
+# held meanwhile for all processes (see TIMETABLE_SOLVER_WORKERS)
+_timetable_generator_lock = threading.Lock()
+GENERATOR_LOCK = 'timetable_generator'
+
+# Route to generate a clash-free timetable for a department's courses.
+# With a teacher selected only that teacher's courses are re-solved; everything else stays put.
+@app.route('/timetables/generate', methods=['GET', 'POST'])
+def generate_timetable():
+    departments = ref_data("SELECT DepartmentID, DepartmentName FROM departments")
+    faculty = ref_data("SELECT FacultyID, CONCAT(FirstName, ' ', LastName) AS FullName FROM faculty")
+    if request.method == 'GET':
+        return render_template('timetables/generate_timetable.html', departments=departments, faculty=faculty, week_days=WEEK_DAYS)
+
+    department_id = request.form['DepartmentID']
+    teacher_id = request.form.get('ResolveTeacher')
+    rooms = [room.strip() for room in request.form['Rooms'].split(',') if room.strip()]
+    days = request.form.getlist('Days')
+    try:
+        periods = [tuple(t.strip() for t in period.split('-')) for period in request.form['Periods'].split(',') if period.strip()]
+        period_minutes = [(to_minutes(end) - to_minutes(start)) % (24 * 60) for start, end in periods]
+        hours = float(request.form.get('HoursPerWeek') or 3)
+        unavailable = [line.split(',') for line in request.form.get('Unavailable', '').splitlines() if line.strip()]
+        unavailable = [(f.strip(), d.strip(), start.strip(), end.strip()) for f, d, start, end in unavailable]
+        for _, _, start, end in unavailable:
+            to_minutes(start), to_minutes(end)
+    except (ValueError, IndexError):
+        return "Error: Periods must look like 08:00-09:00 and unavailability lines like FacultyID,Day,08:00,10:00.", 400
+    if not rooms or not days or not periods:
+        return "Error: Rooms, days and periods are required.", 400
+    if 0 in period_minutes:
+        return "Error: Every period must end after it starts.", 400
+    # The solver treats periods as separate slots, so overlapping ones would double-book
+    for i, (start, end) in enumerate(periods):
+        for other_start, other_end in periods[i + 1:]:
+            if slots_overlap(start, end, other_start, other_end):
+                return f"Error: Periods {escape(start)}-{escape(end)} and {escape(other_start)}-{escape(other_end)} overlap.", 400
+
+    cur = mysql.connection.cursor(DictCursor)
+    if teacher_id:
+        cur.execute("SELECT CourseID, FacultyID FROM courses WHERE DepartmentID = %s AND FacultyID = %s", (department_id, teacher_id))
+    else:
+        cur.execute("SELECT CourseID, FacultyID FROM courses WHERE DepartmentID = %s AND FacultyID IS NOT NULL", (department_id,))
+    courses = cur.fetchall()
+    cur.execute("SELECT TimetableID, CourseID, DayOfWeek, StartTime, EndTime, RoomNumber, TaughtBy FROM timetables")
+    existing = cur.fetchall()
+    cur.close()
+    if not courses:
+        return "Error: No courses with a teacher found to schedule.", 400
+
+    # The selected courses are rescheduled from scratch; every other row is fixed occupancy
+    course_ids = {course['CourseID'] for course in courses}
+    kept = TimetableIndex(row for row in existing if row['CourseID'] not in course_ids)
+    count = sessions_for_hours(hours, sum(period_minutes) / len(period_minutes))
+    sections = [(course['CourseID'], course['FacultyID'], count) for course in courses]
+    teachers = {course['FacultyID'] for course in courses}
+    slots = [((d, p), day, start, end) for d, day in enumerate(days) for p, (start, end) in enumerate(periods)]
+    blocked_rooms = {(room, slot) for slot, day, start, end in slots for room in rooms
+                     if kept.busy('room', room, day, start, end)}
+    blocked_teachers = {(teacher, slot) for slot, day, start, end in slots for teacher in teachers
+                        if kept.busy('teacher', teacher, day, start, end)}
+    for f, away_day, away_start, away_end in unavailable:
+        blocked_teachers.update((teacher, slot) for slot, day, start, end in slots for teacher in teachers
+                                if str(teacher) == f and normalize_day(day) == normalize_day(away_day)
+                                and slots_overlap(start, end, away_start, away_end))
+
+    problem = TimetableProblem(sections, rooms, days, periods, blocked_rooms, blocked_teachers)
+    if not _timetable_generator_lock.acquire(blocking=False):
+        return "Error: Another timetable is being generated; try again when it has finished.", 503
+    try:
+        if not acquire_lock(mysql.connection, GENERATOR_LOCK):
+            return "Error: Another timetable is being generated; try again when it has finished.", 503
+        try:
+            solution = solve_parallel(problem, workers=app.config['TIMETABLE_SOLVER_WORKERS'],
+                                      time_limit=app.config['TIMETABLE_SOLVER_TIME_LIMIT'])
+        finally:
+            release_lock(mysql.connection, GENERATOR_LOCK)
+    finally:
+        _timetable_generator_lock.release()
+    if not solution.complete:
+        unplaced = [problem.sessions[i] for i in solution.unplaced]
+        return render_template('timetables/generate_timetable.html', departments=departments, faculty=faculty,
+                               week_days=WEEK_DAYS, unplaced=unplaced)
+
+    # The timetable may have changed while the solver ran: check the generated slots against the
+    # current index (ignoring the slots they replace) and against each other
+    rows = solution.rows(problem)
+    entries = [dict(zip(TIMETABLE_COLUMNS, row)) for row in rows]
+    replaced = {str(course_id) for course_id in course_ids}
+    clashes = [(reason, other) for _, reason, other, other_position in timetable_index().validate(entries)
+               if other_position is not None or str(other['CourseID']) not in replaced]
+    if clashes:
+        return conflict_response(clashes)
+
+    # Replace the selected courses' slots with the generated ones in one transaction
+    cur = mysql.connection.cursor()
+    try:
+        placeholders = ', '.join(['%s'] * len(course_ids))
+        last_id = change_log.last_key(mysql.connection, 'timetables')
+        cur.execute(f"SELECT TimetableID FROM timetables WHERE CourseID IN ({placeholders}) FOR UPDATE", tuple(course_ids))
+        removed = [row[0] for row in cur.fetchall()]
+        cur.execute(f"DELETE FROM timetables WHERE CourseID IN ({placeholders})", tuple(course_ids))
+        conflicts = committed_clashes(entries)
+        if conflicts:
+            mysql.connection.rollback()
+            return conflict_response(conflicts)
+        cur.executemany("""
+            INSERT INTO timetables (CourseID, DayOfWeek, StartTime, EndTime, RoomNumber, TaughtBy)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """, rows)
+        change_log.record(mysql.connection, 'timetables', 'delete', removed)
+        change_log.record_where(mysql.connection, 'timetables', 'insert', "TimetableID > %s", (last_id,))
+        mysql.connection.commit()
+        tables_changed('timetables')
+    except Exception as e:
+        mysql.connection.rollback()
+        print(f"Error saving generated timetable: {e}")
+        return "An error occurred while saving the generated timetable.", 500
+    finally:
+        cur.close()
+    invalidate_timetable_index()
+    schedule_cache.clear()
+    return redirect(url_for('list_timetables'))
+
+# Route to find the rooms free during a slot ("which rooms are free on Tuesday 10:00-11:30"),
+# and the periods of the week when a room and/or a teacher are free. Answered from the
+# occupancy bitmaps of the timetable index, without SQL.
+@app.route('/timetables/finder')
+def timetable_finder():
+    index = timetable_index()
+    faculty = ref_data("SELECT FacultyID, FirstName, LastName FROM faculty")
+    args = request.args
+    hours = app.config['TIMETABLE_FINDER_HOURS']
+    free_rooms = None
+    free_periods = None
+    try:
+        if args.get('day') and args.get('start') and args.get('end'):
+            if to_minutes(args['start']) == to_minutes(args['end']):
+                return "Error: The slot must end after it starts.", 400
+            free_rooms = index.free_rooms(args['day'], args['start'], args['end'])
+        room = args.get('room', '').strip()
+        teacher = args.get('teacher', '').strip()
+        if room or teacher:
+            minutes = max(args.get('minutes', 60, type=int), 1)
+            from_time = args.get('from') or hours[0]
+            to_time = args.get('to') or hours[1]
+            free_periods = []
+            for day in WEEK_DAYS:
+                periods = index.free_periods(day, [room] if room else (), [teacher] if teacher else (),
+                                             minutes, from_time, to_time)
+                free_periods.append((day, [(format_minutes(start), format_minutes(end)) for start, end in periods]))
+    except (ValueError, IndexError):
+        return "Error: Invalid time.", 400
+    return render_template('timetables/finder.html', rooms=index.rooms(), faculty=faculty, week_days=WEEK_DAYS,
+                           hours=hours, args=args, free_rooms=free_rooms, free_periods=free_periods)
+
+# -------------------- Weekly Timetables --------------------
+
+schedule_cache = ScheduleCache(app.config['SCHEDULE_CACHE_TTL'])
+
+# Every timetable slot grouped by CourseID, cached with the reference data
+def slots_by_course():
+    def load():
+        cur = mysql.connection.cursor(DictCursor)
+        cur.execute("""
+            SELECT t.TimetableID, t.CourseID, c.CourseName, t.DayOfWeek, t.StartTime, t.EndTime,
+                   t.RoomNumber, t.TaughtBy, CONCAT(f.FirstName, ' ', f.LastName) AS TeacherName
+            FROM timetables t
+            JOIN courses c ON t.CourseID = c.CourseID
+            LEFT JOIN faculty f ON t.TaughtBy = f.FacultyID
+        """)
+        grouped = {}
+        for slot in cur.fetchall():
+            grouped.setdefault(str(slot['CourseID']), []).append(slot)
+        cur.close()
+        return grouped
+    return refdata_cache.get('slots_by_course', ['timetables', 'courses', 'faculty'], load)
+
+# Weekly timetable of a student: the courses of their latest assigned semester
+def student_schedule(student_id):
+    def load():
+        cur = mysql.connection.cursor()
+        cur.execute("""
+            SELECT DISTINCT CourseID FROM assign_courses_to_student
+            WHERE StudentID = %s AND COALESCE(Allowed, 1) = 1
+              AND CurrentSemesterID = (SELECT MAX(CurrentSemesterID) FROM assign_courses_to_student WHERE StudentID = %s)
+        """, (student_id, student_id))
+        course_ids = [str(row[0]) for row in cur.fetchall()]
+        cur.close()
+        grouped = slots_by_course()
+        return week_schedule([slot for course_id in course_ids for slot in grouped.get(course_id, [])]), course_ids
+    return schedule_cache.get('student', student_id, load)
+
+# Weekly timetable of a teacher: every slot they teach
+def teacher_schedule(faculty_id):
+    def load():
+        slots = [slot for course_slots in slots_by_course().values() for slot in course_slots
+                 if str(slot['TaughtBy']) == str(faculty_id)]
+        return week_schedule(slots), {slot['CourseID'] for slot in slots}
+    return schedule_cache.get('teacher', faculty_id, load)
+
+# Name shown on a timetable, or None when the student/teacher does not exist
+def schedule_owner(kind, owner_id):
+    table, key = ('students', 'StudentID') if kind == 'student' else ('faculty', 'FacultyID')
+    cur = mysql.connection.cursor(DictCursor)
+    cur.execute(f"SELECT FirstName, LastName FROM {table} WHERE {key} = %s", (owner_id,))
+    owner = cur.fetchone()
+    cur.close()
+    return f"{owner['FirstName']} {owner['LastName']}" if owner else None
+
+def render_schedule(kind, owner_id, week, fmt):
+    name = schedule_owner(kind, owner_id)
+    if name is None:
+        return f"Error: {kind.capitalize()} not found.", 404
+    if fmt == 'ics':
+        return Response(to_ical(week, f"Timetable - {name}"), mimetype='text/calendar',
+                        headers={'Content-Disposition': f'attachment; filename={kind}-{owner_id}.ics'})
+    return render_template('timetables/weekly_timetable.html', kind=kind, owner_id=owner_id, name=name,
+                           week=week, slot_times=slot_times)
+
+# Route to show a student's weekly timetable
+@app.route('/timetables/student/<int:student_id>')
+def student_timetable(student_id):
+    return render_schedule('student', student_id, student_schedule(student_id), 'html')
+
+# Route to download a student's weekly timetable as an iCalendar feed
+@app.route('/timetables/student/<int:student_id>.ics')
+def student_timetable_ics(student_id):
+    return render_schedule('student', student_id, student_schedule(student_id), 'ics')
+
+# Route to show a teacher's weekly timetable
+@app.route('/timetables/teacher/<int:faculty_id>')
+def teacher_timetable(faculty_id):
+    return render_schedule('teacher', faculty_id, teacher_schedule(faculty_id), 'html')
+
+# Route to download a teacher's weekly timetable as an iCalendar feed
+@app.route('/timetables/teacher/<int:faculty_id>.ics')
+def teacher_timetable_ics(faculty_id):
+    return render_schedule('teacher', faculty_id, teacher_schedule(faculty_id), 'ics')
+
+# Route to expose the weekly timetable cache counters
+@app.route('/timetables/schedule_cache/stats')
+def schedule_cache_stats():
+    return jsonify(schedule_cache.stats())
+
 # -------------------- Enrolled Students --------------------
 
 # Route to list enrolled students
 @app.route('/enrolled_students')
 def list_enrolled_students():
-    cur = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-    cur.execute("""
+    enrolled_students, page = stream_keyset_page(
+        """
         SELECT es.EnrollmentID, s.FirstName, s.LastName, c.CourseName
         FROM enrolledstudents es
         JOIN students s ON es.StudentID = s.StudentID
         JOIN courses c ON es.CourseID = c.CourseID
-    """)  # Corrected column names
-    enrolled_students = cur.fetchall()
-    cur.close()
-    return render_template('enrolled_students/list_enrolled_students.html', enrolled_students=enrolled_students)
+        """,
+        [], [], [('es.EnrollmentID', 'EnrollmentID')]
+    )  # Corrected column names
+    return stream_page('enrolled_students/list_enrolled_students.html', enrolled_students=enrolled_students, page=page)
+
+# Route to export enrollments (optionally for one course and/or semester) as CSV or XLSX
+@app.route('/enrolled_students/export.<fmt>')
+def export_enrolled_students(fmt):
+    where_clauses = []
+    params = []
+    if request.args.get('course_id'):
+        where_clauses.append("es.CourseID = %s")
+        params.append(request.args['course_id'])
+    if request.args.get('semester_id'):
+        where_clauses.append("es.SemesterID = %s")
+        params.append(request.args['semester_id'])
+    where_sql = "WHERE " + " AND ".join(where_clauses) if where_clauses else ""
+    query = f"""
+        SELECT es.EnrollmentID, es.StudentID, s.EnrollmentNo, s.FirstName, s.LastName,
+               es.CourseID, c.CourseName, es.SemesterID, sem.SemesterName
+        FROM enrolledstudents es
+        JOIN students s ON es.StudentID = s.StudentID
+        JOIN courses c ON es.CourseID = c.CourseID
+        LEFT JOIN semesters sem ON es.SemesterID = sem.SemesterID
+        {where_sql}
+        ORDER BY es.EnrollmentID
+    """
+    return export_response(query, tuple(params), fmt, 'enrolled_students')
 
 # Route to add a new enrolled student
 @app.route('/enrolled_students/add', methods=['GET', 'POST'])
 def add_enrolled_student():
-    cur = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-    cur.execute("SELECT * FROM students")
-    students = cur.fetchall()
-    cur.execute("SELECT * FROM courses")
-    courses = cur.fetchall()
-    cur.execute("SELECT * FROM semesters")  # Added semesters for SemesterID
-    semesters = cur.fetchall()
-    cur.close()
+    # Students are picked through the search endpoint instead of one huge dropdown
+    courses = ref_data("SELECT * FROM courses")
+    semesters = ref_data("SELECT * FROM semesters")  # Added semesters for SemesterID
     if request.method == 'POST':
         student_id = request.form['StudentID']
         course_id = request.form['CourseID']
         semester_id = request.form['SemesterID']  # Added SemesterID
         cur = mysql.connection.cursor()
+        enrollment_counts.lock_students(cur, [student_id])
         cur.execute("INSERT INTO enrolledstudents (StudentID, CourseID, SemesterID) VALUES (%s, %s, %s)", (student_id, course_id, semester_id))  # Corrected query
+        enrollment_counts.apply_enrollments(mysql.connection, [(student_id, course_id, semester_id)])
+        change_log.record(mysql.connection, 'enrolledstudents', 'insert', [cur.lastrowid])
         mysql.connection.commit()
+        tables_changed('enrolledstudents')
+        profile_cache.invalidate_owner('student', student_id)
         cur.close()
         return redirect(url_for('list_enrolled_students'))
-    return render_template('enrolled_students/add_enrolled_student.html', students=students, courses=courses, semesters=semesters)
+    return render_template('enrolled_students/add_enrolled_student.html', courses=courses, semesters=semesters)
 
 # Route to delete an enrolled student
 @app.route('/enrolled_students/delete/<int:id>', methods=['POST'])
 def delete_enrolled_student(id):
     try:
         cur = mysql.connection.cursor()
-        cur.execute("DELETE FROM enrolledstudents WHERE EnrollmentID = %s", (id,))  # Corrected column name
+        cur.execute("SELECT StudentID, CourseID, SemesterID FROM enrolledstudents WHERE EnrollmentID = %s", (id,))
+        enrollment = cur.fetchone()
+        if enrollment:
+            enrollment_counts.lock_students(cur, [enrollment[0]])
+            cur.execute("DELETE FROM enrolledstudents WHERE EnrollmentID = %s", (id,))  # Corrected column name
+            enrollment_counts.apply_enrollments(mysql.connection, [enrollment], sign=-1)
+            change_log.record(mysql.connection, 'enrolledstudents', 'delete', [id])
         mysql.connection.commit()
+        tables_changed('enrolledstudents')
+        if enrollment:
+            profile_cache.invalidate_owner('student', enrollment[0])
         cur.close()
         return redirect(url_for('list_enrolled_students'))
     except Exception as e:
@@ -564,8 +1773,9 @@ def delete_enrolled_student(id):
 
 # Route to list enrolled teachers
 @app.route('/enrolled_teachers')
+@conditional_get('enrolledteachers', 'faculty', 'courses')
 def list_enrolled_teachers():
-    cur = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
+    cur = mysql.connection.cursor(DictCursor)
     cur.execute("""
         SELECT et.TeacherID, f.FirstName, f.LastName, c.CourseName
         FROM enrolledteachers et
@@ -580,8 +1790,9 @@ def list_enrolled_teachers():
 
 # Route to list offered courses
 @app.route('/offered_courses')
+@conditional_get('courses', 'departments', 'faculty')
 def list_offered_courses():
-    cur = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
+    cur = mysql.connection.cursor(DictCursor)
     cur.execute("""
         SELECT c.CourseID, c.CourseName, d.DepartmentName, f.FirstName, f.LastName
         FROM courses c
@@ -596,8 +1807,9 @@ def list_offered_courses():
 
 # Route to list semesters
 @app.route('/semesters')
+@conditional_get('semesters')
 def list_semesters():
-    cur = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
+    cur = mysql.connection.cursor(DictCursor)
     cur.execute("SELECT * FROM semesters")
     semesters = cur.fetchall()
     cur.close()
@@ -610,7 +1822,9 @@ def add_semester():
         semester_name = request.form['SemesterName']
         cur = mysql.connection.cursor()
         cur.execute("INSERT INTO semesters (SemesterName) VALUES (%s)", (semester_name,))
+        change_log.record(mysql.connection, 'semesters', 'insert', [cur.lastrowid])
         mysql.connection.commit()
+        tables_changed('semesters')
         cur.close()
         return redirect(url_for('list_semesters'))
     return render_template('semesters/add_semester.html')
@@ -618,7 +1832,7 @@ def add_semester():
 # Route to update a semester
 @app.route('/semesters/update/<int:id>', methods=['GET', 'POST'])
 def update_semester(id):
-    cur = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
+    cur = mysql.connection.cursor(DictCursor)
     cur.execute("SELECT * FROM semesters WHERE SemesterID = %s", (id,))
     semester = cur.fetchone()
     cur.close()
@@ -626,7 +1840,9 @@ def update_semester(id):
         semester_name = request.form['SemesterName']
         cur = mysql.connection.cursor()
         cur.execute("UPDATE semesters SET SemesterName = %s WHERE SemesterID = %s", (semester_name, id))
+        change_log.record(mysql.connection, 'semesters', 'update', [id])
         mysql.connection.commit()
+        tables_changed('semesters')
         cur.close()
         return redirect(url_for('list_semesters'))
     return render_template('semesters/update_semester.html', semester=semester)
@@ -637,19 +1853,39 @@ def delete_semester(id):
     try:
         cur = mysql.connection.cursor()
         cur.execute("DELETE FROM semesters WHERE SemesterID = %s", (id,))
+        change_log.record(mysql.connection, 'semesters', 'delete', [id])
         mysql.connection.commit()
+        tables_changed('semesters')
         cur.close()
         return redirect(url_for('list_semesters'))
     except Exception as e:
         print(f"Error deleting semester: {e}")
         return "An error occurred while deleting the semester.", 500
 
+# Route to show how many students are enrolled in a semester (from the enrollment counters)
+@app.route('/semesters/<int:id>/enrollment')
+def semester_enrollment(id):
+    cur = mysql.connection.cursor(DictCursor)
+    cur.execute("SELECT * FROM semesters WHERE SemesterID = %s", (id,))
+    semester = cur.fetchone()
+    cur.execute("""
+        SELECT Enrollments AS TotalEnrollments, Students AS TotalStudents
+        FROM enrollment_counts
+        WHERE Scope = 'semester' AND ScopeID = %s AND SessionID = 0
+    """, (id,))
+    count = cur.fetchone() or {'TotalEnrollments': 0, 'TotalStudents': 0}
+    cur.close()
+    if semester is None:
+        return "Error: Semester not found.", 404
+    return render_template('semesters/semester_enrollment.html', semester=semester, count=count)
+
 # -------------------- Sessions --------------------
 
 # Route to list sessions
 @app.route('/sessions')
+@conditional_get('sessions')
 def list_sessions():
-    cur = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
+    cur = mysql.connection.cursor(DictCursor)
     cur.execute("SELECT * FROM sessions")
     sessions = cur.fetchall()
     cur.close()
@@ -663,7 +1899,9 @@ def add_session():
         end_year = request.form['EndYear']
         cur = mysql.connection.cursor()
         cur.execute("INSERT INTO sessions (StartYear, EndYear) VALUES (%s, %s)", (start_year, end_year))
+        change_log.record(mysql.connection, 'sessions', 'insert', [cur.lastrowid])
         mysql.connection.commit()
+        tables_changed('sessions')
         cur.close()
         return redirect(url_for('list_sessions'))
     return render_template('sessions/add_session.html')
@@ -671,7 +1909,7 @@ def add_session():
 # Route to update a session
 @app.route('/sessions/update/<int:id>', methods=['GET', 'POST'])
 def update_session(id):
-    cur = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
+    cur = mysql.connection.cursor(DictCursor)
     cur.execute("SELECT * FROM sessions WHERE SessionID = %s", (id,))
     session = cur.fetchone()
     cur.close()
@@ -680,7 +1918,9 @@ def update_session(id):
         end_year = request.form['EndYear']
         cur = mysql.connection.cursor()
         cur.execute("UPDATE sessions SET StartYear = %s, EndYear = %s WHERE SessionID = %s", (start_year, end_year, id))
+        change_log.record(mysql.connection, 'sessions', 'update', [id])
         mysql.connection.commit()
+        tables_changed('sessions')
         cur.close()
         return redirect(url_for('list_sessions'))
     return render_template('sessions/update_session.html', session=session)
@@ -691,7 +1931,9 @@ def delete_session(id):
     try:
         cur = mysql.connection.cursor()
         cur.execute("DELETE FROM sessions WHERE SessionID = %s", (id,))
+        change_log.record(mysql.connection, 'sessions', 'delete', [id])
         mysql.connection.commit()
+        tables_changed('sessions')
         cur.close()
         return redirect(url_for('list_sessions'))
     except Exception as e:
@@ -702,8 +1944,9 @@ def delete_session(id):
 
 # Route to list offered programs
 @app.route('/offered_programs')
+@conditional_get('offered_programs', 'sessions')
 def list_offered_programs():
-    cur = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
+    cur = mysql.connection.cursor(DictCursor)
     cur.execute("""
         SELECT op.ProgramID, op.ProgramName, s.StartYear, s.EndYear
         FROM offered_programs op
@@ -716,16 +1959,15 @@ def list_offered_programs():
 # Route to add a new offered program
 @app.route('/offered_programs/add', methods=['GET', 'POST'])
 def add_offered_program():
-    cur = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-    cur.execute("SELECT * FROM sessions")
-    sessions = cur.fetchall()
-    cur.close()
+    sessions = ref_data("SELECT * FROM sessions")
     if request.method == 'POST':
         program_name = request.form['ProgramName']
         session_id = request.form['SessionID']
         cur = mysql.connection.cursor()
         cur.execute("INSERT INTO offered_programs (ProgramName, SessionID) VALUES (%s, %s)", (program_name, session_id))
+        change_log.record(mysql.connection, 'offered_programs', 'insert', [cur.lastrowid])
         mysql.connection.commit()
+        tables_changed('offered_programs')
         cur.close()
         return redirect(url_for('list_offered_programs'))
     return render_template('offered_programs/add_offered_program.html', sessions=sessions)
@@ -733,11 +1975,10 @@ def add_offered_program():
 # Route to update an offered program
 @app.route('/offered_programs/update/<int:id>', methods=['GET', 'POST'])
 def update_offered_program(id):
-    cur = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
+    cur = mysql.connection.cursor(DictCursor)
     cur.execute("SELECT * FROM offered_programs WHERE ProgramID = %s", (id,))
     program = cur.fetchone()
-    cur.execute("SELECT * FROM sessions")
-    sessions = cur.fetchall()
+    sessions = ref_data("SELECT * FROM sessions")
     cur.close()
     if request.method == 'POST':
         program_name = request.form['ProgramName']
@@ -748,7 +1989,9 @@ def update_offered_program(id):
             SET ProgramName = %s, SessionID = %s
             WHERE ProgramID = %s
         """, (program_name, session_id, id))
+        change_log.record(mysql.connection, 'offered_programs', 'update', [id])
         mysql.connection.commit()
+        tables_changed('offered_programs')
         cur.close()
         return redirect(url_for('list_offered_programs'))
     return render_template('offered_programs/update_offered_program.html', program=program, sessions=sessions)
@@ -759,7 +2002,9 @@ def delete_offered_program(id):
     try:
         cur = mysql.connection.cursor()
         cur.execute("DELETE FROM offered_programs WHERE ProgramID = %s", (id,))
+        change_log.record(mysql.connection, 'offered_programs', 'delete', [id])
         mysql.connection.commit()
+        tables_changed('offered_programs')
         cur.close()
         return redirect(url_for('list_offered_programs'))
     except Exception as e:
@@ -770,8 +2015,9 @@ def delete_offered_program(id):
 
 # Route to list current semesters
 @app.route('/current_semester')
+@conditional_get('current_semester', 'offered_programs', 'semesters')
 def list_current_semester():
-    cur = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
+    cur = mysql.connection.cursor(DictCursor)
     cur.execute("""
         SELECT cs.CurrentSemesterID, op.ProgramName, s.SemesterName, cs.StartDate, cs.EndDate
         FROM current_semester cs
@@ -785,12 +2031,8 @@ def list_current_semester():
 # Route to add a new current semester
 @app.route('/current_semester/add', methods=['GET', 'POST'])
 def add_current_semester():
-    cur = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-    cur.execute("SELECT * FROM offered_programs")
-    programs = cur.fetchall()
-    cur.execute("SELECT * FROM semesters")
-    semesters = cur.fetchall()
-    cur.close()
+    programs = ref_data("SELECT * FROM offered_programs")
+    semesters = ref_data("SELECT * FROM semesters")
     if request.method == 'POST':
         program_id = request.form['ProgramID']
         semester_id = request.form['SemesterID']
@@ -801,7 +2043,9 @@ def add_current_semester():
             INSERT INTO current_semester (ProgramID, SemesterID, StartDate, EndDate)
             VALUES (%s, %s, %s, %s)
         """, (program_id, semester_id, start_date, end_date))
+        change_log.record(mysql.connection, 'current_semester', 'insert', [cur.lastrowid])
         mysql.connection.commit()
+        tables_changed('current_semester')
         cur.close()
         return redirect(url_for('list_current_semester'))
     return render_template('current_semester/add_current_semester.html', programs=programs, semesters=semesters)
@@ -812,7 +2056,9 @@ def delete_current_semester(id):
     try:
         cur = mysql.connection.cursor()
         cur.execute("DELETE FROM current_semester WHERE CurrentSemesterID = %s", (id,))
+        change_log.record(mysql.connection, 'current_semester', 'delete', [id])
         mysql.connection.commit()
+        tables_changed('current_semester')
         cur.close()
         return redirect(url_for('list_current_semester'))
     except Exception as e:
@@ -824,19 +2070,15 @@ def delete_current_semester(id):
 # Route to list assigned courses to students
 @app.route('/assign_courses_to_student')
 def list_assign_courses_to_student():
-    cur = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
     # Fetch filter options
-    cur.execute("SELECT ProgramID, ProgramName FROM offered_programs")
-    programs = cur.fetchall()
-    cur.execute("SELECT SessionID, StartYear, EndYear FROM sessions")
-    sessions = cur.fetchall()
-    cur.execute("""
+    programs = ref_data("SELECT ProgramID, ProgramName FROM offered_programs")
+    sessions = ref_data("SELECT SessionID, StartYear, EndYear FROM sessions")
+    current_semesters = ref_data("""
         SELECT cs.CurrentSemesterID, op.ProgramName, s.SemesterName
         FROM current_semester cs
         JOIN offered_programs op ON cs.ProgramID = op.ProgramID
         JOIN semesters s ON cs.SemesterID = s.SemesterID
     """)
-    current_semesters = cur.fetchall()
 
     # Get filter values from query string
     program_id = request.args.get('program_id')
@@ -846,19 +2088,22 @@ def list_assign_courses_to_student():
     # Build dynamic WHERE clause
     where_clauses = []
     params = []
+    filters = {}
     if program_id:
         where_clauses.append("a.ProgramID = %s")
         params.append(program_id)
+        filters['program_id'] = program_id
     if session_id:
         where_clauses.append("a.SessionID = %s")
         params.append(session_id)
+        filters['session_id'] = session_id
     if current_semester_id:
         where_clauses.append("a.CurrentSemesterID = %s")
         params.append(current_semester_id)
-    where_sql = "WHERE " + " AND ".join(where_clauses) if where_clauses else ""
+        filters['current_semester_id'] = current_semester_id
 
-    query = f"""
-        SELECT a.AssignID, s.FirstName, s.LastName, op.ProgramName, se.StartYear, se.EndYear,
+    query = """
+        SELECT a.AssignID, a.StudentID, s.FirstName, s.LastName, op.ProgramName, se.StartYear, se.EndYear,
                sem.SemesterName, c.CourseName
         FROM assign_courses_to_student a
         JOIN students s ON a.StudentID = s.StudentID
@@ -867,70 +2112,625 @@ def list_assign_courses_to_student():
         JOIN current_semester cs ON a.CurrentSemesterID = cs.CurrentSemesterID
         JOIN semesters sem ON cs.SemesterID = sem.SemesterID
         JOIN courses c ON a.CourseID = c.CourseID
-        {where_sql}
     """
-    cur.execute(query, tuple(params))
-    assignments = cur.fetchall()
+    cur = mysql.connection.cursor(DictCursor)
+    assignments, page = fetch_keyset_page(cur, query, where_clauses, params, [('a.AssignID', 'AssignID')])
     cur.close()
+
+    # Group the page's assignments per student/program/semester for display
+    grouped = {}
+    for a in assignments:
+        key = (a['StudentID'], f"{a['FirstName']} {a['LastName']}", a['ProgramName'],
+               f"{a['StartYear']}-{a['EndYear']}", a['SemesterName'])
+        grouped.setdefault(key, []).append(a)
     return render_template(
         'assign_courses_to_student/list_assign_courses_to_student.html',
         assignments=assignments,
+        grouped=grouped,
         programs=programs,
         sessions=sessions,
         current_semesters=current_semesters,
         selected_program_id=program_id,
         selected_session_id=session_id,
-        selected_current_semester_id=current_semester_id
+        selected_current_semester_id=current_semester_id,
+        filters=filters,
+        page=page
     )
 
 # Route to assign a course to a student
 @app.route('/assign_courses_to_student/add', methods=['GET', 'POST'])
 def add_assign_courses_to_student():
-    cur = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-    cur.execute("SELECT * FROM students")
-    students = cur.fetchall()
-    cur.execute("SELECT op.ProgramID, op.ProgramName, op.SessionID, s.StartYear, s.EndYear FROM offered_programs op JOIN sessions s ON op.SessionID = s.SessionID")
-    programs = cur.fetchall()
-    cur.execute("SELECT * FROM courses")
-    courses = cur.fetchall()
-    cur.close()
-
-    # For GET, show all current semesters (with program/session info for filtering in JS)
-    cur = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-    cur.execute("""
-        SELECT cs.CurrentSemesterID, cs.ProgramID, cs.SemesterID, op.ProgramName, s.SemesterName
-        FROM current_semester cs
-        JOIN offered_programs op ON cs.ProgramID = op.ProgramID
-        JOIN semesters s ON cs.SemesterID = s.SemesterID
-    """)
-    current_semesters = cur.fetchall()
-    cur.close()
-
     if request.method == 'POST':
         student_id = request.form['StudentID']
         program_id = request.form['ProgramID']
-        # Find session_id for the selected program
-        session_id = None
-        for p in programs:
-            if str(p['ProgramID']) == str(program_id):
-                session_id = p['SessionID']
-                break
         current_semester_id = request.form['CurrentSemesterID']
         course_id = request.form['CourseID']
         cur = mysql.connection.cursor()
+        session_id = program_session(cur, program_id)
+        enrollment_counts.lock_students(cur, [student_id])
         cur.execute("""
             INSERT INTO assign_courses_to_student
             (StudentID, ProgramID, SessionID, CurrentSemesterID, CourseID)
             VALUES (%s, %s, %s, %s, %s)
         """, (student_id, program_id, session_id, current_semester_id, course_id))
+        enrollment_counts.apply_assignments(mysql.connection, [(student_id, program_id, session_id)])
+        change_log.record(mysql.connection, 'assign_courses_to_student', 'insert', [cur.lastrowid])
         mysql.connection.commit()
+        tables_changed('assign_courses_to_student')
+        schedule_cache.invalidate_owner('student', student_id)
+        profile_cache.invalidate_owner('student', student_id)
         cur.close()
         return redirect(url_for('list_assign_courses_to_student'))
+    students = ref_data("SELECT * FROM students")
     return render_template(
         'assign_courses_to_student/add_assign_courses_to_student.html',
-        students=students, programs=programs, current_semesters=current_semesters, courses=courses
+        students=students, programs=assignable_programs(), current_semesters=assignable_semesters(),
+        courses=ref_data("SELECT * FROM courses")
+    )
+
+# Route to assign the same courses to a whole cohort: every student of the offered program
+# (students.ProgramID; the program fixes the session) gets each selected course in the chosen
+# current semester of that program, including a new intake with no assignments yet. One
+# set-based INSERT ... SELECT in one transaction; courses a student already has in that
+# semester are skipped.
+@app.route('/assign_courses_to_student/cohort', methods=['GET', 'POST'])
+def assign_cohort_courses():
+    courses = ref_data("SELECT CourseID, CourseName FROM courses")
+    result = None
+    if request.method == 'POST':
+        program_id = request.form['ProgramID']
+        current_semester_id = request.form['CurrentSemesterID']
+        known = {str(c['CourseID']) for c in courses}
+        course_ids = sorted({course_id for course_id in request.form.getlist('CourseID') if course_id in known}, key=int)
+        if not course_ids:
+            return "Error: Select at least one course.", 400
+        cur = mysql.connection.cursor()
+        try:
+            session_id = program_session(cur, program_id)
+            if session_id is None:
+                mysql.connection.rollback()
+                return "Error: Unknown program.", 400
+            cur.execute("SELECT ProgramID FROM current_semester WHERE CurrentSemesterID = %s", (current_semester_id,))
+            semester = cur.fetchone()
+            if semester is None or str(semester[0]) != str(program_id):
+                mysql.connection.rollback()
+                return "Error: The current semester does not belong to the selected program.", 400
+            # Lock the cohort so the counters below see every student's rows (see enrollment_counts)
+            cur.execute("SELECT StudentID FROM students WHERE ProgramID = %s FOR UPDATE", (program_id,))
+            students = len(cur.fetchall())
+            placeholders = ', '.join(['%s'] * len(course_ids))
+            cur.execute(f"""
+                SELECT COUNT(*) FROM students s
+                CROSS JOIN courses c
+                WHERE s.ProgramID = %s AND c.CourseID IN ({placeholders})
+                  AND EXISTS (
+                      SELECT 1 FROM assign_courses_to_student x
+                      WHERE x.StudentID = s.StudentID AND x.CurrentSemesterID = %s AND x.CourseID = c.CourseID
+                  )
+            """, (program_id, *course_ids, current_semester_id))
+            skipped = cur.fetchone()[0]
+            last_id = change_log.last_key(mysql.connection, 'assign_courses_to_student')
+            cur.execute(f"""
+                INSERT INTO assign_courses_to_student (StudentID, ProgramID, SessionID, CurrentSemesterID, CourseID)
+                SELECT s.StudentID, %s, %s, %s, c.CourseID
+                FROM students s
+                CROSS JOIN courses c
+                WHERE s.ProgramID = %s AND c.CourseID IN ({placeholders})
+                  AND NOT EXISTS (
+                      SELECT 1 FROM assign_courses_to_student x
+                      WHERE x.StudentID = s.StudentID AND x.CurrentSemesterID = %s AND x.CourseID = c.CourseID
+                  )
+            """, (program_id, session_id, current_semester_id, program_id, *course_ids, current_semester_id))
+            cur.execute("SELECT StudentID, ProgramID, SessionID FROM assign_courses_to_student WHERE AssignID > %s",
+                        (last_id,))
+            added = cur.fetchall()
+            inserted = len(added)
+            enrollment_counts.apply_assignments(mysql.connection, added)
+            change_log.record_where(mysql.connection, 'assign_courses_to_student', 'insert', "AssignID > %s", (last_id,))
+            mysql.connection.commit()
+        except Exception as e:
+            mysql.connection.rollback()
+            print(f"Error assigning cohort courses: {e}")
+            return "An error occurred while assigning the courses to the cohort.", 500
+        finally:
+            cur.close()
+        tables_changed('assign_courses_to_student')
+        schedule_cache.clear()
+        profile_cache.clear()
+        result = {'students': students, 'courses': len(course_ids), 'inserted': inserted, 'skipped': skipped}
+    return render_template('assign_courses_to_student/assign_cohort.html', programs=assignable_programs(),
+                           current_semesters=assignable_semesters(), courses=courses, result=result)
+
+# Offered programs with their session, for the assignment forms
+def assignable_programs():
+    return ref_data("SELECT op.ProgramID, op.ProgramName, op.SessionID, s.StartYear, s.EndYear FROM offered_programs op JOIN sessions s ON op.SessionID = s.SessionID")
+
+# All current semesters (with program/session info for filtering in JS)
+def assignable_semesters():
+    return ref_data("""
+        SELECT cs.CurrentSemesterID, cs.ProgramID, cs.SemesterID, op.ProgramName, s.SemesterName
+        FROM current_semester cs
+        JOIN offered_programs op ON cs.ProgramID = op.ProgramID
+        JOIN semesters s ON cs.SemesterID = s.SemesterID
+    """)
+
+# SessionID of an offered program (None if there is no such program)
+def program_session(cur, program_id):
+    cur.execute("SELECT SessionID FROM offered_programs WHERE ProgramID = %s", (program_id,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+# -------------------- Student Profile Lookup --------------------
+
+# Per-student lookups, kept for STUDENT_PROFILE_CACHE_TTL seconds
+profile_cache = ScheduleCache(app.config['STUDENT_PROFILE_CACHE_TTL'])
+
+# Everything the lookup shows, in one statement so it is a single round trip: the student row,
+# their course assignments and their enrollments with attendance totals, told apart by Section.
+# Each branch reads the student's rows through an index on StudentID that covers it
+# (idx_assign_student_profile, idx_enrolled_student_course, the attendance_summary key).
+STUDENT_PROFILE_SQL = """
+    SELECT 'student' AS Section, s.StudentID AS RowID, s.FirstName, s.LastName, s.EnrollmentNo,
+           NULL AS CurrentSemesterID, NULL AS ProgramName, NULL AS StartYear, NULL AS EndYear,
+           NULL AS SemesterName, NULL AS CourseID, NULL AS CourseName, NULL AS Allowed, NULL AS Is_Repeater,
+           NULL AS PresentCount, NULL AS AbsentCount
+    FROM students s
+    WHERE s.StudentID = %s
+    UNION ALL
+    SELECT 'assigned', a.AssignID, NULL, NULL, NULL,
+           a.CurrentSemesterID, op.ProgramName, se.StartYear, se.EndYear,
+           sem.SemesterName, a.CourseID, c.CourseName, a.Allowed, a.Is_Repeater,
+           NULL, NULL
+    FROM assign_courses_to_student a
+    LEFT JOIN offered_programs op ON a.ProgramID = op.ProgramID
+    LEFT JOIN sessions se ON a.SessionID = se.SessionID
+    LEFT JOIN current_semester cs ON a.CurrentSemesterID = cs.CurrentSemesterID
+    LEFT JOIN semesters sem ON cs.SemesterID = sem.SemesterID
+    LEFT JOIN courses c ON a.CourseID = c.CourseID
+    WHERE a.StudentID = %s
+    UNION ALL
+    SELECT 'enrolled', es.EnrollmentID, NULL, NULL, NULL,
+           es.SemesterID, NULL, NULL, NULL,
+           sem.SemesterName, es.CourseID, c.CourseName, NULL, NULL,
+           x.PresentCount, x.AbsentCount
+    FROM enrolledstudents es
+    LEFT JOIN semesters sem ON es.SemesterID = sem.SemesterID
+    LEFT JOIN courses c ON es.CourseID = c.CourseID
+    LEFT JOIN attendance_summary x
+           ON x.CourseID = es.CourseID AND x.SemesterID = es.SemesterID AND x.StudentID = es.StudentID
+    WHERE es.StudentID = %s
+    ORDER BY Section, CurrentSemesterID DESC, CourseName
+"""
+
+# The lookup of one student: {'student', 'current' (their latest assignment, for the program,
+# session and semester), 'courses' (assignments), 'enrollments'}; student is None if unknown
+def student_profile(student_id):
+    def load():
+        cur = mysql.connection.cursor(DictCursor)
+        cur.execute(STUDENT_PROFILE_SQL, (student_id, student_id, student_id))
+        rows = cur.fetchall()
+        cur.close()
+        profile = {'student': None, 'current': None, 'courses': [], 'enrollments': []}
+        for row in rows:
+            if row['Section'] == 'student':
+                profile['student'] = {'StudentID': row['RowID'], 'FirstName': row['FirstName'],
+                                      'LastName': row['LastName'], 'EnrollmentNo': row['EnrollmentNo']}
+            elif row['Section'] == 'assigned':
+                profile['courses'].append(row)
+            else:
+                row['Percentage'] = (attendance_summary.percentage(row['PresentCount'], row['AbsentCount'])
+                                     if row['PresentCount'] is not None else None)
+                profile['enrollments'].append(row)
+        profile['current'] = profile['courses'][0] if profile['courses'] else None
+        return profile, ()
+    return profile_cache.get('student', student_id, load)
+
+# Route to look up a student's assigned courses, enrollments and attendance by StudentID
+@app.route('/assign_courses_to_student/by_id', methods=['GET', 'POST'])
+def assign_courses_by_id():
+    student_id = request.values.get('StudentID', type=int)
+    if student_id is None:
+        return render_template('assign_courses_to_student/assign_courses_by_id.html', student_id=None)
+    profile = student_profile(student_id)
+    return render_template('assign_courses_to_student/assign_courses_by_id.html', student_id=student_id, **profile)
+
+# Route to expose the student lookup cache counters
+@app.route('/students/profile_cache/stats')
+def profile_cache_stats():
+    return jsonify(profile_cache.stats())
+
+# -------------------- Enrollment Statistics --------------------
+
+# Counter rows of each statistics scope with the name they are shown under
+ENROLLMENT_STATS_QUERIES = {
+    'semester': """
+        SELECT x.ScopeID, x.SessionID, sem.SemesterName AS Name, x.Enrollments, x.Students
+        FROM enrollment_counts x
+        LEFT JOIN semesters sem ON x.ScopeID = sem.SemesterID
+    """,
+    'course': """
+        SELECT x.ScopeID, x.SessionID, c.CourseName AS Name, x.Enrollments, x.Students
+        FROM enrollment_counts x
+        LEFT JOIN courses c ON x.ScopeID = c.CourseID
+    """,
+    'program': """
+        SELECT x.ScopeID, x.SessionID, CONCAT(op.ProgramName, ' ', se.StartYear, '-', se.EndYear) AS Name,
+               x.Enrollments, x.Students
+        FROM enrollment_counts x
+        LEFT JOIN offered_programs op ON x.ScopeID = op.ProgramID
+        LEFT JOIN sessions se ON x.SessionID = se.SessionID
+    """,
+    'department': """
+        SELECT x.ScopeID, x.SessionID, d.DepartmentName AS Name, x.Enrollments, x.Students
+        FROM enrollment_counts x
+        LEFT JOIN departments d ON x.ScopeID = d.DepartmentID
+    """,
+}
+
+# Route to show enrollment and distinct student counts per semester, course, program/session
+# or department, read from the enrollment counters
+@app.route('/reports/enrollment')
+@app.route('/reports/enrollment/<scope>')
+def enrollment_stats(scope='semester'):
+    if scope not in ENROLLMENT_STATS_QUERIES:
+        return "Error: Unknown statistics scope.", 404
+    cur = mysql.connection.cursor(DictCursor)
+    cur.execute(ENROLLMENT_STATS_QUERIES[scope] + """
+        WHERE x.Scope = %s AND x.Enrollments > 0
+        ORDER BY x.Students DESC, x.ScopeID, x.SessionID
+    """, (scope,))
+    rows = cur.fetchall()
+    cur.close()
+    totals = enrollment_counts.totals(mysql.connection)
+    return render_template('reports/enrollment_stats.html', scope=scope, scopes=enrollment_counts.SCOPES,
+                           rows=rows, totals=totals)
+
+# Command to recount the enrollment counters from the tables: flask reconcile-enrollment-counts
+@app.cli.command('reconcile-enrollment-counts')
+def reconcile_enrollment_counts():
+    corrected = enrollment_counts.reconcile(mysql.connection)
+    print(f"Reconciled enrollment counts: {corrected} counters corrected")
+
+# -------------------- Attendance Reports --------------------
+
+# Route to show each student's attendance percentage in a course for one semester.
+# Reads attendance_summary by primary key range (CourseID, SemesterID, StudentID).
+@app.route('/reports/attendance/course/<int:course_id>')
+def course_attendance_report(course_id):
+    cur = mysql.connection.cursor(DictCursor)
+    cur.execute("SELECT CourseID, CourseName FROM courses WHERE CourseID = %s", (course_id,))
+    course = cur.fetchone()
+    cur.execute("""
+        SELECT DISTINCT x.SemesterID, sem.SemesterName
+        FROM attendance_summary x
+        LEFT JOIN semesters sem ON x.SemesterID = sem.SemesterID
+        WHERE x.CourseID = %s
+        ORDER BY x.SemesterID DESC
+    """, (course_id,))
+    semesters = cur.fetchall()
+    semester_id = request.args.get('semester_id') or (str(semesters[0]['SemesterID']) if semesters else '0')
+    rows, page = fetch_keyset_page(
+        cur,
+        """
+        SELECT x.StudentID, s.EnrollmentNo, s.FirstName, s.LastName, x.PresentCount, x.AbsentCount
+        FROM attendance_summary x
+        JOIN students s ON x.StudentID = s.StudentID
+        """,
+        ["x.CourseID = %s", "x.SemesterID = %s"], [course_id, semester_id],
+        [('x.StudentID', 'StudentID')]
     )
+    cur.close()
+    for row in rows:
+        row['Percentage'] = attendance_summary.percentage(row['PresentCount'], row['AbsentCount'])
+    return render_template('reports/course_attendance.html', course=course, semesters=semesters,
+                           semester_id=semester_id, rows=rows, page=page)
+
+# Route to show one student's attendance percentage in every course
+@app.route('/reports/attendance/student/<int:student_id>')
+def student_attendance_report(student_id):
+    cur = mysql.connection.cursor(DictCursor)
+    cur.execute("SELECT StudentID, FirstName, LastName, EnrollmentNo FROM students WHERE StudentID = %s", (student_id,))
+    student = cur.fetchone()
+    cur.execute("""
+        SELECT x.CourseID, c.CourseName, x.SemesterID, sem.SemesterName, x.PresentCount, x.AbsentCount
+        FROM attendance_summary x
+        JOIN courses c ON x.CourseID = c.CourseID
+        LEFT JOIN semesters sem ON x.SemesterID = sem.SemesterID
+        WHERE x.StudentID = %s
+        ORDER BY x.SemesterID DESC, c.CourseName
+    """, (student_id,))
+    rows = cur.fetchall()
+    cur.close()
+    for row in rows:
+        row['Percentage'] = attendance_summary.percentage(row['PresentCount'], row['AbsentCount'])
+    return render_template('reports/student_attendance.html', student=student, rows=rows)
+
+# Command to (re)build attendance_summary from the attendance table: flask rebuild-attendance-summary
+@app.cli.command('rebuild-attendance-summary')
+def rebuild_attendance_summary():
+    rows = attendance_summary.rebuild(mysql.connection)
+    print(f"Rebuilt attendance summary: {rows} rows")
+
+# -------------------- Attendance Analytics --------------------
+
+# Rows shown on an analytics page; the CSV download has all of them
+ANALYTICS_MAX_ROWS = 1000
+
+# The semester list and the semester picked on an analytics page (the latest by default)
+def analytics_semester():
+    semesters = ref_data("SELECT SemesterID, SemesterName FROM semesters ORDER BY SemesterID DESC")
+    semester_id = request.args.get('semester_id') or (str(semesters[0]['SemesterID']) if semesters else '0')
+    return semesters, semester_id
+
+def course_names():
+    return {course['CourseID']: course['CourseName'] for course in ref_data("SELECT CourseID, CourseName FROM courses")}
+
+# Students by StudentID for a list of ids, looked up in chunks of EXPORT_CHUNK_ROWS
+def students_by_id(student_ids):
+    student_ids = list(dict.fromkeys(student_ids))
+    students = {}
+    cur = mysql.connection.cursor(DictCursor)
+    for start in range(0, len(student_ids), EXPORT_CHUNK_ROWS):
+        chunk = student_ids[start:start + EXPORT_CHUNK_ROWS]
+        placeholders = ', '.join(['%s'] * len(chunk))
+        cur.execute(f"SELECT StudentID, EnrollmentNo, FirstName, LastName FROM students WHERE StudentID IN ({placeholders})", tuple(chunk))
+        students.update((row['StudentID'], row) for row in cur.fetchall())
+    cur.close()
+    return students
+
+# CSV download of a header row and data rows
+def csv_download(rows, name):
+    return Response(generate_csv(rows), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename={name}.csv'})
+
+# Route to list the students below the attendance threshold (75% by default) in a semester,
+# lowest first, as a page or CSV
+@app.route('/reports/analytics/defaulters')
+@app.route('/reports/analytics/defaulters.<fmt>')
+def defaulters_report(fmt='html'):
+    if attendance_analytics.np is None:
+        return "Error: Attendance analytics requires the numpy package.", 501
+    if fmt not in ('html', 'csv'):
+        return "Error: Unknown format.", 404
+    semesters, semester_id = analytics_semester()
+    threshold = request.args.get('threshold', attendance_analytics.DEFAULTER_THRESHOLD, type=float)
+    data = attendance_analytics.load_semester(mysql.connection, semester_id, request.args.get('course_id', type=int))
+    defaulters = data.defaulters(threshold)
+    shown = defaulters if fmt == 'csv' else defaulters[:ANALYTICS_MAX_ROWS]
+    students = students_by_id([student_id for student_id, *_ in shown])
+    courses = course_names()
+    rows = []
+    for student_id, course_id, present, total, percentage in shown:
+        student = students.get(student_id, {})
+        rows.append({'StudentID': student_id, 'EnrollmentNo': student.get('EnrollmentNo'),
+                     'FirstName': student.get('FirstName'), 'LastName': student.get('LastName'),
+                     'CourseID': course_id, 'CourseName': courses.get(course_id),
+                     'Present': present, 'Total': total, 'Percentage': percentage})
+    if fmt == 'csv':
+        columns = ['StudentID', 'EnrollmentNo', 'FirstName', 'LastName', 'CourseID', 'CourseName', 'Present', 'Total', 'Percentage']
+        return csv_download([columns] + [[row[column] for column in columns] for row in rows], f'defaulters_semester_{semester_id}')
+    return render_template('reports/defaulters.html', semesters=semesters, semester_id=semester_id,
+                           threshold=threshold, rows=rows, total=len(defaulters), marks=data.marks)
+
+# Route to show each course's attendance percentage week by week in a semester
+@app.route('/reports/analytics/trends')
+@app.route('/reports/analytics/trends.<fmt>')
+def attendance_trends_report(fmt='html'):
+    if attendance_analytics.np is None:
+        return "Error: Attendance analytics requires the numpy package.", 501
+    if fmt not in ('html', 'csv'):
+        return "Error: Unknown format.", 404
+    semesters, semester_id = analytics_semester()
+    data = attendance_analytics.load_semester(mysql.connection, semester_id, request.args.get('course_id', type=int))
+    course_ids, weeks, rates = data.weekly_trends()
+    courses = course_names()
+    if fmt == 'csv':
+        rows = [['CourseID', 'CourseName', 'WeekStart', 'AttendancePercentage']]
+        for course_id, course_rates in zip(course_ids, rates):
+            rows += [[course_id, courses.get(course_id), week, rate]
+                     for week, rate in zip(weeks, course_rates) if rate is not None]
+        return csv_download(rows, f'attendance_trends_semester_{semester_id}')
+    return render_template('reports/attendance_trends.html', semesters=semesters, semester_id=semester_id,
+                           weeks=weeks, rows=[(course_id, courses.get(course_id), course_rates)
+                                              for course_id, course_rates in zip(course_ids, rates)])
+
+# Route to show how often each course's classes are missed on each day of the week
+@app.route('/reports/analytics/heatmap')
+@app.route('/reports/analytics/heatmap.<fmt>')
+def absence_heatmap_report(fmt='html'):
+    if attendance_analytics.np is None:
+        return "Error: Attendance analytics requires the numpy package.", 501
+    if fmt not in ('html', 'csv'):
+        return "Error: Unknown format.", 404
+    semesters, semester_id = analytics_semester()
+    data = attendance_analytics.load_semester(mysql.connection, semester_id)
+    course_ids, weekdays, rates = data.absence_heatmap()
+    courses = course_names()
+    if fmt == 'csv':
+        rows = [['CourseID', 'CourseName'] + weekdays]
+        rows += [[course_id, courses.get(course_id)] + course_rates for course_id, course_rates in zip(course_ids, rates)]
+        return csv_download(rows, f'absence_heatmap_semester_{semester_id}')
+    return render_template('reports/absence_heatmap.html', semesters=semesters, semester_id=semester_id,
+                           weekdays=weekdays, rows=[(course_id, courses.get(course_id), course_rates)
+                                                    for course_id, course_rates in zip(course_ids, rates)])
+
+# -------------------- Schema --------------------
+
+# Command to apply pending schema migrations: flask migrate [--to VERSION]
+@app.cli.command('migrate')
+@click.option('--to', 'target', type=int, default=None, help='Stop after this version.')
+def migrate_schema(target):
+    applied = migrations.migrate(mysql.connection, target=target)
+    print(f"Schema at version {migrations.current_version(mysql.connection)} ({len(applied)} applied)")
+
+# Command to EXPLAIN every query in app.py and list full table scans: flask check-queries.
+# Exits non-zero when a full scan is found or a query cannot be explained.
+@app.cli.command('check-queries')
+def check_queries():
+    results = migrations.explain_queries(mysql.connection, __file__)
+    flagged = 0
+    failed = 0
+    for line, sql, findings, error in results:
+        if error:
+            failed += 1
+            print(f"app.py:{line}: could not explain ({error}): {sql[:100]}")
+        for table, access, rows in findings:
+            flagged += 1
+            print(f"app.py:{line}: full scan of {table} (type={access}, rows={rows}): {sql[:100]}")
+    print(f"{len(results)} queries checked: {flagged} full scans found, {failed} could not be explained")
+    if flagged or failed:
+        raise SystemExit(1)
+
+# -------------------- Templates --------------------
+
+# Load every template into the environment (and its bytecode into the cache); returns their number
+def compile_templates():
+    names = app.jinja_env.list_templates(extensions=['html'])
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+# Command to compile every template into the bytecode cache ahead of the first requests:
+# flask precompile-templates
+@app.cli.command('precompile-templates')
+def precompile_templates():
+    count = compile_templates()
+    print(f"Compiled {count} templates into {app.config['JINJA_BYTECODE_CACHE_DIR']}")
+
+# -------------------- Bulk Import --------------------
+
+# Route to bulk import students, faculty, courses or enrollments from an uploaded CSV file
+@app.route('/import/<entity>', methods=['GET', 'POST'])
+def bulk_import(entity):
+    if entity not in IMPORT_SPECS:
+        return "Error: Unknown import type.", 404
+    columns = IMPORT_SPECS[entity]['columns']
+    result = None
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            return "Error: No CSV file uploaded.", 400
+        result = import_rows(mysql.connection, entity, read_csv(upload.stream))
+        tables_changed(IMPORT_SPECS[entity]['table'])
+        if entity == 'enrolled_students':
+            profile_cache.clear()
+    return render_template('imports/import_csv.html', entity=entity, columns=columns, result=result)
+
+# -------------------- Change Feed --------------------
+
+# Changes (or snapshot rows) returned per request by default and at most
+CHANGES_LIMIT = 500
+CHANGES_MAX_LIMIT = 5000
+
+# The request's `limit` argument, within 1..CHANGES_MAX_LIMIT
+def changes_limit():
+    return max(1, min(request.args.get('limit', CHANGES_LIMIT, type=int), CHANGES_MAX_LIMIT))
+
+# Route for downstream systems to pull the changes after their cursor (see change_log.py):
+# GET /changes?since=<cursor>&limit=N. A cursor behind the compaction horizon is answered
+# with 410, and the consumer bootstraps again from /changes/snapshot.
+@app.route('/changes')
+def list_changes():
+    since = request.args.get('since', 0, type=int)
+    try:
+        changes, cursor, more = change_log.read_since(mysql.connection, since, changes_limit(),
+                                                      app.config['CHANGE_FEED_SETTLE_SECONDS'])
+    except change_log.CursorExpired as e:
+        return jsonify({'error': str(e), 'horizon': e.horizon, 'snapshot': url_for('change_snapshot')}), 410
+    return jsonify({'changes': changes, 'cursor': cursor, 'more': more})
+
+# Route to bootstrap a consumer without scraping the list pages. Without `table` it answers
+# the tables to copy and the cursor to follow /changes from afterwards; with
+# ?table=<name>&after=<key> a page of that table's current rows in primary key order, and
+# `next`, the `after` of the following page (null after the last one).
+@app.route('/changes/snapshot')
+def change_snapshot():
+    table = request.args.get('table')
+    if table is None:
+        cursor = change_log.position(mysql.connection, app.config['CHANGE_FEED_SETTLE_SECONDS'])
+        return jsonify({'tables': change_log.KEYS, 'cursor': cursor})
+    if table not in change_log.KEYS:
+        return jsonify({'error': f"Unknown table {table}"}), 404
+    limit = changes_limit()
+    rows = change_log.snapshot(mysql.connection, table, request.args.get('after', 0, type=int), limit)
+    next_key = rows[-1][change_log.KEYS[table]] if len(rows) == limit else None
+    return jsonify({'table': table, 'rows': rows, 'next': next_key})
+
+# Command to compact the change log: flask compact-change-log [--tombstone-days N]
+@app.cli.command('compact-change-log')
+@click.option('--tombstone-days', type=int, default=change_log.TOMBSTONE_DAYS, help='Keep deletes this many days.')
+def compact_change_log(tombstone_days):
+    removed = change_log.compact(mysql.connection, tombstone_days, app.config['CHANGE_FEED_SETTLE_SECONDS'])
+    print(f"Compacted change log: {removed} changes removed, horizon at {change_log.horizon(mysql.connection)}")
+
+# -------------------- Serving --------------------
+
+# Whether this process has opened its connections and loaded its indexes (see warm_up)
+_warm = False
+
+# Re-apply the settings the module-level caches were built with at import time, after the
+# configuration has changed
+def apply_cache_settings():
+    refdata_cache.ttl = app.config['REFDATA_CACHE_TTL']
+    table_versions.bucket_seconds = app.config['ETAG_MAX_AGE']
+    schedule_cache.ttl = app.config['SCHEDULE_CACHE_TTL']
+    profile_cache.ttl = app.config['STUDENT_PROFILE_CACHE_TTL']
+    os.makedirs(app.config['JINJA_BYTECODE_CACHE_DIR'], exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['JINJA_BYTECODE_CACHE_DIR'])
+
+# Application factory for WSGI servers (see gunicorn.conf.py). Applies `config`, then every
+# FLASK_* environment variable (FLASK_MYSQL_HOST=db1, FLASK_MYSQL_POOL_MAX_SIZE=20, ...), to
+# the caches as well, and compiles the templates, so with a preloading server the workers are
+# forked with them already in memory. The connection pool is built on first use and every
+# other setting is read when it is used, so all of them take the overrides.
+def create_app(config=None):
+    app.config.update(config or {})
+    app.config.from_prefixed_env()
+    apply_cache_settings()
+    compile_templates()
+    return app
+
+# Get a worker ready before it takes traffic: fill its connection pool and load the timetable
+# index and the reference data the busiest forms use. A database that cannot be reached is
+# logged rather than raised, so the worker still starts and /healthz reports it.
+def warm_up():
+    global _warm
+    compile_templates()
+    try:
+        with app.app_context():
+            mysql.pool.fill()
+            timetable_index()
+            ref_data("SELECT CourseID, CourseName FROM courses")
+            ref_data("SELECT * FROM semesters")
+        _warm = True
+    except (PoolExhausted, *DATABASE_ERRORS) as e:
+        metrics.logger.warning("Warm-up could not reach the database: %s", e)
+
+# Let a worker go quietly: write out queued attendance marks and close its idle connections
+def shutdown_worker():
+    if app.config['ATTENDANCE_WRITE_BEHIND'] and _attendance_queue is not None:
+        try:
+            while _attendance_queue.drain_once():
+                pass
+        except Exception as e:
+            # The marks stay in the log for the next worker
+            metrics.logger.warning("Could not flush queued attendance marks: %s", e)
+    mysql.close()
+
+# Route for load balancer health/readiness checks: 200 when this worker can run a query,
+# 503 when the database cannot be reached
+@app.route('/healthz')
+def healthz():
+    try:
+        cur = mysql.connection.cursor()
+        cur.execute("SELECT 1")
+        cur.fetchone()
+        cur.close()
+    except (PoolExhausted, *DATABASE_ERRORS) as e:
+        return jsonify({'status': 'unavailable', 'database': str(e), 'warm': _warm, 'pid': os.getpid()}), 503
+    return jsonify({'status': 'ok', 'database': 'ok', 'warm': _warm, 'pid': os.getpid()})
 
+# Development server only; run production behind gunicorn: gunicorn -c gunicorn.conf.py
 if __name__ == '__main__':
     print("Starting Flask application...")
     app.run(debug=True)
@@ -0,0 +1,130 @@
+# Attendance analytics for one semester: defaulters, weekly trends and absence heatmaps.
+#
+# load_semester() reads every mark of the semester (a mark belongs to the semester the student
+# is enrolled in the course for) through an unbuffered cursor, chunk by chunk, straight into
+# NumPy columns: student, course, day number and present flag. Student and course ids are
+# replaced by dense indexes, so every statistic is a bincount over a combined index instead
+# of a Python loop over rows; a semester of millions of marks takes seconds on one core.
+# matrix() gives the student x meeting view of one course. Needs NumPy; the report routes
+# answer 501 without it.
+
+import datetime
+
+from storage import SSCursor
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Marks pulled from the server per fetch
+CHUNK_ROWS = 100000
+
+# Attendance percentage below which a student is a defaulter
+DEFAULTER_THRESHOLD = 75.0
+
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+
+# Day numbers are MySQL's TO_DAYS(); Python's date ordinals count from the year 1, not 0
+def to_date(day):
+    return datetime.date.fromordinal(int(day) - 365)
+
+
+def weekday(days):
+    return (days - 366) % 7  # Monday is 0, as in date.weekday()
+
+
+def load_semester(connection, semester_id, course_id=None):
+    course_sql = "AND a.CourseID = %s" if course_id else ""
+    params = (semester_id, course_id) if course_id else (semester_id,)
+    cur = connection.cursor(SSCursor)
+    chunks = []
+    try:
+        cur.execute(f"""
+            SELECT a.StudentID, a.CourseID, TO_DAYS(a.AttendanceDate), a.AttendanceStatus = 'Present'
+            FROM attendance a
+            WHERE EXISTS (SELECT 1 FROM enrolledstudents es WHERE es.StudentID = a.StudentID AND es.CourseID = a.CourseID AND es.SemesterID = %s)
+            {course_sql}
+        """, params)
+        while True:
+            rows = cur.fetchmany(CHUNK_ROWS)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=np.int32))
+    finally:
+        cur.close()
+    data = np.concatenate(chunks) if chunks else np.empty((0, 4), dtype=np.int32)
+    return SemesterAttendance(data[:, 0], data[:, 1], data[:, 2], data[:, 3].astype(bool))
+
+
+class SemesterAttendance:
+    def __init__(self, student_ids, course_ids, days, present):
+        # Sorted distinct ids, and each mark's index into them
+        self.student_ids, self.students = np.unique(student_ids, return_inverse=True)
+        self.course_ids, self.courses = np.unique(course_ids, return_inverse=True)
+        self.days = days
+        self.present = present
+
+    @property
+    def marks(self):
+        return len(self.days)
+
+    # Student x meeting matrix of one course: (student ids, meeting day numbers, matrix) with
+    # 1 for present, 0 for absent and -1 where the student has no mark for the meeting
+    def matrix(self, course_id):
+        mask = self.course_ids[self.courses] == course_id
+        students, student_index = np.unique(self.students[mask], return_inverse=True)
+        days, day_index = np.unique(self.days[mask], return_inverse=True)
+        matrix = np.full((len(students), len(days)), -1, dtype=np.int8)
+        matrix[student_index, day_index] = self.present[mask]
+        return self.student_ids[students], days, matrix
+
+    # Present and total marks per (student, course) pair that has any:
+    # (student ids, course ids, present, total)
+    def pair_totals(self):
+        pairs, index = np.unique(self.students.astype(np.int64) * len(self.course_ids) + self.courses,
+                                 return_inverse=True)
+        total = np.bincount(index, minlength=len(pairs))
+        present = np.bincount(index, weights=self.present, minlength=len(pairs)).astype(np.int64)
+        return (self.student_ids[pairs // len(self.course_ids)], self.course_ids[pairs % len(self.course_ids)],
+                present, total)
+
+    # Students below `threshold` percent in a course, lowest first:
+    # list of (StudentID, CourseID, present, total, percentage)
+    def defaulters(self, threshold=DEFAULTER_THRESHOLD, min_meetings=1):
+        students, courses, present, total = self.pair_totals()
+        percentage = 100.0 * present / np.maximum(total, 1)
+        mask = (percentage < threshold) & (total >= min_meetings)
+        order = np.lexsort((students[mask], courses[mask], percentage[mask]))
+        columns = [students[mask], courses[mask], present[mask], total[mask], np.round(percentage[mask], 1)]
+        return list(zip(*(column[order].tolist() for column in columns)))
+
+    # Attendance percentage per course and week: (course ids, week start dates, rates) where
+    # rates[course, week] is None for a week without marks
+    def weekly_trends(self):
+        week_starts = self.days - weekday(self.days)
+        weeks, week_index = np.unique(week_starts, return_inverse=True)
+        rates = self._rates(self.courses, len(self.course_ids), week_index, len(weeks))
+        return self.course_ids.tolist(), [to_date(week) for week in weeks], rates
+
+    # Absence percentage per course and weekday: (course ids, weekday names, rates) with the
+    # weekdays that have any marks; rates[course, day] is None without marks
+    def absence_heatmap(self):
+        days = weekday(self.days)
+        used = np.unique(days)
+        column = np.searchsorted(used, days)
+        rates = self._rates(self.courses, len(self.course_ids), column, len(used), absences=True)
+        return self.course_ids.tolist(), [WEEKDAYS[day] for day in used], rates
+
+    # Percentage present (or absent) per (row, column) cell, as nested lists for templates
+    def _rates(self, rows, row_count, columns, column_count, absences=False):
+        cells = rows.astype(np.int64) * column_count + columns
+        size = row_count * column_count
+        total = np.bincount(cells, minlength=size).reshape(row_count, column_count)
+        counted = np.bincount(cells, weights=~self.present if absences else self.present, minlength=size)
+        counted = counted.reshape(row_count, column_count)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rates = np.round(100.0 * counted / total, 1)
+        return [[None if total[r, c] == 0 else float(rates[r, c]) for c in range(column_count)]
+                for r in range(row_count)]
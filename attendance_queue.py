@@ -0,0 +1,386 @@
+# Write-behind ingestion for attendance marks.
+#
+# In write-behind mode add_attendance and update_attendance append the mark to a local
+# append-only log (one JSON line, fsynced) and answer straight away. A background thread drains
+# the log into MySQL in batches, one transaction per batch, and then advances a checkpoint
+# (byte offset of the drained prefix) stored next to the log.
+#
+# Delivery is at-least-once: a crash between the commit and the checkpoint replays the batch.
+# Replays are harmless because every mark carries an id that is recorded in
+# attendance_applied_marks in the same transaction as the mark itself, and marks whose id is
+# already there are skipped. Once everything is drained the log is truncated.
+#
+# Marks are validated before they are appended. A batch the database still rejects, for any
+# reason other than a transient one (connection lost, pool exhausted), is flushed again in
+# halves until the rejected marks are isolated; those are moved to a dead-letter file next to
+# the log so they cannot hold back every mark queued after them.
+#
+# Several worker processes can share one log: appends and truncation take an exclusive file
+# lock and only the process holding the drain lock flushes. The unflushed tail of the log is
+# also what reads merge in, so a teacher sees their own marks before they reach MySQL.
+
+import datetime
+import json
+import os
+import threading
+import time
+import uuid
+
+import attendance_summary
+import change_log
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process development server, the thread locks suffice
+    fcntl = None
+
+APPLIED_MARKS_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS attendance_applied_marks (
+        MarkID CHAR(32) PRIMARY KEY,
+        AppliedAt TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+# Applied mark ids are kept this long, far longer than a drained batch can wait to be replayed
+APPLIED_MARKS_RETENTION_DAYS = 7
+
+
+# Build a queued mark. op is 'add' (new record) or 'update' (of AttendanceID).
+def new_mark(op, student_id, course_id, attendance_date, status, attendance_id=None):
+    return {
+        'id': uuid.uuid4().hex,
+        'op': op,
+        'AttendanceID': attendance_id,
+        'StudentID': str(student_id),
+        'CourseID': str(course_id),
+        'AttendanceDate': str(attendance_date),
+        'AttendanceStatus': status,
+        'queued_at': time.time(),
+    }
+
+
+# Raise ValueError unless `mark` can be written: numeric ids, a YYYY-MM-DD date and a status
+def validate_mark(mark):
+    if mark.get('op') not in ('add', 'update'):
+        raise ValueError(f"Unknown operation {mark.get('op')!r}")
+    fields = ['StudentID', 'CourseID'] + (['AttendanceID'] if mark['op'] == 'update' else [])
+    for field in fields:
+        if not str(mark.get(field) or '').strip().isdigit():
+            raise ValueError(f"{field} must be a number")
+    try:
+        datetime.datetime.strptime(str(mark.get('AttendanceDate')), '%Y-%m-%d')
+    except ValueError:
+        raise ValueError("AttendanceDate must be a date (YYYY-MM-DD)") from None
+    if mark.get('AttendanceStatus') not in ('Present', 'Absent'):
+        raise ValueError("AttendanceStatus must be Present or Absent")
+
+
+# Write a batch of marks to MySQL in one transaction, skipping marks applied before.
+# Returns the number of marks applied.
+def apply_batch(connection, marks):
+    if not marks:
+        return 0
+    cur = connection.cursor()
+    try:
+        placeholders = ', '.join(['%s'] * len(marks))
+        cur.execute(f"SELECT MarkID FROM attendance_applied_marks WHERE MarkID IN ({placeholders})",
+                    tuple(mark['id'] for mark in marks))
+        done = {row[0] for row in cur.fetchall()}
+        pending = [mark for mark in marks if mark['id'] not in done]
+
+        # Consecutive adds go out as one multi-row INSERT; updates are applied in log order
+        adds = []
+        updated = []
+        last_id = change_log.last_key(connection, 'attendance')
+
+        def flush_adds():
+            if adds:
+                semesters = attendance_summary.enrollment_semesters(cur, [(m['StudentID'], m['CourseID']) for m in adds])
+                rows = [(m['StudentID'], m['CourseID'], m['AttendanceDate'], m['AttendanceStatus'],
+                         semesters[(str(m['StudentID']), str(m['CourseID']))]) for m in adds]
+                cur.executemany("""
+                    INSERT INTO attendance (StudentID, CourseID, AttendanceDate, AttendanceStatus, SemesterID)
+                    VALUES (%s, %s, %s, %s, %s)
+                """, rows)
+                attendance_summary.apply_marks(connection, [(row[0], row[1], row[4], row[3]) for row in rows])
+                del adds[:]
+
+        for mark in pending:
+            if mark['op'] == 'add':
+                adds.append(mark)
+                continue
+            flush_adds()
+            cur.execute("SELECT StudentID, CourseID, SemesterID, AttendanceStatus FROM attendance WHERE AttendanceID = %s FOR UPDATE",
+                        (mark['AttendanceID'],))
+            previous = cur.fetchall()
+            if not previous:
+                # Deleted before the update was drained
+                continue
+            semester_id = attendance_summary.updated_semester(cur, previous[0], mark['StudentID'], mark['CourseID'])
+            cur.execute("UPDATE attendance SET StudentID = %s, CourseID = %s, AttendanceDate = %s, AttendanceStatus = %s, SemesterID = %s WHERE AttendanceID = %s",
+                        (mark['StudentID'], mark['CourseID'], mark['AttendanceDate'], mark['AttendanceStatus'], semester_id, mark['AttendanceID']))
+            attendance_summary.apply_marks(connection, previous, sign=-1)
+            attendance_summary.apply_marks(connection, [(mark['StudentID'], mark['CourseID'], semester_id, mark['AttendanceStatus'])])
+            updated.append(mark['AttendanceID'])
+        flush_adds()
+        change_log.record_where(connection, 'attendance', 'insert', "AttendanceID > %s", (last_id,))
+        change_log.record(connection, 'attendance', 'update', updated)
+
+        if pending:
+            cur.executemany("INSERT INTO attendance_applied_marks (MarkID) VALUES (%s)", [(mark['id'],) for mark in pending])
+        connection.commit()
+        return len(pending)
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+# Forget applied mark ids older than the retention period
+def prune_applied(connection):
+    cur = connection.cursor()
+    try:
+        cur.execute("DELETE FROM attendance_applied_marks WHERE AppliedAt < NOW() - INTERVAL %s DAY",
+                    (APPLIED_MARKS_RETENTION_DAYS,))
+        connection.commit()
+    finally:
+        cur.close()
+
+
+class AttendanceQueue:
+    # `flush(marks)` writes a batch to the database and raises if it could not; the
+    # `transient_errors` it raises are retried as they are, anything else isolates bad marks
+    def __init__(self, path, flush, batch_size=500, interval=1.0, fsync=True,
+                 transient_errors=()):
+        self.path = path
+        self.offset_path = path + '.offset'
+        self.lock_path = path + '.lock'
+        self.dead_letter_path = path + '.dead'
+        self.flush = flush
+        self.transient_errors = tuple(transient_errors)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._thread_pid = None
+        self._tail_cache = (None, [])  # ((offset, size, mtime), marks)
+        self._since_wakeup = 0  # marks appended by this process since the drainer was last woken
+        self.appended = 0
+        self.flushed = 0
+        self.batches = 0
+        self.errors = 0
+        self.last_error = None
+        self.dead_lettered = 0
+        self._recover()
+
+    # -------- files --------
+
+    def _file_lock(self, f, exclusive=True, blocking=True):
+        if fcntl is None:
+            return True
+        flags = (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | (0 if blocking else fcntl.LOCK_NB)
+        try:
+            fcntl.flock(f.fileno(), flags)
+            return True
+        except BlockingIOError:
+            return False
+
+    def _file_unlock(self, f):
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _read_offset(self):
+        try:
+            with open(self.offset_path) as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _write_offset(self, offset):
+        tmp = f"{self.offset_path}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.offset_path)
+
+    # Drop a torn last line left by a crash mid-append and a checkpoint past the end of the log
+    def _recover(self):
+        with self._lock, open(self.path, 'a+b') as f:
+            self._file_lock(f)
+            try:
+                f.seek(0, os.SEEK_END)
+                size = f.tell()
+                f.seek(max(0, size - 65536))
+                tail = f.read()
+                if tail and not tail.endswith(b'\n'):
+                    cut = tail.rfind(b'\n')
+                    if cut >= 0 or size <= len(tail):
+                        size = size - len(tail) + cut + 1
+                        f.truncate(size)
+                if self._read_offset() > size:
+                    self._write_offset(0)
+            finally:
+                self._file_unlock(f)
+
+    # -------- producers --------
+
+    # Durably append a mark; returns once it is on disk. Raises ValueError for an invalid mark.
+    def append(self, mark):
+        validate_mark(mark)
+        line = (json.dumps(mark, separators=(',', ':')) + '\n').encode('utf-8')
+        with self._lock, open(self.path, 'ab') as f:
+            self._file_lock(f)
+            try:
+                f.write(line)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            finally:
+                self._file_unlock(f)
+            self.appended += 1
+            self._since_wakeup += 1
+            full_batch = self._since_wakeup >= self.batch_size
+            if full_batch:
+                self._since_wakeup = 0
+        self.start()
+        # A full batch is drained right away; smaller ones wait for the next tick
+        if full_batch:
+            self._wakeup.set()
+        return mark
+
+    # -------- readers --------
+
+    # Marks in the log that have not reached the database yet, oldest first
+    def pending(self):
+        offset = self._read_offset()
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return []
+        key = (offset, st.st_size, st.st_mtime_ns)
+        if self._tail_cache[0] == key:
+            return self._tail_cache[1]
+        marks = []
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if line.endswith(b'\n'):
+                    marks.append(json.loads(line))
+        self._tail_cache = (key, marks)
+        return marks
+
+    # -------- drainer --------
+
+    # Drain up to one batch; returns the number of marks taken from the log
+    def drain_once(self):
+        with open(self.lock_path, 'a') as guard:
+            if not self._file_lock(guard, blocking=False):
+                return 0  # another process is draining
+            try:
+                offset = self._read_offset()
+                entries = []  # (mark, offset just past its line)
+                end = offset
+                with open(self.path, 'rb') as f:
+                    f.seek(offset)
+                    for line in f:
+                        if not line.endswith(b'\n'):
+                            break
+                        end += len(line)
+                        entries.append((json.loads(line), end))
+                        if len(entries) >= self.batch_size:
+                            break
+                if not entries:
+                    self._compact(offset)
+                    return 0
+                self._flush_isolating(entries)
+                self.batches += 1
+                return len(entries)
+            finally:
+                self._file_unlock(guard)
+
+    # Flush `entries` and advance the checkpoint past them. When the database rejects them
+    # (not transiently), flush each half on its own, down to single marks, which are then
+    # dead-lettered; the checkpoint advances after every part, so nothing is flushed twice.
+    def _flush_isolating(self, entries):
+        marks = [mark for mark, _ in entries]
+        try:
+            self.flush(marks)
+            self.flushed += len(marks)
+        except self.transient_errors:
+            raise
+        except Exception as e:
+            if len(entries) > 1:
+                middle = len(entries) // 2
+                self._flush_isolating(entries[:middle])
+                self._flush_isolating(entries[middle:])
+                return
+            self._dead_letter(marks[0], e)
+        self._write_offset(entries[-1][1])
+
+    # Append a mark the database rejected, with the reason, to the dead-letter file
+    def _dead_letter(self, mark, error):
+        record = dict(mark, error=str(error), failed_at=time.time())
+        with open(self.dead_letter_path, 'ab') as f:
+            self._file_lock(f)
+            try:
+                f.write((json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8'))
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                self._file_unlock(f)
+        self.dead_lettered += 1
+        self.errors += 1
+        self.last_error = f"Mark {mark.get('id')} moved to {self.dead_letter_path}: {error}"
+
+    # Truncate the log as soon as it is fully drained
+    def _compact(self, offset):
+        if offset == 0:
+            return
+        with self._lock, open(self.path, 'r+b') as f:
+            self._file_lock(f)
+            try:
+                f.seek(0, os.SEEK_END)
+                if f.tell() != offset:
+                    return  # appended to meanwhile
+                f.truncate(0)
+                self._write_offset(0)
+            finally:
+                self._file_unlock(f)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                while self.drain_once() >= self.batch_size:
+                    pass
+            except Exception as e:
+                # Keep the marks in the log and retry on the next tick
+                self.errors += 1
+                self.last_error = str(e)
+
+    # Start the drain thread of this process (again after a fork)
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread_pid == os.getpid() and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='attendance-queue', daemon=True)
+            self._thread_pid = os.getpid()
+            self._thread.start()
+
+    def stats(self):
+        marks = self.pending()
+        return {
+            'pending': len(marks),
+            'lag_seconds': round(time.time() - marks[0]['queued_at'], 3) if marks else 0.0,
+            'appended': self.appended,
+            'flushed': self.flushed,
+            'batches': self.batches,
+            'errors': self.errors,
+            'last_error': self.last_error,
+            'dead_lettered': self.dead_lettered,
+        }
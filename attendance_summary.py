@@ -0,0 +1,124 @@
+# Incrementally maintained attendance totals per course x semester x student.
+#
+# Every attendance write applies +1/-1 deltas to attendance_summary inside the same
+# transaction, so percentage reports are a primary-key range read instead of a GROUP BY over
+# the whole attendance table. A new mark is counted under the semester the student is enrolled
+# in the course for when it is written (the latest one if there are several, 0 if none), and
+# that semester is stored with the mark (attendance.SemesterID): removing or changing the mark
+# takes it off the same summary row, however the student's enrollments have changed since.
+# rebuild() recomputes everything from attendance when the totals need a backfill or have
+# drifted, first giving marks written without a semester (outside the routes) their current
+# one.
+
+SUMMARY_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS attendance_summary (
+        CourseID INT NOT NULL,
+        SemesterID INT NOT NULL,
+        StudentID INT NOT NULL,
+        PresentCount INT NOT NULL DEFAULT 0,
+        AbsentCount INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (CourseID, SemesterID, StudentID),
+        KEY idx_attendance_summary_student (StudentID)
+    )
+"""
+
+
+# Semester a new mark of each (student, course) pair is counted under, keyed by the pair as
+# strings, resolved with one query
+def enrollment_semesters(cur, pairs):
+    pairs = {(str(student_id), str(course_id)) for student_id, course_id in pairs}
+    if not pairs:
+        return {}
+    conditions = " OR ".join(["(StudentID = %s AND CourseID = %s)"] * len(pairs))
+    params = [value for pair in sorted(pairs) for value in pair]
+    cur.execute(f"""
+        SELECT StudentID, CourseID, MAX(SemesterID)
+        FROM enrolledstudents
+        WHERE {conditions}
+        GROUP BY StudentID, CourseID
+    """, tuple(params))
+    found = {(str(row[0]), str(row[1])): row[2] for row in cur.fetchall()}
+    return {pair: found.get(pair) or 0 for pair in pairs}
+
+
+# Semester an updated mark is counted under: the one it was stored with while it stays with
+# the same student and course, otherwise the one a new mark would get. `previous` is the
+# mark's (StudentID, CourseID, SemesterID, status) before the update.
+def updated_semester(cur, previous, student_id, course_id):
+    if (str(previous[0]), str(previous[1])) == (str(student_id), str(course_id)):
+        return previous[2] or 0
+    return enrollment_semesters(cur, [(student_id, course_id)])[(str(student_id), str(course_id))]
+
+
+# Apply attendance marks to the summary. `marks` are (StudentID, CourseID, SemesterID, status)
+# tuples, SemesterID being the one stored with the mark; sign is +1 for marks added and -1 for
+# marks removed. Runs in the caller's transaction on `connection` - the caller commits.
+def apply_marks(connection, marks, sign=1):
+    deltas = {}
+    for student_id, course_id, semester_id, status in marks:
+        key = (str(course_id), int(semester_id or 0), str(student_id))
+        present, absent = deltas.get(key, (0, 0))
+        if status == 'Present':
+            present += sign
+        else:
+            absent += sign
+        deltas[key] = (present, absent)
+    if not deltas:
+        return
+    cur = connection.cursor()
+    try:
+        rows = [key + delta for key, delta in deltas.items()]
+        cur.executemany("""
+            INSERT INTO attendance_summary (CourseID, SemesterID, StudentID, PresentCount, AbsentCount)
+            VALUES (%s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                PresentCount = PresentCount + VALUES(PresentCount),
+                AbsentCount = AbsentCount + VALUES(AbsentCount)
+        """, rows)
+    finally:
+        cur.close()
+
+
+# Give every mark without a semester the one a new mark would get, on `cur` in the caller's
+# transaction
+def assign_semesters(cur):
+    cur.execute("""
+        UPDATE attendance
+        SET SemesterID = COALESCE((
+            SELECT MAX(e.SemesterID) FROM enrolledstudents e
+            WHERE e.StudentID = attendance.StudentID AND e.CourseID = attendance.CourseID
+        ), 0)
+        WHERE SemesterID IS NULL
+    """)
+
+
+# Recompute the whole summary from the attendance table in one transaction
+def rebuild(connection):
+    cur = connection.cursor()
+    try:
+        cur.execute(SUMMARY_TABLE_DDL)
+        assign_semesters(cur)
+        cur.execute("DELETE FROM attendance_summary")
+        cur.execute("""
+            INSERT INTO attendance_summary (CourseID, SemesterID, StudentID, PresentCount, AbsentCount)
+            SELECT CourseID, SemesterID, StudentID,
+                   SUM(AttendanceStatus = 'Present'), SUM(AttendanceStatus <> 'Present')
+            FROM attendance
+            GROUP BY CourseID, SemesterID, StudentID
+        """)
+        rows = cur.rowcount
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cur.close()
+    return rows
+
+
+# Attendance percentage of a summary row (None when nothing has been marked)
+def percentage(present, absent):
+    total = present + absent
+    if not total:
+        return None
+    return round(100.0 * present / total, 1)
@@ -0,0 +1,233 @@
+# Synthetic campus generator for the benchmarks.
+#
+#   python -m bench.campus --students 20000 --meetings 30 --reset
+#
+# Seeds the database the app is configured for (override with --db/--host/--user/--password)
+# with departments, faculty, courses, programs, students, enrollments, course assignments, a
+# clash-free timetable and attendance for every enrolled student at every class meeting. Rows
+# are generated deterministically from --seed and written with multi-row INSERTs in batches.
+
+import argparse
+import datetime
+import random
+import time
+
+# Tables the generator fills (and the change log), children first so --reset can empty them in order
+TABLES = [
+    'change_log', 'change_log_horizon', 'attendance_summary', 'enrollment_counts', 'attendance',
+    'assign_courses_to_student', 'enrolledstudents', 'enrolledteachers', 'timetables', 'current_semester',
+    'offered_programs', 'sessions', 'semesters', 'students', 'courses', 'faculty', 'departments',
+]
+
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday']
+PERIODS = [(f"{h:02d}:00", f"{h + 1:02d}:00") for h in range(8, 17)]
+FIRST_NAMES = ['Ali', 'Sara', 'Usman', 'Ayesha', 'Bilal', 'Fatima', 'Hamza', 'Zainab', 'Omar', 'Hira',
+               'Ahmed', 'Maryam', 'Hassan', 'Amna', 'Imran', 'Noor', 'Saad', 'Iqra', 'Tariq', 'Rabia']
+LAST_NAMES = ['Khan', 'Ahmed', 'Malik', 'Hussain', 'Sheikh', 'Butt', 'Chaudhry', 'Raza', 'Iqbal', 'Qureshi',
+              'Mirza', 'Siddiqui', 'Javed', 'Aslam', 'Anwar', 'Baig', 'Abbasi', 'Rana', 'Nawaz', 'Akhtar']
+
+
+class CampusSpec:
+    def __init__(self, departments=8, faculty_per_department=15, courses_per_department=25,
+                 students=20000, courses_per_student=5, semesters=2, meetings=30, seed=1):
+        self.departments = departments
+        self.faculty_per_department = faculty_per_department
+        self.courses_per_department = courses_per_department
+        self.students = students
+        self.courses_per_student = courses_per_student
+        self.semesters = semesters
+        self.meetings = meetings
+        self.seed = seed
+
+    @property
+    def attendance_rows(self):
+        return self.students * self.courses_per_student * self.meetings
+
+
+def insert_rows(connection, sql, rows, batch_size):
+    cur = connection.cursor()
+    try:
+        for start in range(0, len(rows), batch_size):
+            cur.executemany(sql, rows[start:start + batch_size])
+            connection.commit()
+    finally:
+        cur.close()
+
+
+def reset(connection):
+    cur = connection.cursor()
+    try:
+        for table in TABLES:
+            cur.execute(f"DELETE FROM {table}")
+        connection.commit()
+    finally:
+        cur.close()
+
+
+# Fill the database; returns the number of rows written per table
+def generate(connection, spec, batch_size=5000, log=print):
+    rng = random.Random(spec.seed)
+    counts = {}
+    cur = connection.cursor()
+
+    def insert(table, columns, rows):
+        placeholders = ', '.join(['%s'] * len(columns))
+        insert_rows(connection, f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", rows, batch_size)
+        counts[table] = counts.get(table, 0) + len(rows)
+        log(f"  {table}: {counts[table]} rows")
+
+    # Rows reference parents by the IDs the database assigned, read back after each insert
+    def ids(table, key):
+        cur.execute(f"SELECT {key} FROM {table} ORDER BY {key}")
+        return [row[0] for row in cur.fetchall()]
+
+    started = time.monotonic()
+    insert('departments', ['DepartmentName'], [(f"Department {d + 1}",) for d in range(spec.departments)])
+    department_ids = ids('departments', 'DepartmentID')
+
+    insert('faculty', ['FirstName', 'LastName', 'Email', 'DepartmentID'], [
+        (rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), f"faculty{d}_{f}@campus.test", department_id)
+        for d, department_id in enumerate(department_ids) for f in range(spec.faculty_per_department)
+    ])
+    cur.execute("SELECT FacultyID, DepartmentID FROM faculty ORDER BY FacultyID")
+    faculty_by_department = {}
+    for faculty_id, department_id in cur.fetchall():
+        faculty_by_department.setdefault(department_id, []).append(faculty_id)
+
+    insert('courses', ['CourseName', 'DepartmentID', 'FacultyID'], [
+        (f"Course {d + 1}-{c + 1}", department_id, rng.choice(faculty_by_department[department_id]))
+        for d, department_id in enumerate(department_ids) for c in range(spec.courses_per_department)
+    ])
+    cur.execute("SELECT CourseID, DepartmentID, FacultyID FROM courses ORDER BY CourseID")
+    courses = cur.fetchall()
+    courses_by_department = {}
+    for course_id, department_id, _ in courses:
+        courses_by_department.setdefault(department_id, []).append(course_id)
+
+    insert('semesters', ['SemesterName'], [(f"Semester {s + 1}",) for s in range(spec.semesters)])
+    semester_ids = ids('semesters', 'SemesterID')
+    year = datetime.date.today().year
+    insert('sessions', ['StartYear', 'EndYear'], [(year - 1, year + 3)])
+    session_id = ids('sessions', 'SessionID')[-1]
+    insert('offered_programs', ['ProgramName', 'SessionID'],
+           [(f"Program {d + 1}", session_id) for d in range(spec.departments)])
+    program_ids = ids('offered_programs', 'ProgramID')
+    term_start = datetime.date(year, 1, 8)
+    insert('current_semester', ['ProgramID', 'SemesterID', 'StartDate', 'EndDate'], [
+        (program_id, semester_id, term_start, term_start + datetime.timedelta(weeks=16))
+        for program_id in program_ids for semester_id in semester_ids
+    ])
+    cur.execute("SELECT CurrentSemesterID, ProgramID, SemesterID FROM current_semester")
+    current_semesters = {(program_id, semester_id): cs_id for cs_id, program_id, semester_id in cur.fetchall()}
+
+    # Timetable: every course gets two weekly periods; rooms and teachers never clash
+    room_busy = set()
+    teacher_busy = set()
+    slots = [(day, period) for day in DAYS for period in PERIODS]
+    timetable_rows = []
+    for course_id, department_id, faculty_id in courses:
+        placed = 0
+        for day, period in rng.sample(slots, len(slots)):
+            if placed == 2:
+                break
+            if (faculty_id, day, period) in teacher_busy:
+                continue
+            room = next(r for r in range(1, 1000) if (r, day, period) not in room_busy)
+            room_busy.add((room, day, period))
+            teacher_busy.add((faculty_id, day, period))
+            timetable_rows.append((course_id, day, period[0], period[1], f"R{room:03d}", faculty_id))
+            placed += 1
+    insert('timetables', ['CourseID', 'DayOfWeek', 'StartTime', 'EndTime', 'RoomNumber', 'TaughtBy'], timetable_rows)
+
+    insert('students', ['FirstName', 'LastName', 'EnrollmentNo', 'Email', 'DepartmentID'], [
+        (rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), f"{year}-{s + 1:06d}", f"student{s + 1}@campus.test",
+         department_ids[s % len(department_ids)])
+        for s in range(spec.students)
+    ])
+    cur.execute("SELECT StudentID, DepartmentID FROM students ORDER BY StudentID")
+    students = cur.fetchall()
+
+    # Enrollments and matching course assignments in the latest semester
+    semester_id = semester_ids[-1]
+    enrollments = []
+    assignments = []
+    for student_id, department_id in students:
+        d = department_ids.index(department_id)
+        program_id = program_ids[d]
+        chosen = rng.sample(courses_by_department[department_id],
+                            min(spec.courses_per_student, len(courses_by_department[department_id])))
+        for course_id in chosen:
+            enrollments.append((student_id, course_id, semester_id))
+            assignments.append((student_id, program_id, session_id, current_semesters[(program_id, semester_id)], course_id))
+    insert('enrolledstudents', ['StudentID', 'CourseID', 'SemesterID'], enrollments)
+    insert('assign_courses_to_student', ['StudentID', 'ProgramID', 'SessionID', 'CurrentSemesterID', 'CourseID'], assignments)
+
+    # Attendance for every meeting, written per meeting so memory stays flat
+    meeting_dates = [term_start + datetime.timedelta(days=i) for i in range(spec.meetings * 7) if
+                     (term_start + datetime.timedelta(days=i)).weekday() < 5][:spec.meetings]
+    sql = "INSERT INTO attendance (StudentID, CourseID, AttendanceDate, AttendanceStatus, SemesterID) VALUES (%s, %s, %s, %s, %s)"
+    total = 0
+    for meeting_date in meeting_dates:
+        rows = [(student_id, course_id, meeting_date, 'Present' if rng.random() < 0.82 else 'Absent', semester_id)
+                for student_id, course_id, semester_id in enrollments]
+        insert_rows(connection, sql, rows, batch_size)
+        total += len(rows)
+        log(f"  attendance: {total} rows")
+    counts['attendance'] = total
+    cur.close()
+
+    import attendance_summary
+    counts['attendance_summary'] = attendance_summary.rebuild(connection)
+    import enrollment_counts
+    counts['enrollment_counts'] = enrollment_counts.reconcile(connection)
+    log(f"Generated campus in {time.monotonic() - started:.1f}s")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed the database with a synthetic campus.")
+    parser.add_argument('--departments', type=int, default=8)
+    parser.add_argument('--faculty-per-department', type=int, default=15)
+    parser.add_argument('--courses-per-department', type=int, default=25)
+    parser.add_argument('--students', type=int, default=20000)
+    parser.add_argument('--courses-per-student', type=int, default=5)
+    parser.add_argument('--semesters', type=int, default=2)
+    parser.add_argument('--meetings', type=int, default=30, help='class meetings with attendance per course')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--reset', action='store_true', help='empty the tables first')
+    add_database_arguments(parser)
+    args = parser.parse_args()
+
+    app = configure_app(args)
+    spec = CampusSpec(args.departments, args.faculty_per_department, args.courses_per_department, args.students,
+                      args.courses_per_student, args.semesters, args.meetings, args.seed)
+    print(f"Generating {spec.students} students and about {spec.attendance_rows} attendance rows")
+    import migrations
+    from app import mysql
+    with app.app_context():
+        migrations.migrate(mysql.connection)
+        if args.reset:
+            reset(mysql.connection)
+        generate(mysql.connection, spec, batch_size=args.batch_size)
+
+
+# Database options shared by the generator and the runner
+def add_database_arguments(parser):
+    parser.add_argument('--host')
+    parser.add_argument('--user')
+    parser.add_argument('--password')
+    parser.add_argument('--db')
+
+
+# Import the app with the database options applied (the pool connects lazily, on first use)
+def configure_app(args):
+    from app import app
+    for option, key in (('host', 'MYSQL_HOST'), ('user', 'MYSQL_USER'), ('password', 'MYSQL_PASSWORD'), ('db', 'MYSQL_DB')):
+        if getattr(args, option) is not None:
+            app.config[key] = getattr(args, option)
+    return app
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+# Benchmark runner: drives the hot routes and reports throughput and latency percentiles.
+#
+#   python -m bench.run                           # in-process, through the Flask test client
+#   python -m bench.run --url http://127.0.0.1:5000 --concurrency 16
+#
+# Run it against a database seeded by bench.campus. Every scenario is a request template whose
+# ids are drawn from the data actually in the database, so runs on the same dataset and seed
+# issue the same requests. Results are written as JSON to bench/results/ and compared with the
+# previous run (or --compare FILE) so a change can be judged by its effect per route.
+
+import argparse
+import datetime
+import json
+import os
+import random
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from bench.campus import add_database_arguments, configure_app
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+# name -> function(rng, sample) returning (method, path, form data or None).
+# Scenarios that reach a write route are built to be rejected, so the dataset stays unchanged.
+def _scenarios():
+    def pick(rng, sample, key):
+        return rng.choice(sample[key])
+
+    return {
+        'attendance_list': lambda rng, s: ('GET', '/attendance', None),
+        'attendance_by_course': lambda rng, s: ('GET', f"/attendance?course_id={pick(rng, s, 'courses')}", None),
+        'attendance_by_student': lambda rng, s: ('GET', f"/attendance?student_id={pick(rng, s, 'students')}", None),
+        'assign_list': lambda rng, s: ('GET', '/assign_courses_to_student', None),
+        'assign_by_program': lambda rng, s: (
+            'GET', f"/assign_courses_to_student?program_id={pick(rng, s, 'programs')}", None),
+        'students_list': lambda rng, s: ('GET', '/students', None),
+        'student_lookup': lambda rng, s: (
+            'GET', f"/assign_courses_to_student/by_id?StudentID={pick(rng, s, 'students')}", None),
+        'student_search': lambda rng, s: (
+            'GET', f"/api/students/search?q={urllib.parse.quote(pick(rng, s, 'names')[:3])}", None),
+        'course_roster': lambda rng, s: ('GET', f"/api/courses/{pick(rng, s, 'courses')}/roster", None),
+        'timetables_list': lambda rng, s: ('GET', '/timetables', None),
+        'student_timetable': lambda rng, s: ('GET', f"/timetables/student/{pick(rng, s, 'students')}", None),
+        'teacher_timetable': lambda rng, s: ('GET', f"/timetables/teacher/{pick(rng, s, 'faculty')}", None),
+        'free_rooms': lambda rng, s: (
+            'GET', f"/timetables/finder?day={rng.choice(['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday'])}"
+                   f"&start={rng.randint(8, 15):02d}:00&end={rng.randint(16, 17):02d}:30", None),
+        'course_report': lambda rng, s: ('GET', f"/reports/attendance/course/{pick(rng, s, 'courses')}", None),
+        'student_report': lambda rng, s: ('GET', f"/reports/attendance/student/{pick(rng, s, 'students')}", None),
+        # Exactly the slot of an existing entry: answered 400 after the clash check
+        'timetable_clash_check': lambda rng, s: ('POST', '/timetables/add', dict(pick(rng, s, 'slots'))),
+    }
+
+
+SCENARIOS = _scenarios()
+EXPECTED_STATUS = {'timetable_clash_check': 400}
+
+
+# Ids to build requests from, sampled from the database
+def load_sample(app, size=500, seed=1):
+    from app import mysql
+    from storage import DictCursor
+    rng = random.Random(seed)
+    sample = {}
+    with app.app_context():
+        cur = mysql.connection.cursor(DictCursor)
+        for key, sql in (
+            ('students', "SELECT StudentID AS id FROM students ORDER BY StudentID"),
+            ('courses', "SELECT CourseID AS id FROM courses ORDER BY CourseID"),
+            ('faculty', "SELECT FacultyID AS id FROM faculty ORDER BY FacultyID"),
+            ('programs', "SELECT ProgramID AS id FROM offered_programs ORDER BY ProgramID"),
+            ('names', "SELECT DISTINCT FirstName AS id FROM students ORDER BY FirstName"),
+        ):
+            cur.execute(sql)
+            values = [row['id'] for row in cur.fetchall()]
+            sample[key] = rng.sample(values, min(size, len(values)))
+        cur.execute("SELECT CourseID, DayOfWeek, StartTime, EndTime, RoomNumber, TaughtBy FROM timetables ORDER BY TimetableID")
+        sample['slots'] = [
+            {'CourseID': row['CourseID'], 'DayOfWeek': row['DayOfWeek'], 'StartTime': str(row['StartTime'])[:5],
+             'EndTime': str(row['EndTime'])[:5], 'RoomNumber': row['RoomNumber'], 'TaughtBy': row['TaughtBy']}
+            for row in cur.fetchall()
+        ][:size]
+        cur.execute("SELECT COUNT(*) AS n FROM attendance")
+        sample['attendance_rows'] = cur.fetchone()['n']
+        cur.close()
+    return sample
+
+
+# Send one request and return its status code; one sender per worker thread
+def test_client_sender(app):
+    client = app.test_client()
+
+    def send(method, path, data):
+        return client.open(path, method=method, data=data).status_code
+    return send
+
+
+def http_sender(base_url, timeout=60):
+    def send(method, path, data):
+        body = urllib.parse.urlencode(data).encode('utf-8') if data is not None else None
+        req = urllib.request.Request(base_url.rstrip('/') + path, data=body, method=method)
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code
+    return send
+
+
+# Nearest-rank percentile of sorted values
+def percentile(values, p):
+    if not values:
+        return None
+    rank = max(1, -(-len(values) * p // 100))
+    return values[int(rank) - 1]
+
+
+def summarize(latencies, errors, seconds):
+    latencies = sorted(latencies)
+    ms = lambda value: round(value * 1000, 2) if value is not None else None
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput': round(len(latencies) / seconds, 1) if seconds else 0.0,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+    }
+
+
+# Run `requests` requests of one scenario spread over `concurrency` threads
+def run_scenario(name, make_sender, sample, requests, concurrency, warmup, seed):
+    build = SCENARIOS[name]
+    expected = EXPECTED_STATUS.get(name, 200)
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def worker(index, count):
+        rng = random.Random(f"{seed}:{name}:{index}")
+        send = make_sender()
+        for _ in range(warmup):
+            try:
+                send(*build(rng, sample))
+            except Exception:
+                pass
+        local = []
+        local_errors = 0
+        barrier.wait()
+        for _ in range(count):
+            method, path, data = build(rng, sample)
+            started = time.perf_counter()
+            try:
+                status = send(method, path, data)
+            except Exception:
+                status = None
+            local.append(time.perf_counter() - started)
+            if status != expected:
+                local_errors += 1
+        with lock:
+            latencies.extend(local)
+            errors[0] += local_errors
+
+    counts = [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+    barrier = threading.Barrier(concurrency + 1)
+    threads = [threading.Thread(target=worker, args=(i, count)) for i, count in enumerate(counts)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()  # time only the measured requests, after every worker has warmed up
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, errors[0], time.perf_counter() - started)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(RESULTS_DIR)).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def latest_result(exclude=None):
+    if not os.path.isdir(RESULTS_DIR):
+        return None
+    names = sorted(name for name in os.listdir(RESULTS_DIR) if name.endswith('.json'))
+    paths = [os.path.join(RESULTS_DIR, name) for name in names]
+    paths = [path for path in paths if path != exclude]
+    return paths[-1] if paths else None
+
+
+def print_report(result, baseline=None):
+    header = f"{'scenario':<24}{'req':>7}{'err':>6}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}"
+    if baseline:
+        header += f"{'p95 vs base':>14}"
+    print(header)
+    for name, row in result['scenarios'].items():
+        line = (f"{name:<24}{row['requests']:>7}{row['errors']:>6}{row['throughput']:>9}"
+                f"{str(row['p50_ms']):>9}{str(row['p95_ms']):>9}{str(row['p99_ms']):>9}")
+        base = (baseline or {}).get('scenarios', {}).get(name)
+        if base and base.get('p95_ms') and row['p95_ms'] is not None:
+            line += f"{(row['p95_ms'] - base['p95_ms']) / base['p95_ms'] * 100:>+13.1f}%"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the hot routes.")
+    parser.add_argument('--url', help='benchmark a running server instead of the in-process test client')
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--warmup', type=int, default=5, help='unmeasured requests per thread first')
+    parser.add_argument('--only', nargs='+', choices=sorted(SCENARIOS), help='scenarios to run')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--label', default='', help='note stored with the result')
+    parser.add_argument('--compare', help='result file to compare with (default: the previous run)')
+    parser.add_argument('--no-save', action='store_true')
+    add_database_arguments(parser)
+    args = parser.parse_args()
+
+    app = configure_app(args)
+    sample = load_sample(app, seed=args.seed)
+    if args.url:
+        make_sender = lambda: http_sender(args.url)
+    else:
+        make_sender = lambda: test_client_sender(app)
+
+    result = {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'label': args.label,
+        'target': args.url or 'test-client',
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'dataset': {'students': len(sample['students']), 'courses': len(sample['courses']),
+                    'attendance_rows': sample['attendance_rows']},
+        'scenarios': {},
+    }
+    for name in args.only or list(SCENARIOS):
+        if name == 'timetable_clash_check' and not sample['slots']:
+            continue
+        result['scenarios'][name] = run_scenario(name, make_sender, sample, args.requests, args.concurrency,
+                                                 args.warmup, args.seed)
+        row = result['scenarios'][name]
+        print(f"  {name}: {row['throughput']} req/s, p95 {row['p95_ms']} ms")
+
+    path = None
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stem = os.path.join(RESULTS_DIR, datetime.datetime.now().strftime('%Y%m%d-%H%M%S'))
+        path, n = stem + '.json', 1
+        while os.path.exists(path):
+            path, n = f"{stem}-{n}.json", n + 1
+        with open(path, 'w') as f:
+            json.dump(result, f, indent=2)
+    baseline_path = args.compare or latest_result(exclude=path)
+    baseline = None
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+    print()
+    print_report(result, baseline)
+    if baseline:
+        print(f"\nCompared with {os.path.basename(baseline_path)} ({baseline.get('commit')}, {baseline.get('label') or 'no label'})")
+    if path:
+        print(f"Saved {path}")
+
+
+if __name__ == '__main__':
+    main()
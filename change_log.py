@@ -0,0 +1,271 @@
+# Change feed for downstream systems (the LMS, the reporting warehouse).
+#
+# Every insert, update and delete made by the routes appends a row per changed row to
+# change_log, in the same transaction as the write: the table, the row's primary key, the
+# operation and the row as it is after the change as JSON (NULL for a delete). ChangeID orders
+# the feed. A consumer keeps the last ChangeID it applied as its cursor and pulls what follows
+# with read_since() (GET /changes?since=<cursor>), applying each change as an upsert or a
+# delete by key, so seeing a change twice is harmless.
+#
+# ChangeIDs are handed out when the change row is written, not when its transaction commits,
+# so a higher id can become visible while a lower one is still uncommitted - or never appears,
+# because its transaction rolled back. read_since() serves changes as long as their ids follow
+# on without a gap. At a missing id it stops until the change after the gap is `settle`
+# seconds old (CHANGE_FEED_SETTLE_SECONDS in the app config), then takes the missing id for a
+# rollback and moves on. That bound is a heuristic, not a guarantee: a transaction that keeps
+# its changes uncommitted for longer than it (a very large CSV import, say) has them skipped by
+# a consumer that read past them meanwhile. The routes record their changes last, just before
+# they commit, to keep that window short; raise the bound if imports commit more slowly.
+#
+# compact() keeps only the latest change of each row, and drops deletes older than
+# TOMBSTONE_DAYS; the highest ChangeID dropped that way is the horizon, and a cursor below it
+# may have missed a delete. A change is only dropped once the change superseding it has
+# settled, so the gaps compaction leaves never hold a reader up. A new consumer, or one whose cursor fell behind the horizon,
+# bootstraps with snapshot(): the current rows of each table, paged by primary key, plus the
+# cursor (position()) to follow the feed from once every page is in.
+
+import datetime
+import json
+
+from storage import DictCursor
+
+CHANGE_LOG_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS change_log (
+        ChangeID BIGINT AUTO_INCREMENT PRIMARY KEY,
+        TableName VARCHAR(64) NOT NULL,
+        RowID INT NOT NULL,
+        Operation VARCHAR(10) NOT NULL,
+        RowData TEXT,
+        ChangedAt TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        KEY idx_change_log_row (TableName, RowID, ChangeID)
+    )
+"""
+
+# A single row (ID 1) holding the compaction horizon
+HORIZON_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS change_log_horizon (
+        ID INT PRIMARY KEY,
+        ChangeID BIGINT NOT NULL
+    )
+"""
+
+# Primary key of every table the feed covers
+KEYS = {
+    'departments': 'DepartmentID',
+    'faculty': 'FacultyID',
+    'courses': 'CourseID',
+    'students': 'StudentID',
+    'semesters': 'SemesterID',
+    'sessions': 'SessionID',
+    'offered_programs': 'ProgramID',
+    'current_semester': 'CurrentSemesterID',
+    'attendance': 'AttendanceID',
+    'timetables': 'TimetableID',
+    'enrolledstudents': 'EnrollmentID',
+    'assign_courses_to_student': 'AssignID',
+}
+
+# Seconds a missing ChangeID is waited for before it is taken for a rollback (see above)
+SETTLE_SECONDS = 60
+
+# Days a delete is kept by compaction; consumers must pull at least this often
+TOMBSTONE_DAYS = 30
+
+# Superseded changes removed per DELETE (and transaction) by compact()
+COMPACT_BATCH = 1000
+
+INSERT_SQL = """
+    INSERT INTO change_log (TableName, RowID, Operation, RowData)
+    VALUES (%s, %s, %s, %s)
+"""
+
+
+# Raised by read_since() for a cursor below the compaction horizon
+class CursorExpired(Exception):
+    def __init__(self, since, horizon):
+        super().__init__(f"Cursor {since} is behind the compaction horizon {horizon}; bootstrap from a snapshot")
+        self.horizon = horizon
+
+
+# Dates and times as ISO strings (TIME columns come back as timedelta), anything else as text
+def _json_value(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        seconds = int(value.total_seconds())
+        return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+    return str(value)
+
+
+def encode_row(row):
+    return json.dumps(row, default=_json_value, separators=(',', ':'))
+
+
+# Highest primary key of `table`, read before a multi-row INSERT so its rows can be recorded
+# afterwards with record_where(..., "<key> > %s", (last,))
+def last_key(connection, table):
+    cur = connection.cursor()
+    try:
+        cur.execute(f"SELECT MAX({KEYS[table]}) FROM {table}")
+        return cur.fetchone()[0] or 0
+    finally:
+        cur.close()
+
+
+# Append the changes of the `table` rows with primary keys `keys`, written by the caller's
+# transaction on `connection` - the caller commits. Inserted and updated rows are read back
+# (keys that no longer exist are skipped); deletes only need their keys.
+def record(connection, table, operation, keys):
+    keys = sorted({int(key) for key in keys})
+    if not keys:
+        return
+    if operation == 'delete':
+        cur = connection.cursor()
+        try:
+            cur.executemany(INSERT_SQL, [(table, key, operation, None) for key in keys])
+        finally:
+            cur.close()
+        return
+    record_where(connection, table, operation, f"{KEYS[table]} IN ({', '.join(['%s'] * len(keys))})", keys)
+
+
+# Append an insert or update change for every `table` row matching `where`
+def record_where(connection, table, operation, where, params=()):
+    key = KEYS[table]
+    cur = connection.cursor(DictCursor)
+    try:
+        cur.execute(f"SELECT * FROM {table} WHERE {where} ORDER BY {key}", tuple(params))
+        rows = cur.fetchall()
+        if rows:
+            cur.executemany(INSERT_SQL, [(table, row[key], operation, encode_row(row)) for row in rows])
+    finally:
+        cur.close()
+
+
+def horizon(connection):
+    cur = connection.cursor()
+    try:
+        cur.execute("SELECT ChangeID FROM change_log_horizon WHERE ID = 1")
+        row = cur.fetchone()
+        return row[0] if row else 0
+    finally:
+        cur.close()
+
+
+# Up to `limit` changes after cursor `since`, oldest first, stopping at an unsettled gap:
+# (changes, cursor, more) where cursor is the ChangeID to pass as `since` next time and more
+# tells whether further changes are ready to be pulled straight away
+def read_since(connection, since, limit, settle=SETTLE_SECONDS):
+    floor = horizon(connection)
+    if since < floor:
+        raise CursorExpired(since, floor)
+    cur = connection.cursor(DictCursor)
+    try:
+        cur.execute("""
+            SELECT ChangeID, TableName, RowID, Operation, RowData, ChangedAt,
+                   ChangedAt <= NOW() - INTERVAL %s SECOND AS Settled
+            FROM change_log
+            WHERE ChangeID > %s
+            ORDER BY ChangeID
+            LIMIT %s
+        """, (settle, since, limit + 1))
+        rows = cur.fetchall()
+    finally:
+        cur.close()
+    changes = []
+    for row in rows[:limit]:
+        if row['ChangeID'] != since + 1 and not row['Settled']:
+            return changes, since, False
+        changes.append({
+            'id': row['ChangeID'],
+            'table': row['TableName'],
+            'key': row['RowID'],
+            'op': row['Operation'],
+            'row': json.loads(row['RowData']) if row['RowData'] is not None else None,
+            'at': _json_value(row['ChangedAt']),
+        })
+        since = row['ChangeID']
+    more = len(rows) > limit and (rows[limit]['ChangeID'] == since + 1 or bool(rows[limit]['Settled']))
+    return changes, since, more
+
+
+# Feed position a snapshot taken now is consistent with: every change up to it has committed
+# (or rolled back), by the same rule as read_since() - the newest settled change, then the
+# younger ones that follow it without a gap
+def position(connection, settle=SETTLE_SECONDS):
+    cur = connection.cursor()
+    try:
+        cur.execute("""
+            SELECT ChangeID FROM change_log
+            WHERE ChangedAt <= NOW() - INTERVAL %s SECOND
+            ORDER BY ChangeID DESC
+            LIMIT 1
+        """, (settle,))
+        row = cur.fetchone()
+        since = max(row[0] if row else 0, horizon(connection))
+        cur.execute("SELECT ChangeID FROM change_log WHERE ChangeID > %s ORDER BY ChangeID", (since,))
+        for (change_id,) in cur.fetchall():
+            if change_id != since + 1:
+                break
+            since = change_id
+    finally:
+        cur.close()
+    return since
+
+
+# Up to `limit` current rows of `table` with primary keys above `after`, in key order, as the
+# JSON-ready dicts the feed carries
+def snapshot(connection, table, after, limit):
+    key = KEYS[table]
+    cur = connection.cursor(DictCursor)
+    try:
+        cur.execute(f"SELECT * FROM {table} WHERE {key} > %s ORDER BY {key} LIMIT %s", (after, limit))
+        return [json.loads(encode_row(row)) for row in cur.fetchall()]
+    finally:
+        cur.close()
+
+
+# Drop every change superseded by a later, settled one of the same row, then the deletes
+# older than `tombstone_days`, raising the horizon past them. Returns the number of changes
+# removed.
+def compact(connection, tombstone_days=TOMBSTONE_DAYS, settle=SETTLE_SECONDS):
+    removed = 0
+    cur = connection.cursor()
+    try:
+        cur.execute("""
+            SELECT c.ChangeID
+            FROM change_log c
+            JOIN (
+                SELECT TableName, RowID, MAX(ChangeID) AS Latest FROM change_log
+                GROUP BY TableName, RowID
+                HAVING COUNT(*) > 1
+            ) latest ON c.TableName = latest.TableName AND c.RowID = latest.RowID AND c.ChangeID < latest.Latest
+            JOIN change_log l ON l.ChangeID = latest.Latest
+            WHERE l.ChangedAt <= NOW() - INTERVAL %s SECOND
+        """, (settle,))
+        superseded = [row[0] for row in cur.fetchall()]
+        for start in range(0, len(superseded), COMPACT_BATCH):
+            batch = superseded[start:start + COMPACT_BATCH]
+            cur.execute(f"DELETE FROM change_log WHERE ChangeID IN ({', '.join(['%s'] * len(batch))})", tuple(batch))
+            removed += cur.rowcount
+            connection.commit()
+
+        cur.execute("""
+            SELECT MAX(ChangeID) FROM change_log
+            WHERE Operation = 'delete' AND ChangedAt <= NOW() - INTERVAL %s DAY
+        """, (tombstone_days,))
+        floor = cur.fetchone()[0]
+        if floor:
+            cur.execute("""
+                INSERT INTO change_log_horizon (ID, ChangeID) VALUES (1, %s)
+                ON DUPLICATE KEY UPDATE ChangeID = VALUES(ChangeID)
+            """, (floor,))
+            cur.execute("DELETE FROM change_log WHERE Operation = 'delete' AND ChangeID <= %s", (floor,))
+            removed += cur.rowcount
+            connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cur.close()
+    return removed
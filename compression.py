@@ -0,0 +1,82 @@
+# Response compression (gzip, or brotli when the package is installed).
+#
+# Text responses the client accepts compressed are encoded in an after_request hook. A
+# streamed response (list pages, CSV exports) is compressed chunk by chunk with a sync flush
+# after each chunk, so it keeps streaming: every chunk the view yields is still sent as soon as
+# it is ready. ETags stay valid because they are weak, which allows a different encoding of
+# the same content.
+
+import zlib
+
+try:
+    import brotli  # Optional, preferred over gzip when the client accepts it
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {
+    'text/html', 'text/css', 'text/csv', 'text/plain', 'text/calendar', 'text/javascript',
+    'application/json', 'application/javascript',
+}
+
+
+def _gzip_chunks(chunks, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        data += compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _brotli_chunks(chunks, level):
+    compressor = brotli.Compressor(quality=min(level, 11))
+    for chunk in chunks:
+        data = compressor.process(chunk) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+# Encode a streamed body, closing the original iterable when the server closes the response
+# (that is what releases a streamed view's request context and database cursor)
+def _encoded_stream(chunks, encode, level):
+    try:
+        yield from encode((chunk.encode('utf-8') if isinstance(chunk, str) else chunk for chunk in chunks), level)
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+# Best encoding both sides support, or None
+def choose_encoding(accept_encodings):
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+# Compress `response` in place for a request accepting `accept_encodings` (the request's
+# AcceptEncoding header). Small, binary, already encoded and file responses are left alone.
+def compress_response(response, accept_encodings, min_size=500, level=6):
+    if (response.status_code != 200 or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    encoding = choose_encoding(accept_encodings)
+    response.vary.add('Accept-Encoding')
+    if encoding is None:
+        return response
+    encode = _brotli_chunks if encoding == 'br' else _gzip_chunks
+    if response.is_streamed:
+        response.response = _encoded_stream(response.response, encode, level)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        response.set_data(b"".join(encode([data], level)))
+    response.headers['Content-Encoding'] = encoding
+    return response
@@ -0,0 +1,214 @@
+# Bulk CSV import for students, faculty, courses and enrollments.
+#
+# Rows are validated and inserted in batches: every foreign key column is checked with one
+# IN (...) lookup per batch, duplicates are detected against both the file and the database,
+# and the valid rows of a batch go in with a single multi-row INSERT and one commit.
+# Enrollments update the enrollment counters, and every row is appended to the change log,
+# in that same transaction.
+
+import csv
+import io
+
+import change_log
+import enrollment_counts
+
+# Rows validated, inserted and committed together
+IMPORT_BATCH_ROWS = 1000
+
+# What each importable entity looks like.
+#   columns    - CSV columns inserted into the table, in order
+#   optional   - columns that may be left out or empty (stored as NULL)
+#   references - column -> (table, key column) it must exist in (when given)
+#   unique     - column that must not repeat in the file or the table
+IMPORT_SPECS = {
+    'students': {
+        'table': 'students',
+        'columns': ['FirstName', 'LastName', 'EnrollmentNo', 'Email', 'DepartmentID', 'ProgramID'],
+        'optional': ['ProgramID'],
+        'references': {
+            'DepartmentID': ('departments', 'DepartmentID'),
+            'ProgramID': ('offered_programs', 'ProgramID'),
+        },
+        'unique': 'EnrollmentNo',
+    },
+    'faculty': {
+        'table': 'faculty',
+        'columns': ['FirstName', 'LastName', 'Email', 'DepartmentID'],
+        'references': {'DepartmentID': ('departments', 'DepartmentID')},
+    },
+    'courses': {
+        'table': 'courses',
+        'columns': ['CourseName', 'DepartmentID', 'FacultyID'],
+        'references': {
+            'DepartmentID': ('departments', 'DepartmentID'),
+            'FacultyID': ('faculty', 'FacultyID'),
+        },
+    },
+    'enrolled_students': {
+        'table': 'enrolledstudents',
+        'columns': ['StudentID', 'CourseID', 'SemesterID'],
+        'references': {
+            'StudentID': ('students', 'StudentID'),
+            'CourseID': ('courses', 'CourseID'),
+            'SemesterID': ('semesters', 'SemesterID'),
+        },
+    },
+}
+
+# Integer columns (foreign keys) that must parse as numbers
+ID_COLUMNS = {'DepartmentID', 'FacultyID', 'StudentID', 'CourseID', 'SemesterID', 'ProgramID'}
+
+
+# Outcome of an import: how many rows went in and which rows were rejected
+class ImportResult:
+    def __init__(self):
+        self.inserted = 0
+        self.errors = []  # (line number, message)
+
+    def add_error(self, line, message):
+        self.errors.append((line, message))
+
+
+# Read an uploaded file as CSV rows (dicts keyed by header), tolerating a UTF-8 BOM
+def read_csv(stream):
+    return csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+
+
+# Return the subset of `values` present in table.column, using one query
+def existing_values(cur, table, column, values):
+    if not values:
+        return set()
+    placeholders = ', '.join(['%s'] * len(values))
+    cur.execute(f"SELECT {column} FROM {table} WHERE {column} IN ({placeholders})", tuple(values))
+    return {str(row[0]) for row in cur.fetchall()}
+
+
+# Enrollment files may identify students by EnrollmentNo instead of StudentID;
+# resolve the whole batch with one lookup.
+def resolve_enrollment_numbers(cur, batch, result):
+    numbers = {row['EnrollmentNo'] for _, row in batch if not row.get('StudentID') and row.get('EnrollmentNo')}
+    if not numbers:
+        return batch
+    placeholders = ', '.join(['%s'] * len(numbers))
+    cur.execute(f"SELECT EnrollmentNo, StudentID FROM students WHERE EnrollmentNo IN ({placeholders})", tuple(numbers))
+    student_ids = {str(row[0]): str(row[1]) for row in cur.fetchall()}
+    resolved = []
+    for line, row in batch:
+        if not row.get('StudentID') and row.get('EnrollmentNo'):
+            if row['EnrollmentNo'] not in student_ids:
+                result.add_error(line, f"Unknown EnrollmentNo {row['EnrollmentNo']}")
+                continue
+            row['StudentID'] = student_ids[row['EnrollmentNo']]
+        resolved.append((line, row))
+    return resolved
+
+
+# Validate a batch of (line, row) pairs; returns the rows that may be inserted
+def validate_batch(cur, spec, batch, seen, result):
+    columns = spec['columns']
+    optional = spec.get('optional', [])
+    candidates = []
+    for line, row in batch:
+        for c in optional:
+            row.setdefault(c, '')
+        missing = [c for c in columns if not row.get(c) and c not in optional]
+        if missing:
+            result.add_error(line, f"Missing value for {', '.join(missing)}")
+            continue
+        bad_ids = [c for c in columns if c in ID_COLUMNS and row[c] and not row[c].isdigit()]
+        if bad_ids:
+            result.add_error(line, f"Invalid ID in {', '.join(bad_ids)}")
+            continue
+        for c in columns:
+            if c in ID_COLUMNS and row[c]:
+                row[c] = str(int(row[c]))  # "007" and "7" are the same key
+        candidates.append((line, row))
+
+    # One lookup per referenced table for the whole batch
+    known = {}
+    for column, (table, key) in spec['references'].items():
+        known[column] = existing_values(cur, table, key, {row[column] for _, row in candidates if row[column]})
+
+    unique = spec.get('unique')
+    taken = set()
+    if unique:
+        taken = existing_values(cur, spec['table'], unique, {row[unique] for _, row in candidates})
+
+    # Enrollments are unique per student, course and semester
+    enrolled = set()
+    if spec['table'] == 'enrolledstudents' and candidates:
+        student_ids = {row['StudentID'] for _, row in candidates}
+        placeholders = ', '.join(['%s'] * len(student_ids))
+        cur.execute(f"SELECT StudentID, CourseID, SemesterID FROM enrolledstudents WHERE StudentID IN ({placeholders})", tuple(student_ids))
+        enrolled = {tuple(str(v) for v in row) for row in cur.fetchall()}
+
+    valid = []
+    for line, row in candidates:
+        unknown = [c for c in spec['references'] if row[c] and row[c] not in known[c]]
+        if unknown:
+            result.add_error(line, f"Unknown {', '.join(unknown)}")
+            continue
+        if unique:
+            if row[unique] in seen or row[unique] in taken:
+                result.add_error(line, f"Duplicate {unique} {row[unique]}")
+                continue
+            seen.add(row[unique])
+        if spec['table'] == 'enrolledstudents':
+            key = (row['StudentID'], row['CourseID'], row['SemesterID'])
+            if key in seen or key in enrolled:
+                result.add_error(line, "Student is already enrolled in this course for the semester")
+                continue
+            seen.add(key)
+        valid.append((line, row))
+    return valid
+
+
+# Import the rows of an uploaded CSV into the entity's table.
+# Each batch is its own transaction, so a failing batch does not undo the ones before it.
+def import_rows(connection, entity, rows, batch_size=IMPORT_BATCH_ROWS):
+    spec = IMPORT_SPECS[entity]
+    columns = spec['columns']
+    insert_sql = (f"INSERT INTO {spec['table']} ({', '.join(columns)}) "
+                  f"VALUES ({', '.join(['%s'] * len(columns))})")
+    result = ImportResult()
+    seen = set()
+    cur = connection.cursor()
+    try:
+        batch = []
+        # Line 1 is the header, so data starts on line 2
+        for line, row in enumerate(rows, start=2):
+            batch.append((line, {k: (v or '').strip() for k, v in row.items() if k}))
+            if len(batch) >= batch_size:
+                insert_batch(connection, cur, spec, insert_sql, batch, seen, result)
+                batch = []
+        if batch:
+            insert_batch(connection, cur, spec, insert_sql, batch, seen, result)
+    finally:
+        cur.close()
+    result.errors.sort()
+    return result
+
+
+# Validate one batch and insert its valid rows in a single transaction
+def insert_batch(connection, cur, spec, insert_sql, batch, seen, result):
+    if spec['table'] == 'enrolledstudents':
+        batch = resolve_enrollment_numbers(cur, batch, result)
+    valid = validate_batch(cur, spec, batch, seen, result)
+    if not valid:
+        return
+    try:
+        if spec['table'] == 'enrolledstudents':
+            enrollment_counts.lock_students(cur, [row['StudentID'] for _, row in valid])
+        last_id = change_log.last_key(connection, spec['table'])
+        # executemany sends the batch as a single multi-row INSERT
+        cur.executemany(insert_sql, [tuple(row[c] or None for c in spec['columns']) for _, row in valid])
+        if spec['table'] == 'enrolledstudents':
+            enrollment_counts.apply_enrollments(
+                connection, [(row['StudentID'], row['CourseID'], row['SemesterID']) for _, row in valid])
+        change_log.record_where(connection, spec['table'], 'insert', f"{change_log.KEYS[spec['table']]} > %s", (last_id,))
+        connection.commit()
+        result.inserted += len(valid)
+    except Exception as e:
+        connection.rollback()
+        for line, _ in valid:
+            result.add_error(line, f"Database error: {e}")
@@ -0,0 +1,235 @@
+# Pooled database connections for the routes.
+#
+# PooledMySQL is a drop-in replacement for flask_mysqldb.MySQL: routes keep using
+# `mysql.connection`, which now checks a connection out of a per-process pool the first time
+# it is used in an app context and hands it back on teardown instead of closing it. The
+# connections come from storage.connect(), so they are MySQL or SQLite ones depending on
+# DATABASE_BACKEND.
+# `wrap_connection`, if set, is applied to that connection before the routes see it (the
+# metrics instrumentation uses it); the pool always gets the unwrapped connection back.
+
+import os
+import threading
+import time
+
+from flask import g
+
+import storage
+
+
+# Raised when no connection becomes free within the checkout timeout
+class PoolExhausted(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, connect, min_size=1, max_size=10, timeout=5.0, recycle=3600, ping=True):
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping = ping
+        self._idle = []  # (connection, created at), most recently returned last
+        self._created_at = {}  # id(connection) -> created at
+        self._size = 0  # open connections, idle or checked out
+        self._lock = threading.Condition()
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.created = 0
+        self.recycled = 0
+        self.discarded = 0
+        self.fill()
+
+    # Open connections until min_size exist
+    def fill(self):
+        while True:
+            with self._lock:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                conn = self._new_connection()
+            except Exception:
+                with self._lock:
+                    self._size -= 1
+                raise
+            with self._lock:
+                self._idle.append((conn, self._created_at[id(conn)]))
+                self._lock.notify()
+
+    def _new_connection(self):
+        conn = self._connect()
+        self._created_at[id(conn)] = time.monotonic()
+        self.created += 1
+        return conn
+
+    def _close(self, conn):
+        self._created_at.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    # Take a healthy connection, opening one if the pool is below max_size and waiting up to
+    # `timeout` seconds for one to be returned otherwise
+    def checkout(self):
+        deadline = time.monotonic() + self.timeout
+        waited = False
+        while True:
+            with self._lock:
+                conn = None
+                if self._idle:
+                    conn, created = self._idle.pop()
+                elif self._size < self.max_size:
+                    self._size += 1
+                else:
+                    if not waited:
+                        waited = True
+                        self.waits += 1
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self._lock.wait(remaining):
+                        if not self._idle and self._size >= self.max_size:
+                            self.timeouts += 1
+                            raise PoolExhausted(f"No database connection available within {self.timeout}s")
+                    continue
+
+            if conn is None:
+                try:
+                    conn = self._new_connection()
+                except Exception:
+                    self._release_slot()
+                    raise
+            elif self.recycle and time.monotonic() - created > self.recycle:
+                # Past its recycle age: replace it
+                self.recycled += 1
+                self._close(conn)
+                self._release_slot()
+                continue
+            elif self.ping:
+                try:
+                    conn.ping()
+                except storage.DATABASE_ERRORS:
+                    self.discarded += 1
+                    self._close(conn)
+                    self._release_slot()
+                    continue
+            with self._lock:
+                self.checkouts += 1
+            return conn
+
+    # Forget a connection that was closed, letting a waiter open a new one
+    def _release_slot(self):
+        with self._lock:
+            self._size -= 1
+            self._lock.notify()
+
+    # Return a connection; anything uncommitted is rolled back so the next user starts clean
+    def checkin(self, conn, broken=False):
+        if not broken:
+            try:
+                conn.rollback()
+            except storage.DATABASE_ERRORS:
+                broken = True
+        if broken:
+            self.discarded += 1
+            self._close(conn)
+            self._release_slot()
+            return
+        with self._lock:
+            self._idle.append((conn, self._created_at.get(id(conn), time.monotonic())))
+            self._lock.notify()
+
+    # Close the idle connections (the process is shutting down)
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for conn, _ in idle:
+            self._close(conn)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'timeouts': self.timeouts,
+                'created': self.created,
+                'recycled': self.recycled,
+                'discarded': self.discarded,
+            }
+
+
+class PooledMySQL:
+    def __init__(self, app=None):
+        self.app = app
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+        self.wrap_connection = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        storage.configure(app)
+        app.config.setdefault('MYSQL_HOST', 'localhost')
+        app.config.setdefault('MYSQL_USER', None)
+        app.config.setdefault('MYSQL_PASSWORD', None)
+        app.config.setdefault('MYSQL_DB', None)
+        app.config.setdefault('MYSQL_PORT', 3306)
+        app.config.setdefault('MYSQL_CHARSET', 'utf8')
+        app.config.setdefault('MYSQL_CONNECT_TIMEOUT', 10)
+        app.config.setdefault('MYSQL_POOL_MIN_SIZE', 1)
+        app.config.setdefault('MYSQL_POOL_MAX_SIZE', 10)
+        app.config.setdefault('MYSQL_POOL_TIMEOUT', 5.0)  # seconds to wait for a free connection
+        app.config.setdefault('MYSQL_POOL_RECYCLE', 3600)  # seconds before a connection is replaced
+        app.config.setdefault('MYSQL_POOL_PING', True)  # check connections on checkout
+        self.app = app
+        app.teardown_appcontext(self.teardown)
+
+    def _connect(self):
+        return storage.connect(self.app.config)
+
+    # The pool of the current process; a forked worker builds its own instead of sharing sockets
+    @property
+    def pool(self):
+        with self._pool_lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                config = self.app.config
+                self._pool = ConnectionPool(
+                    self._connect,
+                    min_size=config['MYSQL_POOL_MIN_SIZE'],
+                    max_size=config['MYSQL_POOL_MAX_SIZE'],
+                    timeout=config['MYSQL_POOL_TIMEOUT'],
+                    recycle=config['MYSQL_POOL_RECYCLE'],
+                    ping=config['MYSQL_POOL_PING'],
+                )
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    # Close this process's idle connections, if it has opened any
+    def close(self):
+        with self._pool_lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.close()
+
+    # The connection for the current app context, checked out on first use
+    @property
+    def connection(self):
+        if 'mysql_connection' not in g:
+            conn = self.pool.checkout()
+            g.mysql_pooled_connection = conn
+            g.mysql_connection = self.wrap_connection(conn) if self.wrap_connection else conn
+        return g.mysql_connection
+
+    def teardown(self, exception):
+        g.pop('mysql_connection', None)
+        conn = g.pop('mysql_pooled_connection', None)
+        if conn is not None:
+            self.pool.checkin(conn, broken=isinstance(exception, storage.OPERATIONAL_ERRORS))
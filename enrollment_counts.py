@@ -0,0 +1,224 @@
+# Incrementally maintained enrollment counters.
+#
+# enrollment_counts holds, per scope, the number of rows and of distinct students:
+#   enrolled   (0, 0)                   every row of enrolledstudents
+#   semester   (SemesterID, 0)          enrolledstudents rows of a semester
+#   course     (CourseID, 0)            enrolledstudents rows of a course
+#   department (DepartmentID, 0)        enrolledstudents rows of the department's courses
+#   assigned   (0, 0)                   every row of assign_courses_to_student
+#   program    (ProgramID, SessionID)   assign_courses_to_student rows of a program/session
+# A missing id counts as 0. The routes that write those tables apply +1/-1 deltas inside the
+# same transaction, so statistics pages and the dashboard read a handful of counter rows
+# instead of COUNT(*) over the enrollment tables. A student is counted in a scope when their
+# first row there is written and uncounted when the last one is removed; the caller locks the
+# students (lock_students) before writing so two writers cannot both see themselves first.
+# reconcile() recomputes every counter from the tables, for a backfill, after writes that
+# bypass the routes, or when a course has moved to another department.
+
+from collections import Counter
+
+COUNTS_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS enrollment_counts (
+        Scope VARCHAR(20) NOT NULL,
+        ScopeID INT NOT NULL,
+        SessionID INT NOT NULL DEFAULT 0,
+        Enrollments INT NOT NULL DEFAULT 0,
+        Students INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (Scope, ScopeID, SessionID)
+    )
+"""
+
+# Scopes with a statistics page
+SCOPES = ['semester', 'course', 'program', 'department']
+
+# (ScopeID, SessionID, Enrollments, Students) of every counter of a scope, from the tables
+RECOUNT_QUERIES = {
+    'enrolled': """
+        SELECT 0, 0, COUNT(*), COUNT(DISTINCT StudentID) FROM enrolledstudents
+    """,
+    'semester': """
+        SELECT COALESCE(SemesterID, 0), 0, COUNT(*), COUNT(DISTINCT StudentID)
+        FROM enrolledstudents
+        GROUP BY COALESCE(SemesterID, 0)
+    """,
+    'course': """
+        SELECT CourseID, 0, COUNT(*), COUNT(DISTINCT StudentID)
+        FROM enrolledstudents
+        GROUP BY CourseID
+    """,
+    'department': """
+        SELECT COALESCE(c.DepartmentID, 0), 0, COUNT(*), COUNT(DISTINCT es.StudentID)
+        FROM enrolledstudents es
+        LEFT JOIN courses c ON es.CourseID = c.CourseID
+        GROUP BY COALESCE(c.DepartmentID, 0)
+    """,
+    'assigned': """
+        SELECT 0, 0, COUNT(*), COUNT(DISTINCT StudentID) FROM assign_courses_to_student
+    """,
+    'program': """
+        SELECT COALESCE(ProgramID, 0), COALESCE(SessionID, 0), COUNT(*), COUNT(DISTINCT StudentID)
+        FROM assign_courses_to_student
+        GROUP BY COALESCE(ProgramID, 0), COALESCE(SessionID, 0)
+    """,
+}
+
+UPSERT_SQL = """
+    INSERT INTO enrollment_counts (Scope, ScopeID, SessionID, Enrollments, Students)
+    VALUES (%s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        Enrollments = Enrollments + VALUES(Enrollments),
+        Students = Students + VALUES(Students)
+"""
+
+
+# Form values and database values alike, with a missing id as 0
+def _id(value):
+    return int(value) if value not in (None, '') else 0
+
+
+def _placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+
+# Lock the students about to get enrollment rows written, until the caller commits
+def lock_students(cur, student_ids):
+    student_ids = sorted({_id(student_id) for student_id in student_ids})
+    if student_ids:
+        cur.execute(f"SELECT StudentID FROM students WHERE StudentID IN ({_placeholders(student_ids)}) FOR UPDATE",
+                    tuple(student_ids))
+        cur.fetchall()
+
+
+# Counter keys of an enrolledstudents row
+def _enrollment_keys(course_id, semester_id, department_id):
+    return [('enrolled', 0, 0), ('semester', _id(semester_id), 0), ('course', _id(course_id), 0),
+            ('department', _id(department_id), 0)]
+
+
+# Counter keys of an assign_courses_to_student row
+def _assignment_keys(program_id, session_id):
+    return [('assigned', 0, 0), ('program', _id(program_id), _id(session_id))]
+
+
+# Upsert the deltas of rows just written. `written` are (StudentID, keys) per row;
+# `remaining` counts each student's rows per key after the write.
+def _apply(cur, written, remaining, sign):
+    enrollments = Counter()
+    per_student = Counter()
+    for student_id, keys in written:
+        for key in keys:
+            enrollments[key] += sign
+            per_student[(student_id, key)] += 1
+    students = Counter()
+    for (student_id, key), rows in per_student.items():
+        left = remaining[student_id][key]
+        # The student's first rows in the scope were added, or their last ones removed
+        if (sign > 0 and left == rows) or (sign < 0 and left == 0):
+            students[key] += sign
+    if enrollments:
+        cur.executemany(UPSERT_SQL, [key + (enrollments[key], students[key]) for key in enrollments])
+
+
+# Apply enrolledstudents rows to the counters. `rows` are (StudentID, CourseID, SemesterID)
+# tuples already inserted (sign +1) or deleted (sign -1) in the caller's transaction on
+# `connection` - the caller commits.
+def apply_enrollments(connection, rows, sign=1):
+    if not rows:
+        return
+    cur = connection.cursor()
+    try:
+        course_ids = sorted({_id(course_id) for _, course_id, _ in rows})
+        cur.execute(f"SELECT CourseID, DepartmentID FROM courses WHERE CourseID IN ({_placeholders(course_ids)})",
+                    tuple(course_ids))
+        departments = dict(cur.fetchall())
+        student_ids = sorted({_id(student_id) for student_id, _, _ in rows})
+        cur.execute(f"""
+            SELECT es.StudentID, es.CourseID, es.SemesterID, c.DepartmentID
+            FROM enrolledstudents es
+            LEFT JOIN courses c ON es.CourseID = c.CourseID
+            WHERE es.StudentID IN ({_placeholders(student_ids)})
+        """, tuple(student_ids))
+        remaining = {student_id: Counter() for student_id in student_ids}
+        for student_id, course_id, semester_id, department_id in cur.fetchall():
+            remaining[student_id].update(_enrollment_keys(course_id, semester_id, department_id))
+        written = [(_id(student_id), _enrollment_keys(course_id, semester_id, departments.get(_id(course_id))))
+                   for student_id, course_id, semester_id in rows]
+        _apply(cur, written, remaining, sign)
+    finally:
+        cur.close()
+
+
+# Apply assign_courses_to_student rows, as (StudentID, ProgramID, SessionID) tuples, to the
+# counters; like apply_enrollments
+def apply_assignments(connection, rows, sign=1):
+    if not rows:
+        return
+    cur = connection.cursor()
+    try:
+        student_ids = sorted({_id(student_id) for student_id, _, _ in rows})
+        cur.execute(f"""
+            SELECT StudentID, ProgramID, SessionID
+            FROM assign_courses_to_student
+            WHERE StudentID IN ({_placeholders(student_ids)})
+        """, tuple(student_ids))
+        remaining = {student_id: Counter() for student_id in student_ids}
+        for student_id, program_id, session_id in cur.fetchall():
+            remaining[student_id].update(_assignment_keys(program_id, session_id))
+        written = [(_id(student_id), _assignment_keys(program_id, session_id))
+                   for student_id, program_id, session_id in rows]
+        _apply(cur, written, remaining, sign)
+    finally:
+        cur.close()
+
+
+# Recount every counter from the tables and correct the ones that differ, on `cur` in the
+# caller's transaction. Returns the number of counter rows corrected.
+def recount(cur):
+    cur.execute(COUNTS_TABLE_DDL)
+    cur.execute("SELECT Scope, ScopeID, SessionID, Enrollments, Students FROM enrollment_counts FOR UPDATE")
+    stored = {tuple(row[:3]): tuple(row[3:]) for row in cur.fetchall()}
+    fresh = {}
+    for scope, sql in RECOUNT_QUERIES.items():
+        cur.execute(sql)
+        for scope_id, session_id, enrollments, students in cur.fetchall():
+            fresh[(scope, int(scope_id), int(session_id))] = (int(enrollments), int(students))
+    changed = [key + counts for key, counts in fresh.items() if stored.get(key) != counts]
+    gone = [key for key in stored if key not in fresh]
+    if changed:
+        cur.executemany("""
+            INSERT INTO enrollment_counts (Scope, ScopeID, SessionID, Enrollments, Students)
+            VALUES (%s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE Enrollments = VALUES(Enrollments), Students = VALUES(Students)
+        """, changed)
+    if gone:
+        cur.executemany("DELETE FROM enrollment_counts WHERE Scope = %s AND ScopeID = %s AND SessionID = %s", gone)
+    return len(changed) + len(gone)
+
+
+# Recount every counter in one transaction
+def reconcile(connection):
+    cur = connection.cursor()
+    try:
+        corrected = recount(cur)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cur.close()
+    return corrected
+
+
+# Dashboard totals: {'enrolled': (enrollments, students), 'assigned': (assignments, students)}
+def totals(connection):
+    cur = connection.cursor()
+    try:
+        cur.execute("""
+            SELECT Scope, Enrollments, Students FROM enrollment_counts
+            WHERE Scope IN ('enrolled', 'assigned') AND ScopeID = 0 AND SessionID = 0
+        """)
+        counts = {'enrolled': (0, 0), 'assigned': (0, 0)}
+        counts.update((scope, (enrollments, students)) for scope, enrollments, students in cur.fetchall())
+        return counts
+    finally:
+        cur.close()
@@ -0,0 +1,47 @@
+# Gunicorn settings for running the app in production:
+#
+#   gunicorn -c gunicorn.conf.py
+#
+# One preforked worker process per core, each serving requests on a few threads (the routes
+# spend most of their time waiting on the database). The app is loaded once in the master,
+# with its templates compiled, and forked into the workers; each worker then opens its
+# connection pool and loads its indexes in post_worker_init, before it accepts a request.
+# Workers are replaced after max_requests (+ jitter, so they don't all restart at once) and
+# given graceful_timeout to finish their requests and flush queued attendance marks.
+#
+# Every setting can be overridden from the environment; app settings are read from FLASK_*
+# variables (see create_app in app.py).
+
+import multiprocessing
+import os
+
+wsgi_app = 'app:create_app()'
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+
+# Keep workers x MYSQL_POOL_MAX_SIZE below MySQL's max_connections, and threads at or below
+# MYSQL_POOL_MAX_SIZE so a worker's threads never wait for a connection of their own pool
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+preload_app = True
+
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 1000))
+# Above TIMETABLE_SOLVER_TIME_LIMIT, the slowest route
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 90))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG')  # e.g. '-' for stdout; off by default
+errorlog = '-'
+
+
+def post_worker_init(worker):
+    from app import warm_up
+    warm_up()
+    worker.log.info("Worker %s warmed up", worker.pid)
+
+
+def worker_exit(server, worker):
+    from app import shutdown_worker
+    shutdown_worker()
@@ -0,0 +1,209 @@
+# Request and SQL instrumentation, exposed in the Prometheus text format.
+#
+# Every request records its latency per endpoint, plus the number of SQL statements it ran,
+# the time spent in them and the rows it fetched. The SQL figures come from
+# InstrumentedConnection, which wraps the pooled connection a request checks out so every
+# cursor it hands out is timed. Metrics live in the worker process; each worker serves its own.
+
+import json
+import logging
+import random
+import threading
+import time
+
+# Upper bounds of the histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250)
+ROW_BUCKETS = (0, 1, 10, 50, 100, 500, 1000, 5000, 10000, 50000)
+
+logger = logging.getLogger('fyp')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._values = {}  # label values -> count
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.label_names, label_values)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * len(self.buckets) + [0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    labels = _labels(self.label_names, label_values, [('le', _number(bound))])
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _labels(self.label_names, label_values, [('le', '+Inf')])
+                lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+                labels = _labels(self.label_names, label_values)
+                lines.append(f"{self.name}_sum{labels} {_number(series[-2])}")
+                lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+# Gauge lines for a dict of numbers, e.g. the connection pool or cache counters
+def render_gauges(prefix, values, help_text):
+    lines = []
+    for key, value in sorted(values.items()):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        name = f"{prefix}_{key}"
+        lines += [f"# HELP {name} {help_text} ({key})", f"# TYPE {name} gauge", f"{name} {_number(value)}"]
+    return lines
+
+
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'Request latency by endpoint.',
+                            ['endpoint', 'method'])
+REQUESTS = Counter('http_requests_total', 'Requests by endpoint and status.', ['endpoint', 'method', 'status'])
+SQL_STATEMENTS = Histogram('db_statements_per_request', 'SQL statements executed per request.',
+                           ['endpoint'], buckets=COUNT_BUCKETS)
+SQL_TIME = Histogram('db_time_seconds_per_request', 'Time spent in SQL per request.', ['endpoint'])
+SQL_ROWS = Histogram('db_rows_fetched_per_request', 'Rows fetched from the database per request.',
+                     ['endpoint'], buckets=ROW_BUCKETS)
+REQUEST_METRICS = [REQUEST_LATENCY, REQUESTS, SQL_STATEMENTS, SQL_TIME, SQL_ROWS]
+
+
+# SQL work done by one request
+class QueryStats:
+    def __init__(self):
+        self.statements = 0
+        self.seconds = 0.0
+        self.rows = 0
+
+
+class InstrumentedCursor:
+    def __init__(self, cursor, stats):
+        self._cursor = cursor
+        self._stats = stats
+
+    def _timed(self, method, *args):
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self._stats.statements += 1
+            self._stats.seconds += time.perf_counter() - started
+
+    def execute(self, query, args=None):
+        return self._timed(self._cursor.execute, query, args)
+
+    def executemany(self, query, args):
+        return self._timed(self._cursor.executemany, query, args)
+
+    def _fetched(self, rows):
+        self._stats.rows += len(rows)
+        return rows
+
+    def fetchone(self):
+        row = self._timed_fetch(self._cursor.fetchone)
+        if row is not None:
+            self._stats.rows += 1
+        return row
+
+    def fetchmany(self, *args):
+        return self._fetched(self._timed_fetch(self._cursor.fetchmany, *args))
+
+    def fetchall(self):
+        return self._fetched(self._timed_fetch(self._cursor.fetchall))
+
+    # Fetching from an unbuffered (SSCursor) result reads from the server, so it counts as DB time
+    def _timed_fetch(self, method, *args):
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self._stats.seconds += time.perf_counter() - started
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class InstrumentedConnection:
+    def __init__(self, connection, stats):
+        self._connection = connection
+        self._stats = stats
+
+    def cursor(self, *args):
+        return InstrumentedCursor(self._connection.cursor(*args), self._stats)
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+# Record one finished request
+def observe_request(endpoint, method, status, seconds, stats):
+    REQUEST_LATENCY.observe(seconds, endpoint, method)
+    REQUESTS.inc(endpoint, method, str(status))
+    SQL_STATEMENTS.observe(stats.statements, endpoint)
+    SQL_TIME.observe(stats.seconds, endpoint)
+    SQL_ROWS.observe(stats.rows, endpoint)
+
+
+# Log an event as one JSON line, but only for a `rate` fraction of calls (always when forced)
+def log_sampled(event, rate, force=False, **fields):
+    if not force and random.random() >= rate:
+        return
+    logger.info(json.dumps(dict(fields, event=event, sample_rate=1.0 if force else rate), default=str))
+
+
+def render(extra_lines=()):
+    lines = []
+    for metric in REQUEST_METRICS:
+        lines += metric.render()
+    lines += extra_lines
+    return "\n".join(lines) + "\n"
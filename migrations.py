@@ -0,0 +1,409 @@
+# Versioned schema migrations and a query plan check.
+#
+# MIGRATIONS is an ordered list of (version, description, steps). A step is either a SQL
+# statement or a callable taking a cursor. Applied versions are recorded in
+# schema_migrations, so `flask migrate` only runs what a database has not seen yet. Steps are
+# written to be safe on databases that were created by hand before migrations existed:
+# tables use IF NOT EXISTS and indexes/columns are only added when missing.
+#
+# explain_queries() pulls every SQL statement out of app.py, runs EXPLAIN on it and reports
+# the tables the database would read with a full scan. Statements built from f-strings are
+# only checked when their interpolations are IN (...) placeholder lists; table names, columns
+# and optional clauses filled in at run time leave nothing fixed to explain.
+#
+# The same migrations build the SQLite schema; storage.py translates the MySQL DDL, and the
+# steps below look up existing indexes and columns in the SQLite catalog instead.
+
+import ast
+import re
+
+import storage
+from attendance_queue import APPLIED_MARKS_TABLE_DDL
+from attendance_summary import SUMMARY_TABLE_DDL, assign_semesters
+from change_log import CHANGE_LOG_TABLE_DDL, HORIZON_TABLE_DDL
+from enrollment_counts import COUNTS_TABLE_DDL, recount
+from table_versions import TABLE_VERSIONS_DDL
+
+
+# Step adding an index unless one with that name already exists
+def add_index(table, name, columns, unique=False):
+    def step(cur):
+        kind = "UNIQUE INDEX" if unique else "INDEX"
+        if storage.dialect(cur) == 'sqlite':
+            cur.execute(f"CREATE {kind} IF NOT EXISTS {name} ON {table} ({', '.join(columns)})")
+            return
+        cur.execute("""
+            SELECT 1 FROM information_schema.STATISTICS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+            LIMIT 1
+        """, (table, name))
+        if cur.fetchone() is None:
+            cur.execute(f"ALTER TABLE {table} ADD {kind} {name} ({', '.join(columns)})")
+    step.description = f"index {name} on {table} ({', '.join(columns)})"
+    return step
+
+
+# Step adding a column unless the table already has it
+def add_column(table, column, definition):
+    def step(cur):
+        if storage.dialect(cur) == 'sqlite':
+            cur.execute("SELECT 1 FROM pragma_table_info(%s) WHERE name = %s", (table, column))
+        else:
+            cur.execute("""
+                SELECT 1 FROM information_schema.COLUMNS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+                LIMIT 1
+            """, (table, column))
+        if cur.fetchone() is None:
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    step.description = f"column {table}.{column}"
+    return step
+
+
+# Step running `function(cur)`, e.g. to fill a new table from existing rows
+def run(description, function):
+    def step(cur):
+        function(cur)
+    step.description = description
+    return step
+
+
+# Give each student without a program the program of their latest course assignment
+def backfill_student_programs(cur):
+    cur.execute("""
+        UPDATE students
+        SET ProgramID = (
+            SELECT a.ProgramID FROM assign_courses_to_student a
+            WHERE a.StudentID = students.StudentID
+            ORDER BY a.AssignID DESC
+            LIMIT 1
+        )
+        WHERE ProgramID IS NULL
+    """)
+
+
+MIGRATIONS = [
+    (1, "Base schema", [
+        """
+        CREATE TABLE IF NOT EXISTS departments (
+            DepartmentID INT AUTO_INCREMENT PRIMARY KEY,
+            DepartmentName VARCHAR(100) NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS faculty (
+            FacultyID INT AUTO_INCREMENT PRIMARY KEY,
+            FirstName VARCHAR(50) NOT NULL,
+            LastName VARCHAR(50) NOT NULL,
+            Email VARCHAR(100),
+            DepartmentID INT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS courses (
+            CourseID INT AUTO_INCREMENT PRIMARY KEY,
+            CourseName VARCHAR(100) NOT NULL,
+            DepartmentID INT,
+            FacultyID INT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS students (
+            StudentID INT AUTO_INCREMENT PRIMARY KEY,
+            FirstName VARCHAR(50) NOT NULL,
+            LastName VARCHAR(50) NOT NULL,
+            EnrollmentNo VARCHAR(30) NOT NULL,
+            Email VARCHAR(100),
+            DepartmentID INT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS semesters (
+            SemesterID INT AUTO_INCREMENT PRIMARY KEY,
+            SemesterName VARCHAR(50) NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS sessions (
+            SessionID INT AUTO_INCREMENT PRIMARY KEY,
+            StartYear INT NOT NULL,
+            EndYear INT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS offered_programs (
+            ProgramID INT AUTO_INCREMENT PRIMARY KEY,
+            ProgramName VARCHAR(100) NOT NULL,
+            SessionID INT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS current_semester (
+            CurrentSemesterID INT AUTO_INCREMENT PRIMARY KEY,
+            ProgramID INT,
+            SemesterID INT,
+            StartDate DATE,
+            EndDate DATE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS attendance (
+            AttendanceID INT AUTO_INCREMENT PRIMARY KEY,
+            StudentID INT NOT NULL,
+            CourseID INT NOT NULL,
+            AttendanceDate DATE NOT NULL,
+            AttendanceStatus VARCHAR(10) NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS timetables (
+            TimetableID INT AUTO_INCREMENT PRIMARY KEY,
+            CourseID INT NOT NULL,
+            DayOfWeek VARCHAR(10) NOT NULL,
+            StartTime TIME NOT NULL,
+            EndTime TIME NOT NULL,
+            RoomNumber VARCHAR(20) NOT NULL,
+            TaughtBy INT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS enrolledstudents (
+            EnrollmentID INT AUTO_INCREMENT PRIMARY KEY,
+            StudentID INT NOT NULL,
+            CourseID INT NOT NULL,
+            SemesterID INT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS enrolledteachers (
+            TeacherID INT AUTO_INCREMENT PRIMARY KEY,
+            FacultyID INT NOT NULL,
+            OfferedCourseID INT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS assign_courses_to_student (
+            AssignID INT AUTO_INCREMENT PRIMARY KEY,
+            StudentID INT NOT NULL,
+            ProgramID INT,
+            SessionID INT,
+            CurrentSemesterID INT,
+            CourseID INT NOT NULL,
+            Allowed TINYINT(1) DEFAULT 1,
+            Is_Repeater TINYINT(1) DEFAULT 0
+        )
+        """,
+        SUMMARY_TABLE_DDL,
+    ]),
+    (2, "Indexes for the routes' access paths", [
+        # Class marking, the course/date filters and the attendance listing's keyset order
+        add_index('attendance', 'idx_attendance_course_date', ['CourseID', 'AttendanceDate']),
+        add_index('attendance', 'idx_attendance_student_course', ['StudentID', 'CourseID']),
+        add_index('attendance', 'idx_attendance_date', ['AttendanceDate', 'AttendanceID']),
+        # Rosters by course/semester and the per-student semester lookup of attendance_summary
+        add_index('enrolledstudents', 'idx_enrolled_course_semester', ['CourseID', 'SemesterID']),
+        add_index('enrolledstudents', 'idx_enrolled_student_course', ['StudentID', 'CourseID', 'SemesterID']),
+        # Room and teacher overlap checks for one day
+        add_index('timetables', 'idx_timetables_day_room', ['DayOfWeek', 'RoomNumber', 'StartTime']),
+        add_index('timetables', 'idx_timetables_day_teacher', ['DayOfWeek', 'TaughtBy', 'StartTime']),
+        add_index('timetables', 'idx_timetables_course', ['CourseID']),
+        # Filtered assignment listing and per-student lookups
+        add_index('assign_courses_to_student', 'idx_assign_program_session_semester',
+                  ['ProgramID', 'SessionID', 'CurrentSemesterID']),
+        add_index('assign_courses_to_student', 'idx_assign_student', ['StudentID', 'CourseID']),
+        add_index('students', 'idx_students_enrollment_no', ['EnrollmentNo']),
+        add_index('students', 'idx_students_department', ['DepartmentID']),
+        add_index('faculty', 'idx_faculty_department', ['DepartmentID']),
+        add_index('courses', 'idx_courses_department', ['DepartmentID']),
+        add_index('courses', 'idx_courses_faculty', ['FacultyID']),
+        add_index('offered_programs', 'idx_offered_programs_session', ['SessionID']),
+        add_index('current_semester', 'idx_current_semester_program', ['ProgramID', 'SemesterID']),
+        add_index('enrolledteachers', 'idx_enrolledteachers_faculty', ['FacultyID']),
+        add_index('enrolledteachers', 'idx_enrolledteachers_course', ['OfferedCourseID']),
+    ]),
+    (3, "Allowed and Is_Repeater flags on course assignments", [
+        add_column('assign_courses_to_student', 'Allowed', 'TINYINT(1) DEFAULT 1'),
+        add_column('assign_courses_to_student', 'Is_Repeater', 'TINYINT(1) DEFAULT 0'),
+    ]),
+    (4, "Name indexes for the student prefix search", [
+        add_index('students', 'idx_students_first_name', ['FirstName', 'LastName']),
+        add_index('students', 'idx_students_last_name', ['LastName', 'FirstName']),
+    ]),
+    (5, "Applied mark ids for the write-behind attendance queue", [
+        APPLIED_MARKS_TABLE_DDL,
+    ]),
+    (6, "Enrollment counters", [
+        COUNTS_TABLE_DDL,
+        run("count enrollments and course assignments", recount),
+    ]),
+    (7, "Covering index for the student lookup", [
+        add_index('assign_courses_to_student', 'idx_assign_student_profile',
+                  ['StudentID', 'CurrentSemesterID', 'ProgramID', 'SessionID', 'CourseID', 'Allowed', 'Is_Repeater']),
+    ]),
+    (8, "Change log for the change feed", [
+        CHANGE_LOG_TABLE_DDL,
+        HORIZON_TABLE_DDL,
+    ]),
+    (9, "Program of each student, for cohort course assignment", [
+        add_column('students', 'ProgramID', 'INT'),
+        add_index('students', 'idx_students_program', ['ProgramID']),
+        run("set students' programs from their course assignments", backfill_student_programs),
+    ]),
+    (10, "Table versions for conditional GETs", [
+        TABLE_VERSIONS_DDL,
+    ]),
+    (11, "Semester each attendance mark is counted under in the summary", [
+        add_column('attendance', 'SemesterID', 'INT'),
+        run("set the semester of existing marks", assign_semesters),
+    ]),
+]
+
+MIGRATIONS_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        Version INT PRIMARY KEY,
+        Description VARCHAR(200) NOT NULL,
+        AppliedAt TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+
+def applied_versions(cur):
+    cur.execute(MIGRATIONS_TABLE_DDL)
+    cur.execute("SELECT Version FROM schema_migrations")
+    return {row[0] for row in cur.fetchall()}
+
+
+def current_version(connection):
+    cur = connection.cursor()
+    try:
+        return max(applied_versions(cur), default=0)
+    finally:
+        cur.close()
+
+
+# Apply every migration not yet recorded, up to `target` (all of them by default). Returns the
+# versions applied. MySQL commits DDL implicitly, so each version is recorded as soon as its
+# steps have run; a failure leaves the earlier versions applied and the failing one pending.
+def migrate(connection, target=None, log=print):
+    cur = connection.cursor()
+    applied = []
+    try:
+        done = applied_versions(cur)
+        for version, description, steps in MIGRATIONS:
+            if version in done or (target is not None and version > target):
+                continue
+            log(f"Applying {version}: {description}")
+            for step in steps:
+                if callable(step):
+                    log(f"  {step.description}")
+                    step(cur)
+                else:
+                    cur.execute(step)
+            cur.execute("INSERT INTO schema_migrations (Version, Description) VALUES (%s, %s)", (version, description))
+            connection.commit()
+            applied.append(version)
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cur.close()
+    return applied
+
+
+# -------------------- Query plan check --------------------
+
+# A string literal is taken for a statement only in a statement's shape, so operation names
+# like 'update' or 'delete' (passed to change_log.record) are not
+STATEMENT_START = re.compile(r'^\s*(SELECT\s.*\bFROM\b|UPDATE\s+\w+\s+SET\b|DELETE\s+FROM\b)', re.I | re.S)
+
+
+# Text of an f-string with each placeholder list inside "IN (...)" replaced by one
+# placeholder, or None if anything else is interpolated
+def joined_text(node):
+    text = ""
+    for part in node.values:
+        if isinstance(part, ast.Constant):
+            text += str(part.value)
+        elif re.search(r'\bIN\s*\($', text, re.I):
+            text += "%s"
+        else:
+            return None
+    return text
+
+
+# (line, sql) for every SQL statement literal in a Python source file
+def extract_queries(path):
+    with open(path, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), filename=path)
+    # String pieces of f-strings are handled through their JoinedStr
+    pieces = {id(part) for node in ast.walk(tree) if isinstance(node, ast.JoinedStr) for part in node.values}
+    queries = []
+    for node in ast.walk(tree):
+        if id(node) in pieces:
+            continue
+        if isinstance(node, ast.Constant) and isinstance(node.value, str):
+            sql = node.value
+        elif isinstance(node, ast.JoinedStr):
+            sql = joined_text(node)
+        else:
+            continue
+        if sql is not None and STATEMENT_START.match(sql):
+            queries.append((node.lineno, " ".join(sql.split())))
+    return sorted(set(queries))
+
+
+# Fill %s placeholders with a value MySQL can plan with
+def explainable(sql):
+    sql = re.sub(r'\b(LIMIT|OFFSET)\s+%s', r'\1 1', sql, flags=re.I)
+    return sql.replace('%s', "'1'")
+
+
+# EXPLAIN QUERY PLAN rows of SQLite in the shape of MySQL's EXPLAIN: a SCAN of a table is a
+# full scan ('ALL', or 'index' when it walks an index), a SEARCH an index lookup
+def sqlite_plan(rows):
+    plan = []
+    for row in rows:
+        words = row[-1].split()
+        if len(words) < 2 or words[0] not in ('SCAN', 'SEARCH') or words[1] == 'CONSTANT':
+            continue
+        if words[0] == 'SEARCH':
+            access = 'ref'
+        else:
+            access = 'index' if 'INDEX' in words else 'ALL'
+        plan.append({'table': words[1], 'type': access, 'rows': None})
+    return plan
+
+
+# EXPLAIN every query in `path`. Returns (line, sql, findings, error) tuples where findings
+# lists the full scans as (table, access type, estimated rows). Reading the whole driving
+# table of a statement without a WHERE clause is what a listing does and is not reported.
+def explain_queries(connection, path):
+    results = []
+    sqlite = storage.dialect(connection) == 'sqlite'
+    cur = connection.cursor()
+    try:
+        for line, sql in extract_queries(path):
+            try:
+                if sqlite:
+                    cur.execute("EXPLAIN QUERY PLAN " + explainable(sql))
+                    plan = sqlite_plan(cur.fetchall())
+                else:
+                    cur.execute("EXPLAIN " + explainable(sql))
+                    columns = [column[0].lower() for column in cur.description]
+                    plan = [dict(zip(columns, row)) for row in cur.fetchall()]
+            except Exception as e:
+                connection.rollback()
+                results.append((line, sql, [], str(e)))
+                continue
+            has_where = re.search(r'\bWHERE\b', sql, re.I) is not None
+            findings = []
+            for position, row in enumerate(plan):
+                if row.get('type') not in ('ALL', 'index'):
+                    continue
+                if position == 0 and not has_where:
+                    continue
+                findings.append((row.get('table'), row.get('type'), row.get('rows')))
+            results.append((line, sql, findings, None))
+    finally:
+        cur.close()
+    return results
@@ -0,0 +1,60 @@
+# Process-local cache for reference data (departments, courses, faculty, ...).
+#
+# Entries expire after a TTL and are also dropped explicitly when a route writes to one of
+# the tables they were read from, so a worker sees its own writes immediately and other
+# workers' writes within the TTL.
+
+import threading
+import time
+
+
+class ReferenceCache:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}  # key -> (expires at, tables, value)
+        self._lock = threading.Lock()
+        self._generation = 0  # bumped by every invalidation
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    # Cached value for `key`, calling `loader()` on a miss. `tables` are the tables the value
+    # was read from; writing to any of them invalidates it.
+    def get(self, key, tables, loader):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+            generation = self._generation
+        value = loader()
+        with self._lock:
+            # Don't keep a value that may predate a write made while it was loading
+            if generation == self._generation:
+                self._entries[key] = (now + self.ttl, frozenset(tables), value)
+        return value
+
+    # Drop every entry read from any of `tables`
+    def invalidate(self, *tables):
+        tables = set(tables)
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if entry[1] & tables]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+            self._generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+            }
@@ -0,0 +1,172 @@
+# Weekly timetables of students and teachers, cached per person.
+#
+# A schedule is built once from the course -> slots map (itself cached with the reference data)
+# and the person's courses, then kept until something it was built from changes: the person's
+# own course assignments, or a timetable row of one of their courses. Each entry remembers the
+# CourseIDs it covers, so a timetable change only drops the schedules of students taking that
+# course and of the teachers involved. Entries also expire after a TTL so writes made through
+# other worker processes are picked up.
+
+import datetime
+import threading
+import time
+
+from timetable_conflicts import format_minutes, normalize_day, to_minutes
+
+DAY_ORDER = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+
+class ScheduleCache:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}  # (kind, owner id) -> (expires at, course ids, schedule)
+        self._by_course = {}  # course id -> keys of the entries covering it
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    # Schedule of a student ('student') or teacher ('teacher'), calling `loader()` on a miss.
+    # The loader returns (schedule, CourseIDs it covers).
+    def get(self, kind, owner_id, loader):
+        key = (kind, str(owner_id))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+            generation = self._generation
+        schedule, course_ids = loader()
+        course_ids = frozenset(str(course_id) for course_id in course_ids)
+        with self._lock:
+            # Don't keep a schedule that may predate an invalidation made while it was loading
+            if generation == self._generation:
+                self._drop(key)
+                self._entries[key] = (now + self.ttl, course_ids, schedule)
+                for course_id in course_ids:
+                    self._by_course.setdefault(course_id, set()).add(key)
+        return schedule
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        for course_id in entry[1]:
+            keys = self._by_course.get(course_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_course[course_id]
+        return True
+
+    # Drop one person's schedule (their assignments changed)
+    def invalidate_owner(self, kind, owner_id):
+        with self._lock:
+            self.invalidations += self._drop((kind, str(owner_id)))
+            self._generation += 1
+
+    # Drop every schedule affected by timetable rows (dicts with CourseID and TaughtBy), e.g. the
+    # old and new version of an updated row
+    def invalidate_entries(self, *entries):
+        with self._lock:
+            keys = set()
+            for entry in entries:
+                keys |= self._by_course.get(str(entry['CourseID']), set())
+                keys.add(('teacher', str(entry['TaughtBy'])))
+            for key in keys:
+                self.invalidations += self._drop(key)
+            self._generation += 1
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._by_course.clear()
+            self._generation += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+            }
+
+
+# Sort slots into a week: list of (day name, slots) for the days that have any
+def week_schedule(slots):
+    days = {}
+    for slot in slots:
+        days.setdefault(normalize_day(slot['DayOfWeek']), []).append(slot)
+    week = []
+    for day in sorted(days, key=lambda d: DAY_ORDER.index(d) if d in DAY_ORDER else len(DAY_ORDER)):
+        week.append((day.capitalize(), sorted(days[day], key=lambda s: to_minutes(s['StartTime']))))
+    return week
+
+
+def _ical_text(value):
+    return (str(value).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+# Fold content lines longer than 75 octets as RFC 5545 requires
+def _ical_line(line):
+    data = line.encode('utf-8')
+    parts = []
+    while len(data) > 75:
+        cut = 75 if not parts else 74
+        while cut and (data[cut] & 0xC0) == 0x80:  # don't split a UTF-8 sequence
+            cut -= 1
+        parts.append(data[:cut])
+        data = data[cut:]
+    parts.append(data)
+    return b"\r\n ".join(parts).decode('utf-8')
+
+
+# iCalendar feed of a weekly schedule: one weekly recurring event per slot, starting in the
+# week of `today`. Times are floating (local wall-clock) times.
+def to_ical(week, calendar_name, today=None):
+    today = today or datetime.date.today()
+    monday = today - datetime.timedelta(days=today.weekday())
+    stamp = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//FYP//Timetable//EN",
+        "CALSCALE:GREGORIAN",
+        f"X-WR-CALNAME:{_ical_text(calendar_name)}",
+    ]
+    for day_name, slots in week:
+        day = normalize_day(day_name)
+        if day not in DAY_ORDER:
+            continue
+        date = monday + datetime.timedelta(days=DAY_ORDER.index(day))
+        for slot in slots:
+            start, end = to_minutes(slot['StartTime']), to_minutes(slot['EndTime'])
+            starts_at = datetime.datetime.combine(date, datetime.time(start // 60, start % 60))
+            ends_at = datetime.datetime.combine(date, datetime.time(end // 60, end % 60))
+            if end <= start:
+                ends_at += datetime.timedelta(days=1)  # crosses midnight
+            lines += [
+                "BEGIN:VEVENT",
+                f"UID:timetable-{slot['TimetableID']}@fyp",
+                f"DTSTAMP:{stamp}",
+                f"DTSTART:{starts_at.strftime('%Y%m%dT%H%M%S')}",
+                f"DTEND:{ends_at.strftime('%Y%m%dT%H%M%S')}",
+                "RRULE:FREQ=WEEKLY",
+                f"SUMMARY:{_ical_text(slot['CourseName'])}",
+                f"LOCATION:{_ical_text(slot['RoomNumber'])}",
+                f"DESCRIPTION:{_ical_text(slot.get('TeacherName') or '')}",
+                "END:VEVENT",
+            ]
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(_ical_line(line) for line in lines) + "\r\n"
+
+
+# HH:MM label of a slot's times for templates
+def slot_times(slot):
+    return f"{format_minutes(to_minutes(slot['StartTime']))}-{format_minutes(to_minutes(slot['EndTime']))}"
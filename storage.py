@@ -0,0 +1,373 @@
+# Storage backends under the routes.
+#
+# Routes, migrations and the helper modules talk to a MySQLdb-style DB-API connection:
+# `connection.cursor(DictCursor)`, %s placeholders, commit()/rollback(). connect() opens one for
+# the backend named by DATABASE_BACKEND:
+#
+#   'mysql'  - a MySQLdb connection to the MYSQL_* server (the default).
+#   'sqlite' - an embedded SQLite database at SQLITE_PATH in WAL mode, for single-node
+#              deployments: reads run in-process with no network round trip, readers never
+#              block the (single) writer, and every worker process opens the same file.
+#
+# The SQLite connection is wrapped so it behaves like MySQLdb's: the MySQL dialect the queries
+# are written in is translated on the fly (placeholders, CONCAT, TO_DAYS, upserts,
+# INSERT IGNORE, FOR UPDATE, inline KEY clauses, AUTO_INCREMENT, NOW() - INTERVAL, LIKE
+# escapes), DATE/TIME/TIMESTAMP columns come back as date/timedelta/datetime as they do from
+# MySQL, and a transaction is opened on the first write (or locking read) and ends with
+# commit() or rollback(). acquire_lock / release_lock give both backends a named advisory lock
+# shared across worker processes.
+
+import datetime
+import functools
+import re
+import sqlite3
+
+try:
+    import fcntl
+except ImportError:  # Not on Windows, where SQLite's advisory locks are per process only
+    fcntl = None
+
+try:
+    import MySQLdb
+    import MySQLdb.cursors
+except ImportError:  # Only needed for the MySQL backend
+    MySQLdb = None
+
+if MySQLdb is not None:
+    DictCursor = MySQLdb.cursors.DictCursor
+    SSCursor = MySQLdb.cursors.SSCursor
+    SSDictCursor = MySQLdb.cursors.SSDictCursor
+else:
+    class DictCursor:
+        pass
+
+    class SSCursor:
+        pass
+
+    class SSDictCursor:
+        pass
+
+# Exceptions of either backend, for `except` clauses and isinstance checks
+DATABASE_ERRORS = (sqlite3.Error,) + ((MySQLdb.Error,) if MySQLdb is not None else ())
+OPERATIONAL_ERRORS = (sqlite3.OperationalError,) + ((MySQLdb.OperationalError,) if MySQLdb is not None else ())
+
+# Applied to every SQLite connection. WAL lets readers run alongside the writer, NORMAL
+# synchronous is durable across application crashes in WAL mode (a power cut can lose the
+# last commits but never corrupts the file), and busy_timeout makes a writer wait for the
+# write lock held by another worker instead of failing at once.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,  # milliseconds
+    'cache_size': -65536,  # KiB, i.e. 64 MiB of page cache per connection
+    'mmap_size': 268435456,  # read the first 256 MiB of the file through the page cache
+    'temp_store': 'MEMORY',
+    'foreign_keys': 'OFF',  # the MySQL schema declares none either
+}
+
+
+def configure(app):
+    app.config.setdefault('DATABASE_BACKEND', 'mysql')
+    app.config.setdefault('SQLITE_PATH', 'timetable_attendance.db')
+    app.config.setdefault('SQLITE_PRAGMAS', {})
+
+
+# Open a connection for the configured backend
+def connect(config):
+    backend = config['DATABASE_BACKEND']
+    if backend == 'sqlite':
+        return SQLiteConnection(config['SQLITE_PATH'], dict(SQLITE_PRAGMAS, **config['SQLITE_PRAGMAS']))
+    if backend != 'mysql':
+        raise ValueError(f"Unknown DATABASE_BACKEND {backend!r} (expected 'mysql' or 'sqlite')")
+    if MySQLdb is None:
+        raise RuntimeError("The MySQL backend needs the mysqlclient package")
+    kwargs = {
+        'host': config['MYSQL_HOST'],
+        'port': config['MYSQL_PORT'],
+        'charset': config['MYSQL_CHARSET'],
+        'connect_timeout': config['MYSQL_CONNECT_TIMEOUT'],
+    }
+    if config['MYSQL_USER']:
+        kwargs['user'] = config['MYSQL_USER']
+    if config['MYSQL_PASSWORD']:
+        kwargs['passwd'] = config['MYSQL_PASSWORD']
+    if config['MYSQL_DB']:
+        kwargs['db'] = config['MYSQL_DB']
+    return MySQLdb.connect(**kwargs)
+
+
+# 'mysql' or 'sqlite' for a connection or cursor (wrapped ones included)
+def dialect(obj):
+    return getattr(obj, 'dialect', 'mysql')
+
+
+# Take the advisory lock `name` without waiting and return whether it was taken. The lock is
+# shared by every process using the same database: MySQL's GET_LOCK belongs to the
+# connection's session (and is dropped with it if the process dies), SQLite's is an flock on a
+# file next to the database. Release it with release_lock on the same connection.
+def acquire_lock(connection, name):
+    if dialect(connection) == 'sqlite':
+        return connection.acquire_lock(name)
+    cur = connection.cursor()
+    try:
+        cur.execute("SELECT GET_LOCK(%s, 0)", (name,))
+        return cur.fetchone()[0] == 1
+    finally:
+        cur.close()
+
+
+def release_lock(connection, name):
+    if dialect(connection) == 'sqlite':
+        connection.release_lock(name)
+        return
+    cur = connection.cursor()
+    try:
+        cur.execute("SELECT RELEASE_LOCK(%s)", (name,))
+    finally:
+        cur.close()
+
+
+# -------------------- Types --------------------
+
+def _date(value):
+    return datetime.date.fromisoformat(value.decode()[:10])
+
+
+def _datetime(value):
+    return datetime.datetime.fromisoformat(value.decode())
+
+
+# TIME columns come back from MySQL as timedeltas
+def _time(value):
+    parts = [int(part) for part in value.decode().split(':')]
+    return datetime.timedelta(hours=parts[0], minutes=parts[1] if len(parts) > 1 else 0,
+                              seconds=parts[2] if len(parts) > 2 else 0)
+
+
+def _timedelta_text(value):
+    seconds = int(value.total_seconds())
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+# A value that does not parse (text typed into a DATE column by hand) is returned as stored
+def _lenient(convert):
+    def converter(value):
+        try:
+            return convert(value)
+        except ValueError:
+            return value.decode()
+    return converter
+
+
+sqlite3.register_converter('DATE', _lenient(_date))
+sqlite3.register_converter('DATETIME', _lenient(_datetime))
+sqlite3.register_converter('TIMESTAMP', _lenient(_datetime))
+sqlite3.register_converter('TIME', _lenient(_time))
+sqlite3.register_adapter(datetime.date, lambda value: value.isoformat())
+sqlite3.register_adapter(datetime.datetime, lambda value: value.isoformat(' '))
+sqlite3.register_adapter(datetime.timedelta, _timedelta_text)
+
+
+# -------------------- MySQL -> SQLite translation --------------------
+
+READ_STATEMENT = re.compile(r'^\s*(\(\s*)*(SELECT|WITH|EXPLAIN|PRAGMA)\b', re.I)
+FOR_UPDATE = re.compile(r'\s+FOR\s+UPDATE\s*$', re.I)
+ON_DUPLICATE = re.compile(r'\bON\s+DUPLICATE\s+KEY\s+UPDATE\b', re.I)
+INLINE_KEY = re.compile(r',\s*(UNIQUE\s+)?(?:KEY|INDEX)\s+(\w+)\s*\(([^)]*)\)', re.I)
+CREATE_TABLE = re.compile(r'^\s*CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)', re.I)
+INTERVAL = re.compile(r'\bNOW\(\)\s*-\s*INTERVAL\s+(%s|\d+)\s+(SECOND|MINUTE|HOUR|DAY)\b', re.I)
+LIKE_PARAMETER = re.compile(r'\bLIKE\s+%s(?!\s+ESCAPE)', re.I)
+
+
+# Split the argument list starting at sql[start] (just past an opening parenthesis) on its
+# top-level commas. Returns (arguments, index just past the closing parenthesis).
+def _arguments(sql, start):
+    args, depth, quote, begin = [], 0, None, start
+    for i in range(start, len(sql)):
+        ch = sql[i]
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in ("'", '"'):
+            quote = ch
+        elif ch == '(':
+            depth += 1
+        elif ch == ')':
+            if depth == 0:
+                args.append(sql[begin:i].strip())
+                return args, i + 1
+            depth -= 1
+        elif ch == ',' and depth == 0:
+            args.append(sql[begin:i].strip())
+            begin = i + 1
+    raise ValueError(f"Unbalanced parentheses in {sql!r}")
+
+
+# Replace every call of the MySQL function `name` with build(arguments)
+def _rewrite_calls(sql, name, build):
+    while True:
+        match = re.search(rf'\b{name}\s*\(', sql, re.I)
+        if match is None:
+            return sql
+        args, end = _arguments(sql, match.end())
+        sql = sql[:match.start()] + build(args) + sql[end:]
+
+
+FUNCTIONS = {
+    'CONCAT': lambda args: "(" + " || ".join(args) + ")",
+    'TO_DAYS': lambda args: f"CAST(julianday({args[0]}) - 1721059.5 AS INTEGER)",  # days since year 0
+}
+
+
+# Returns (statements, writes): the SQLite statements for one MySQL statement (CREATE TABLE
+# with inline KEY clauses becomes the table plus its indexes) and whether it must run in a
+# write transaction
+@functools.lru_cache(maxsize=1024)
+def translate(sql):
+    writes = READ_STATEMENT.match(sql) is None
+    if FOR_UPDATE.search(sql):
+        sql = FOR_UPDATE.sub('', sql)
+        writes = True  # take the write lock before reading, as the row lock would
+    match = ON_DUPLICATE.search(sql)
+    if match:
+        sql = sql[:match.start()] + "ON CONFLICT DO UPDATE SET" + re.sub(
+            r'\bVALUES\((\w+)\)', r'excluded.\1', sql[match.end():], flags=re.I)
+    sql = re.sub(r'\bINSERT\s+IGNORE\b', 'INSERT OR IGNORE', sql, flags=re.I)
+    sql = INTERVAL.sub(lambda m: f"datetime('now', '-' || {m.group(1)} || ' {m.group(2).lower()}s')", sql)
+    # MySQL escapes LIKE wildcards with a backslash by default, SQLite only when told to
+    sql = LIKE_PARAMETER.sub(r"LIKE %s ESCAPE '\\'", sql)
+    for name, build in FUNCTIONS.items():
+        sql = _rewrite_calls(sql, name, build)
+    statements = []
+    table = CREATE_TABLE.match(sql)
+    if table:
+        sql = re.sub(r'\b(?:BIG)?INT\s+AUTO_INCREMENT\s+PRIMARY\s+KEY\b', 'INTEGER PRIMARY KEY AUTOINCREMENT', sql, flags=re.I)
+        for unique, name, columns in INLINE_KEY.findall(sql):
+            kind = "UNIQUE INDEX" if unique else "INDEX"
+            statements.append(f"CREATE {kind} IF NOT EXISTS {name} ON {table.group(1)} ({columns})")
+        sql = INLINE_KEY.sub('', sql)
+    return (sql.replace('%s', '?'),) + tuple(statements), writes
+
+
+# -------------------- SQLite connection --------------------
+
+class SQLiteCursor:
+    dialect = 'sqlite'
+
+    def __init__(self, connection, dict_rows):
+        self._connection = connection
+        self._cursor = connection.raw.cursor()
+        self._dict_rows = dict_rows
+        self._columns = None
+        self.rowcount = -1
+        self.lastrowid = None
+
+    def _begin(self, writes):
+        if writes and not self._connection.raw.in_transaction:
+            self._cursor.execute("BEGIN IMMEDIATE")
+
+    def execute(self, query, args=None):
+        statements, writes = translate(query)
+        self._begin(writes)
+        self._cursor.execute(statements[0], tuple(args) if args is not None else ())
+        for statement in statements[1:]:
+            self._connection.raw.execute(statement)
+        return self._done()
+
+    def executemany(self, query, args):
+        statements, writes = translate(query)
+        self._begin(writes)
+        self._cursor.executemany(statements[0], [tuple(row) for row in args])
+        return self._done()
+
+    def _done(self):
+        description = self._cursor.description
+        self._columns = [column[0] for column in description] if description else None
+        self.rowcount = self._cursor.rowcount
+        self.lastrowid = self._cursor.lastrowid
+        return self.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def _row(self, row):
+        if row is None or not self._dict_rows:
+            return row
+        return dict(zip(self._columns, row))
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchmany(self, size=1):
+        return tuple(self._row(row) for row in self._cursor.fetchmany(size))
+
+    def fetchall(self):
+        return tuple(self._row(row) for row in self._cursor.fetchall())
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    dialect = 'sqlite'
+
+    def __init__(self, path, pragmas):
+        self.path = path
+        self.locks = {}  # advisory lock name -> open lock file
+        # Autocommit at the sqlite3 level; SQLiteCursor opens transactions itself
+        self.raw = sqlite3.connect(path, isolation_level=None, check_same_thread=False,
+                                   detect_types=sqlite3.PARSE_DECLTYPES)
+        for name, value in pragmas.items():
+            self.raw.execute(f"PRAGMA {name} = {value}")
+
+    # Cursor classes are MySQLdb's: DictCursor and SSDictCursor (and subclasses) return dicts,
+    # anything else tuples. SQLite cursors always stream, so the SS ones need nothing special.
+    def cursor(self, cursorclass=None):
+        return SQLiteCursor(self, cursorclass is not None and issubclass(cursorclass, (DictCursor, SSDictCursor)))
+
+    def commit(self):
+        if self.raw.in_transaction:
+            self.raw.execute("COMMIT")
+
+    def rollback(self):
+        if self.raw.in_transaction:
+            self.raw.execute("ROLLBACK")
+
+    def ping(self, *args):
+        self.raw.execute("SELECT 1")
+
+    def acquire_lock(self, name):
+        if name in self.locks:
+            return False
+        lock_file = open(f"{self.path}.{name}.lock", 'a')
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+        self.locks[name] = lock_file
+        return True
+
+    def release_lock(self, name):
+        lock_file = self.locks.pop(name, None)
+        if lock_file is not None:
+            lock_file.close()  # closing the file drops the flock
+
+    def close(self):
+        for name in list(self.locks):
+            self.release_lock(name)
+        try:
+            self.raw.execute("PRAGMA optimize")  # refresh planner statistics where they are stale
+        finally:
+            self.raw.close()
@@ -0,0 +1,62 @@
+# Per-table version counters for conditional GETs.
+#
+# table_versions holds a version number per table. A page's ETag is derived from the versions
+# of the tables it reads, fetched with one primary-key query, so a client holding the current
+# ETag can be answered with 304 before the page's own queries run - whichever worker process
+# made the last write. The ETag also includes the current time bucket, which bounds how long a
+# page changed outside the app (by hand, in the database) can be reported unchanged.
+#
+# Writes bump the versions after they commit (tables_changed in app.py), once per request and
+# in a transaction of their own, so a table's version row is only locked for the bump itself
+# rather than for the whole write: concurrent writers of a table don't queue on it. Until the
+# bump lands, a reader can still be answered 304 for a change that has just committed, as if
+# it had asked a moment earlier; should the process die in between, the time bucket bounds
+# how long that lasts.
+
+import hashlib
+import time
+
+TABLE_VERSIONS_DDL = """
+    CREATE TABLE IF NOT EXISTS table_versions (
+        TableName VARCHAR(64) PRIMARY KEY,
+        Version BIGINT NOT NULL DEFAULT 0
+    )
+"""
+
+
+class TableVersions:
+    def __init__(self, bucket_seconds):
+        self.bucket_seconds = bucket_seconds
+
+    # Bump the version of each of `tables` in a transaction of its own on `connection`: call it
+    # once the write has committed
+    def bump(self, connection, tables):
+        cur = connection.cursor()
+        try:
+            cur.executemany("""
+                INSERT INTO table_versions (TableName, Version) VALUES (%s, 1)
+                ON DUPLICATE KEY UPDATE Version = Version + 1
+            """, [(table,) for table in sorted(set(tables))])
+            connection.commit()
+        finally:
+            cur.close()
+
+    # Committed version of each of `tables` (0 for a table never written)
+    def versions(self, connection, tables):
+        tables = sorted(set(tables))
+        cur = connection.cursor()
+        try:
+            cur.execute(f"SELECT TableName, Version FROM table_versions WHERE TableName IN ({', '.join(['%s'] * len(tables))})",
+                        tuple(tables))
+            found = dict(cur.fetchall())
+        finally:
+            cur.close()
+        return {table: found.get(table, 0) for table in tables}
+
+    # ETag value for a page reading `tables`; `extra` covers whatever else the page depends
+    # on (its path and query string)
+    def etag(self, connection, tables, extra=""):
+        bucket = int(time.time() // self.bucket_seconds) if self.bucket_seconds else 0
+        versions = ",".join(f"{table}:{version}" for table, version in self.versions(connection, tables).items())
+        key = f"{bucket}|{versions}|{extra}"
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
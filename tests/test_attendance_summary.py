@@ -0,0 +1,110 @@
+# Attendance summary totals stay on the summary row a mark was counted under, whatever
+# happens to the student's enrollments afterwards. Runs on the SQLite backend:
+#
+#   python -m pytest tests
+
+import os
+import shutil
+import tempfile
+import unittest
+
+os.environ.setdefault('DATABASE_BACKEND', 'sqlite')
+
+import attendance_summary  # noqa: E402
+import migrations  # noqa: E402
+from app import app, mysql  # noqa: E402
+
+
+class AttendanceSummaryTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        app.config.update(TESTING=True, DATABASE_BACKEND='sqlite',
+                          SQLITE_PATH=os.path.join(self.directory, 'test.db'))
+        self.client = app.test_client()
+        with app.app_context():
+            migrations.migrate(mysql.connection, log=lambda *args: None)
+            cur = mysql.connection.cursor()
+            cur.execute("INSERT INTO departments (DepartmentName) VALUES ('Physics')")
+            cur.execute("INSERT INTO students (FirstName, LastName, EnrollmentNo, Email, DepartmentID) VALUES ('Ada', 'L', 'P-1', 'a@x', 1)")
+            self.student_id = cur.lastrowid
+            cur.execute("INSERT INTO courses (CourseName, DepartmentID) VALUES ('Optics', 1)")
+            self.course_id = cur.lastrowid
+            cur.execute("INSERT INTO semesters (SemesterName) VALUES ('Fall')")
+            self.fall = cur.lastrowid
+            cur.execute("INSERT INTO semesters (SemesterName) VALUES ('Spring')")
+            self.spring = cur.lastrowid
+            mysql.connection.commit()
+            cur.close()
+
+    def tearDown(self):
+        mysql.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def enroll(self, semester_id):
+        response = self.client.post('/enrolled_students/add', data={
+            'StudentID': self.student_id, 'CourseID': self.course_id, 'SemesterID': semester_id})
+        self.assertEqual(response.status_code, 302)
+
+    def mark(self, date, present):
+        data = {'StudentID': self.student_id, 'CourseID': self.course_id, 'AttendanceDate': date}
+        if present:
+            data['AttendanceStatus'] = 'on'
+        self.assertEqual(self.client.post('/attendance/add', data=data).status_code, 302)
+        with app.app_context():
+            cur = mysql.connection.cursor()
+            cur.execute("SELECT MAX(AttendanceID) FROM attendance")
+            return cur.fetchone()[0]
+
+    def summary(self):
+        with app.app_context():
+            cur = mysql.connection.cursor()
+            cur.execute("""
+                SELECT SemesterID, PresentCount, AbsentCount FROM attendance_summary
+                WHERE PresentCount <> 0 OR AbsentCount <> 0
+                ORDER BY SemesterID
+            """)
+            return [tuple(row) for row in cur.fetchall()]
+
+    def rebuilt(self):
+        with app.app_context():
+            attendance_summary.rebuild(mysql.connection)
+        return self.summary()
+
+    def test_deleting_an_old_mark_after_enrolling_in_a_new_semester(self):
+        self.enroll(self.fall)
+        old_mark = self.mark('2031-01-06', present=True)
+        self.mark('2031-01-07', present=False)
+        self.enroll(self.spring)
+        self.mark('2031-05-05', present=True)
+        self.assertEqual(self.summary(), [(self.fall, 1, 1), (self.spring, 1, 0)])
+
+        response = self.client.post(f'/attendance/delete/{old_mark}')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.summary(), [(self.fall, 0, 1), (self.spring, 1, 0)])
+        self.assertEqual(self.summary(), self.rebuilt())
+
+    def test_updating_an_old_mark_keeps_its_semester(self):
+        self.enroll(self.fall)
+        old_mark = self.mark('2031-01-06', present=True)
+        self.enroll(self.spring)
+
+        response = self.client.post(f'/attendance/update/{old_mark}', data={
+            'StudentID': self.student_id, 'CourseID': self.course_id, 'AttendanceDate': '2031-01-06'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.summary(), [(self.fall, 0, 1)])
+        self.assertEqual(self.summary(), self.rebuilt())
+
+    def test_unenrolling_does_not_move_counted_marks(self):
+        self.enroll(self.fall)
+        self.mark('2031-01-06', present=True)
+        with app.app_context():
+            cur = mysql.connection.cursor()
+            cur.execute("SELECT EnrollmentID FROM enrolledstudents")
+            enrollment_id = cur.fetchone()[0]
+        self.assertEqual(self.client.post(f'/enrolled_students/delete/{enrollment_id}').status_code, 302)
+        self.assertEqual(self.summary(), [(self.fall, 1, 0)])
+        self.assertEqual(self.summary(), self.rebuilt())
+
+
+if __name__ == '__main__':
+    unittest.main()
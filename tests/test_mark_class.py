@@ -0,0 +1,87 @@
+# Marking a class writes only the submitted students' marks, and only the ones that change.
+# Runs on the SQLite backend:
+#
+#   python -m pytest tests
+
+import os
+import shutil
+import tempfile
+import unittest
+
+os.environ.setdefault('DATABASE_BACKEND', 'sqlite')
+
+import migrations  # noqa: E402
+from app import app, mysql  # noqa: E402
+
+
+class MarkClassTest(unittest.TestCase):
+    date = '2031-01-06'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        app.config.update(TESTING=True, DATABASE_BACKEND='sqlite',
+                          SQLITE_PATH=os.path.join(self.directory, 'test.db'))
+        self.client = app.test_client()
+        with app.app_context():
+            migrations.migrate(mysql.connection, log=lambda *args: None)
+            cur = mysql.connection.cursor()
+            cur.execute("INSERT INTO departments (DepartmentName) VALUES ('Physics')")
+            cur.execute("INSERT INTO courses (CourseName, DepartmentID) VALUES ('Optics', 1)")
+            self.course_id = cur.lastrowid
+            cur.execute("INSERT INTO semesters (SemesterName) VALUES ('Fall')")
+            semester_id = cur.lastrowid
+            self.student_ids = []
+            for number in range(3):
+                cur.execute("INSERT INTO students (FirstName, LastName, EnrollmentNo, Email, DepartmentID) VALUES (%s, 'L', %s, %s, 1)",
+                            (f"S{number}", f"P-{number}", f"s{number}@x"))
+                self.student_ids.append(str(cur.lastrowid))
+                cur.execute("INSERT INTO enrolledstudents (StudentID, CourseID, SemesterID) VALUES (%s, %s, %s)",
+                            (cur.lastrowid, self.course_id, semester_id))
+            mysql.connection.commit()
+            cur.close()
+
+    def tearDown(self):
+        mysql.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def mark_class(self, student_ids, present):
+        return self.client.post('/attendance/mark_class', data={
+            'CourseID': self.course_id, 'AttendanceDate': self.date,
+            'StudentID': student_ids, 'Present': present})
+
+    def marks(self):
+        with app.app_context():
+            cur = mysql.connection.cursor()
+            cur.execute("SELECT StudentID, AttendanceStatus FROM attendance ORDER BY StudentID")
+            return [(str(student_id), status) for student_id, status in cur.fetchall()]
+
+    def changes(self):
+        with app.app_context():
+            cur = mysql.connection.cursor()
+            cur.execute("SELECT COUNT(*) FROM change_log WHERE TableName = 'attendance'")
+            return cur.fetchone()[0]
+
+    def test_rejects_an_empty_roster(self):
+        self.assertEqual(self.mark_class([], []).status_code, 400)
+
+    def test_rejects_students_not_enrolled_in_the_course(self):
+        response = self.mark_class(self.student_ids + ['999999'], [])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.marks(), [])
+
+    def test_partial_roster_keeps_other_students_marks(self):
+        first, second, third = self.student_ids
+        self.assertEqual(self.mark_class(self.student_ids, [first]).status_code, 302)
+        self.assertEqual(self.mark_class([second], [second]).status_code, 302)
+        self.assertEqual(self.marks(), [(first, 'Present'), (second, 'Present'), (third, 'Absent')])
+
+    def test_unchanged_marks_are_not_rewritten(self):
+        first = self.student_ids[0]
+        self.assertEqual(self.mark_class(self.student_ids, [first]).status_code, 302)
+        changes = self.changes()
+        self.assertEqual(self.mark_class(self.student_ids, [first]).status_code, 302)
+        self.assertEqual(self.changes(), changes)
+
+
+if __name__ == '__main__':
+    unittest.main()
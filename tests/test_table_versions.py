@@ -0,0 +1,53 @@
+# Writes bump their tables' versions once they have committed, so a page's ETag changes with
+# them - including writes made by the attendance queue's flush, outside any request. Runs on
+# the SQLite backend:
+#
+#   python -m pytest tests
+
+import os
+import shutil
+import tempfile
+import unittest
+
+os.environ.setdefault('DATABASE_BACKEND', 'sqlite')
+
+import app as app_module  # noqa: E402
+import migrations  # noqa: E402
+from app import app, mysql  # noqa: E402
+from attendance_queue import new_mark  # noqa: E402
+
+
+class TableVersionsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        app.config.update(TESTING=True, DATABASE_BACKEND='sqlite',
+                          SQLITE_PATH=os.path.join(self.directory, 'test.db'))
+        self.client = app.test_client()
+        with app.app_context():
+            migrations.migrate(mysql.connection, log=lambda *args: None)
+
+    def tearDown(self):
+        mysql.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def versions(self, *tables):
+        with app.app_context():
+            return app_module.table_versions.versions(mysql.connection, tables)
+
+    def test_a_write_changes_the_etag(self):
+        etag = self.client.get('/departments').headers['ETag']
+        self.assertEqual(self.client.get('/departments', headers={'If-None-Match': etag}).status_code, 304)
+
+        self.assertEqual(self.client.post('/departments/add', data={'DepartmentName': 'Physics'}).status_code, 302)
+        response = self.client.get('/departments', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(self.versions('departments'), {'departments': 1})
+
+    def test_flushing_queued_marks_bumps_attendance(self):
+        app_module.flush_attendance_marks([new_mark('add', 1, 1, '2031-01-06', 'Present')])
+        self.assertEqual(self.versions('attendance'), {'attendance': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
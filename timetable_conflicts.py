@@ -0,0 +1,273 @@
+# In-memory interval index for timetable clash detection.
+#
+# Timetable slots are kept per day in sorted interval lists keyed by room and by teacher, so
+# "does this slot clash, and with what" is a couple of binary searches instead of a SQL scan
+# with OR conditions no index can serve. Slots that run past midnight are split into two
+# segments ([start, 24:00) and [00:00, end)) so every stored interval has start < end.
+#
+# Next to the interval lists, every room and teacher has an occupancy bitmap per day: a Python
+# int with one bit per SLOT_MINUTES slot, set where anything is on. They are kept up to date by
+# add()/remove(), so "which rooms are free" and "when are this room and this teacher both
+# free" are bitwise ANDs/ORs over a few ints with no SQL. A slot counts as busy if an entry
+# covers any part of it, so times off the slot grid are rounded outwards.
+
+import bisect
+import datetime
+import threading
+
+MINUTES_PER_DAY = 24 * 60
+
+# Minutes per bit of an occupancy bitmap
+SLOT_MINUTES = 5
+
+
+# Convert a TIME value (timedelta from MySQL, or "HH:MM[:SS]" from a form) to minutes past midnight
+def to_minutes(value):
+    if isinstance(value, datetime.timedelta):
+        return int(value.total_seconds() // 60) % MINUTES_PER_DAY
+    if isinstance(value, datetime.time):
+        return value.hour * 60 + value.minute
+    parts = str(value).strip().split(':')
+    return (int(parts[0]) * 60 + int(parts[1])) % MINUTES_PER_DAY
+
+
+# Like to_minutes, but "24:00" is the end of the day rather than midnight
+def to_minutes_of_day(value):
+    minutes = to_minutes(value)
+    return MINUTES_PER_DAY if minutes == 0 and str(value).strip().startswith('24') else minutes
+
+
+# Format minutes past midnight as HH:MM
+def format_minutes(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+# Split a slot into the non-wrapping segments it occupies
+def segments(start, end):
+    if start < end:
+        return [(start, end)]
+    if start > end:
+        # Crosses midnight
+        return [(start, MINUTES_PER_DAY), (0, end)]
+    return []
+
+
+# Bitmap of the slots touched by the non-wrapping interval [start, end)
+def span_mask(start, end):
+    first = start // SLOT_MINUTES
+    last = -(-end // SLOT_MINUTES)
+    return ((1 << (last - first)) - 1) << first if last > first else 0
+
+
+# Bitmap of the slots a slot touches (it may cross midnight)
+def slot_mask(start, end):
+    mask = 0
+    for seg_start, seg_end in segments(start, end):
+        mask |= span_mask(seg_start, seg_end)
+    return mask
+
+
+# (start, end) minutes of the runs of set bits in `bits` that last at least `minutes`
+def bit_runs(bits, minutes=SLOT_MINUTES):
+    runs = []
+    while bits:
+        low = bits & -bits
+        first = low.bit_length() - 1
+        carry = bits + low  # clears the lowest run and sets the bit just past it
+        last = (carry & -carry).bit_length() - 1
+        if (last - first) * SLOT_MINUTES >= minutes:
+            runs.append((first * SLOT_MINUTES, last * SLOT_MINUTES))
+        bits &= carry
+    return runs
+
+
+# Whether two slots overlap (either may cross midnight)
+def slots_overlap(start_a, end_a, start_b, end_b):
+    a = segments(to_minutes(start_a), to_minutes(end_a))
+    b = segments(to_minutes(start_b), to_minutes(end_b))
+    return any(sa < eb and sb < ea for sa, ea in a for sb, eb in b)
+
+
+def normalize_day(day):
+    return str(day).strip().lower()
+
+
+def normalize_room(room):
+    return str(room).strip().lower()
+
+
+# Sorted intervals for one room or teacher on one day
+class IntervalList:
+    def __init__(self):
+        self.items = []  # (start, end, timetable_id), sorted
+        self.longest = 0
+
+    def add(self, start, end, timetable_id):
+        bisect.insort(self.items, (start, end, timetable_id))
+        self.longest = max(self.longest, end - start)
+
+    def remove(self, start, end, timetable_id):
+        i = bisect.bisect_left(self.items, (start, end, timetable_id))
+        if i < len(self.items) and self.items[i] == (start, end, timetable_id):
+            del self.items[i]
+
+    # IDs of intervals overlapping [start, end). Only intervals that start after
+    # start - longest can reach into the query, so two bisects bound the scan.
+    def overlapping(self, start, end):
+        lo = bisect.bisect_right(self.items, (start - self.longest, MINUTES_PER_DAY + 1))
+        hi = bisect.bisect_left(self.items, (end, -1))
+        return [item[2] for item in self.items[lo:hi] if item[1] > start]
+
+
+# Conflict index over a set of timetable entries (dicts shaped like rows of `timetables`)
+class TimetableIndex:
+    def __init__(self, entries=()):
+        self._lists = {}  # (day, 'room' | 'teacher', key) -> IntervalList
+        self._entries = {}  # TimetableID -> entry
+        self._occupancy = {}  # (day, 'room' | 'teacher') -> {key: bitmap of busy slots}
+        self._rooms = {}  # normalized room -> [room as first written, entries in it]
+        self._room_order = None  # (normalized room, room) sorted by name, built on demand
+        self._lock = threading.Lock()
+        for entry in entries:
+            self.add(entry)
+
+    def __len__(self):
+        return len(self._entries)
+
+    # Index keys an entry lives under: its room and its teacher on its day
+    def _keys(self, entry):
+        day = normalize_day(entry['DayOfWeek'])
+        return [(day, 'room', normalize_room(entry['RoomNumber'])),
+                (day, 'teacher', str(entry['TaughtBy']))]
+
+    def add(self, entry):
+        start, end = to_minutes(entry['StartTime']), to_minutes(entry['EndTime'])
+        mask = slot_mask(start, end)
+        with self._lock:
+            self._entries[entry['TimetableID']] = entry
+            for key in self._keys(entry):
+                intervals = self._lists.setdefault(key, IntervalList())
+                for seg_start, seg_end in segments(start, end):
+                    intervals.add(seg_start, seg_end, entry['TimetableID'])
+                bitmaps = self._occupancy.setdefault(key[:2], {})
+                bitmaps[key[2]] = bitmaps.get(key[2], 0) | mask
+            room_key = normalize_room(entry['RoomNumber'])
+            if room_key not in self._rooms:
+                self._rooms[room_key] = [str(entry['RoomNumber']).strip(), 0]
+                self._room_order = None
+            self._rooms[room_key][1] += 1
+
+    def remove(self, timetable_id):
+        with self._lock:
+            entry = self._entries.pop(timetable_id, None)
+            if entry is None:
+                return
+            start, end = to_minutes(entry['StartTime']), to_minutes(entry['EndTime'])
+            for key in self._keys(entry):
+                intervals = self._lists.get(key)
+                if intervals is None:
+                    continue
+                for seg_start, seg_end in segments(start, end):
+                    intervals.remove(seg_start, seg_end, timetable_id)
+                bitmaps = self._occupancy[key[:2]]
+                if not intervals.items:
+                    del self._lists[key]
+                    del bitmaps[key[2]]
+                else:
+                    # Other entries may cover the same slots (clashes entered before the check)
+                    mask = 0
+                    for seg_start, seg_end, _ in intervals.items:
+                        mask |= span_mask(seg_start, seg_end)
+                    bitmaps[key[2]] = mask
+            room_key = normalize_room(entry['RoomNumber'])
+            self._rooms[room_key][1] -= 1
+            if not self._rooms[room_key][1]:
+                del self._rooms[room_key]
+                self._room_order = None
+
+    # Every indexed entry clashing with the slot, as (reason, entry) pairs where reason is
+    # 'room' or 'teacher'. `exclude_id` skips the entry being updated.
+    def conflicts(self, day, start_time, end_time, room, teacher, exclude_id=None):
+        start, end = to_minutes(start_time), to_minutes(end_time)
+        probe = {'DayOfWeek': day, 'RoomNumber': room, 'TaughtBy': teacher}
+        found = []
+        with self._lock:
+            for key in self._keys(probe):
+                intervals = self._lists.get(key)
+                if intervals is None:
+                    continue
+                ids = set()
+                for seg_start, seg_end in segments(start, end):
+                    ids.update(intervals.overlapping(seg_start, seg_end))
+                ids.discard(exclude_id)
+                found.extend((key[1], self._entries[i]) for i in sorted(ids, key=str))
+        return found
+
+    # Whether a room ('room') or teacher ('teacher') has anything on during the slot
+    def busy(self, kind, key, day, start_time, end_time):
+        key = (normalize_day(day), kind, normalize_room(key) if kind == 'room' else str(key))
+        with self._lock:
+            intervals = self._lists.get(key)
+            if intervals is None:
+                return False
+            start, end = to_minutes(start_time), to_minutes(end_time)
+            return any(intervals.overlapping(seg_start, seg_end) for seg_start, seg_end in segments(start, end))
+
+    def _sorted_rooms(self):
+        if self._room_order is None:
+            self._room_order = sorted(((room, name) for room, (name, _) in self._rooms.items()),
+                                      key=lambda item: item[1].lower())
+        return self._room_order
+
+    # Every room that appears in the timetable, sorted
+    def rooms(self):
+        with self._lock:
+            return [name for _, name in self._sorted_rooms()]
+
+    # Rooms of the timetable with nothing on at any point of the slot on `day`, sorted
+    def free_rooms(self, day, start_time, end_time):
+        mask = slot_mask(to_minutes(start_time), to_minutes(end_time))
+        with self._lock:
+            bitmaps = self._occupancy.get((normalize_day(day), 'room'), {})
+            return [name for room, name in self._sorted_rooms() if not bitmaps.get(room, 0) & mask]
+
+    # Periods of at least `minutes` between `from_time` and `to_time` on `day` when all the
+    # given rooms and teachers are free: list of (start, end) minutes, on the slot grid
+    def free_periods(self, day, rooms=(), teachers=(), minutes=SLOT_MINUTES, from_time='00:00', to_time='24:00'):
+        day = normalize_day(day)
+        with self._lock:
+            room_bitmaps = self._occupancy.get((day, 'room'), {})
+            teacher_bitmaps = self._occupancy.get((day, 'teacher'), {})
+            busy = 0
+            for room in rooms:
+                busy |= room_bitmaps.get(normalize_room(room), 0)
+            for teacher in teachers:
+                busy |= teacher_bitmaps.get(str(teacher), 0)
+        # Only slots that lie wholly inside the window
+        first = -(-to_minutes_of_day(from_time) // SLOT_MINUTES)
+        last = to_minutes_of_day(to_time) // SLOT_MINUTES
+        window = ((1 << (last - first)) - 1) << first if last > first else 0
+        return bit_runs(window & ~busy, minutes)
+
+    # Validate a whole proposed timetable in one pass. Each proposed entry is checked against
+    # the indexed timetable and against the proposed entries before it; every clash is
+    # returned as (position, reason, clashing entry, clashing position or None).
+    def validate(self, proposed):
+        scratch = TimetableIndex()
+        problems = []
+        for position, entry in enumerate(proposed):
+            args = (entry['DayOfWeek'], entry['StartTime'], entry['EndTime'], entry['RoomNumber'], entry['TaughtBy'])
+            for reason, other in self.conflicts(*args, exclude_id=entry.get('TimetableID')):
+                problems.append((position, reason, other, None))
+            for reason, other in scratch.conflicts(*args):
+                problems.append((position, reason, other, other['TimetableID'][1]))
+            scratch.add(dict(entry, TimetableID=('proposed', position)))
+        return problems
+
+
+# Human readable description of a clash
+def describe_conflict(reason, entry):
+    slot = f"{entry['DayOfWeek']} {format_minutes(to_minutes(entry['StartTime']))}-{format_minutes(to_minutes(entry['EndTime']))}"
+    if reason == 'room':
+        return f"room {entry['RoomNumber']} is already booked on {slot}"
+    return f"teacher {entry['TaughtBy']} is already teaching on {slot}"
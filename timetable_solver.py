@@ -0,0 +1,207 @@
+# Automatic timetable generation.
+#
+# A course needs a number of weekly sessions, each filling one period, taught by its FacultyID
+# in one of the given rooms. The hard constraints are the ones add_timetable enforces: a room
+# and a teacher can each hold only one session at a time. Occupancy that must be kept (rows of
+# other departments, teacher unavailability) is passed in as blocked (room or teacher, slot)
+# pairs, which is also how a single teacher's sessions are re-solved without touching anything
+# else.
+#
+# Each search is a randomized greedy placement followed by a conflict-repair phase. Several
+# searches with different seeds run in parallel across CPU cores and the first complete
+# timetable wins; the others are told to stop through a shared event they poll. The search
+# processes are started fresh ('spawn') rather than forked, so they never inherit the calling
+# web worker's threads, held locks or open database connections.
+
+import math
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+# Seconds the parallel search may run before the best partial result is returned
+DEFAULT_TIME_LIMIT = 50
+
+
+# Everything a search needs. Slots are (day index, period index) pairs.
+#   sections         - list of (CourseID, FacultyID, sessions per week)
+#   rooms            - room numbers
+#   days             - day names
+#   periods          - (start, end) times, e.g. ("08:00", "09:00")
+#   blocked_rooms    - set of (room, slot) already taken
+#   blocked_teachers - set of (FacultyID, slot) already taken or unavailable
+class TimetableProblem:
+    def __init__(self, sections, rooms, days, periods, blocked_rooms=(), blocked_teachers=()):
+        self.sections = list(sections)
+        self.rooms = list(rooms)
+        self.days = list(days)
+        self.periods = list(periods)
+        self.blocked_rooms = set(blocked_rooms)
+        self.blocked_teachers = set(blocked_teachers)
+        self.slots = [(d, p) for d in range(len(self.days)) for p in range(len(self.periods))]
+        # One entry per session to place: (CourseID, FacultyID)
+        self.sessions = [(course_id, teacher_id)
+                         for course_id, teacher_id, count in self.sections
+                         for _ in range(count)]
+
+
+# Outcome of a search: session index -> (slot, room), plus the sessions that could not be placed
+class TimetableSolution:
+    def __init__(self, problem, placement):
+        self.placement = placement
+        self.unplaced = [i for i in range(len(problem.sessions)) if i not in placement]
+
+    @property
+    def complete(self):
+        return not self.unplaced
+
+    # Rows ready for the timetables table
+    def rows(self, problem):
+        rows = []
+        for i, (slot, room) in sorted(self.placement.items()):
+            course_id, teacher_id = problem.sessions[i]
+            start, end = problem.periods[slot[1]]
+            rows.append((course_id, problem.days[slot[0]], start, end, room, teacher_id))
+        return rows
+
+
+# Number of weekly sessions needed for `hours` of teaching in periods of `period_minutes`
+def sessions_for_hours(hours, period_minutes):
+    return max(1, math.ceil(hours * 60 / period_minutes))
+
+
+# One randomized search; returns a TimetableSolution (possibly incomplete). Gives up at
+# `deadline` (time.monotonic()) or once `stop` (an Event) is set.
+def solve(problem, seed=0, deadline=None, max_steps=200000, stop=None):
+    rng = random.Random(seed)
+    room_busy = {}  # (room, slot) -> session
+    teacher_busy = {}  # (teacher, slot) -> session
+    course_days = {}  # (course, day) -> sessions of that course on that day
+    placement = {}
+
+    def place(i, slot, room):
+        course_id, teacher_id = problem.sessions[i]
+        placement[i] = (slot, room)
+        room_busy[(room, slot)] = i
+        teacher_busy[(teacher_id, slot)] = i
+        course_days[(course_id, slot[0])] = course_days.get((course_id, slot[0]), 0) + 1
+
+    def unplace(i):
+        course_id, teacher_id = problem.sessions[i]
+        slot, room = placement.pop(i)
+        del room_busy[(room, slot)]
+        del teacher_busy[(teacher_id, slot)]
+        course_days[(course_id, slot[0])] -= 1
+
+    # Slots a session's teacher can use at all
+    def teacher_slots(teacher_id):
+        return [slot for slot in problem.slots if (teacher_id, slot) not in problem.blocked_teachers]
+
+    # Busiest teachers first: they have the least freedom
+    load = {}
+    for _, teacher_id in problem.sessions:
+        load[teacher_id] = load.get(teacher_id, 0) + 1
+    order = list(range(len(problem.sessions)))
+    rng.shuffle(order)
+    order.sort(key=lambda i: -load[problem.sessions[i][1]])
+
+    # Greedy phase: best free (slot, room), spreading a course over different days
+    for i in order:
+        course_id, teacher_id = problem.sessions[i]
+        best = None
+        best_cost = None
+        for slot in teacher_slots(teacher_id):
+            if (teacher_id, slot) in teacher_busy:
+                continue
+            free_rooms = [r for r in problem.rooms
+                          if (r, slot) not in room_busy and (r, slot) not in problem.blocked_rooms]
+            if not free_rooms:
+                continue
+            cost = course_days.get((course_id, slot[0]), 0) * 10 + rng.random()
+            if best_cost is None or cost < best_cost:
+                best_cost = cost
+                best = (slot, rng.choice(free_rooms))
+        if best is not None:
+            place(i, *best)
+
+    # Repair phase: place an unplaced session where it evicts the fewest others
+    unplaced = [i for i in order if i not in placement]
+    tabu = {}
+    step = 0
+    while unplaced and step < max_steps:
+        if step % 100 == 0 and ((deadline is not None and time.monotonic() > deadline)
+                                or (stop is not None and stop.is_set())):
+            break
+        step += 1
+        i = unplaced.pop(rng.randrange(len(unplaced)))
+        course_id, teacher_id = problem.sessions[i]
+        best = None
+        best_cost = None
+        for slot in teacher_slots(teacher_id):
+            if tabu.get((i, slot), -1) > step:
+                continue
+            teacher_clash = teacher_busy.get((teacher_id, slot))
+            for room in problem.rooms:
+                if (room, slot) in problem.blocked_rooms:
+                    continue
+                evicted = {teacher_clash, room_busy.get((room, slot))} - {None}
+                cost = len(evicted) * 100 + course_days.get((course_id, slot[0]), 0) * 10 + rng.random()
+                if best_cost is None or cost < best_cost:
+                    best_cost = cost
+                    best = (slot, room, evicted)
+        if best is None:
+            # Teacher has no usable slot at all
+            continue
+        slot, room, evicted = best
+        for j in evicted:
+            unplace(j)
+            unplaced.append(j)
+            tabu[(j, slot)] = step + 10
+        place(i, slot, room)
+
+    return TimetableSolution(problem, placement)
+
+
+# Stop event of the solve_parallel call this pool process works for (set by _init_worker)
+_stop = None
+
+
+def _init_worker(stop):
+    global _stop
+    _stop = stop
+
+
+def _solve_worker(problem, seed, deadline_seconds):
+    return solve(problem, seed=seed, deadline=time.monotonic() + deadline_seconds, stop=_stop)
+
+
+# Run independent searches on `workers` cores (all by default) and return the first complete
+# timetable, or the best partial one when the time limit is reached - with every session
+# unplaced if no search finished at all.
+def solve_parallel(problem, workers=None, time_limit=DEFAULT_TIME_LIMIT):
+    workers = workers or os.cpu_count() or 1
+    started = time.monotonic()
+    best = None
+    context = multiprocessing.get_context('spawn')
+    stop = context.Event()
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker, initargs=(stop,))
+    try:
+        pending = {pool.submit(_solve_worker, problem, seed, time_limit) for seed in range(workers)}
+        while pending:
+            remaining = time_limit - (time.monotonic() - started)
+            done, pending = wait(pending, timeout=max(remaining, 0) + 1, return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                solution = future.result()
+                if best is None or len(solution.unplaced) < len(best.unplaced):
+                    best = solution
+            if best is not None and best.complete:
+                break
+    finally:
+        # Searches still running notice within a few hundred steps and return; waiting for them
+        # keeps the pool's processes inside the caller's limit on concurrent generations
+        stop.set()
+        pool.shutdown(wait=True, cancel_futures=True)
+    return best if best is not None else TimetableSolution(problem, {})